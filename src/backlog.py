@@ -0,0 +1,138 @@
+"""Backlog mode: extract invoices through the OpenAI Batch API.
+
+    python src/backlog.py prepare --max-results 500   # classify and queue requests
+    python src/backlog.py submit                      # upload and create batch jobs
+    python src/backlog.py wait                        # poll until batches finish
+    python src/backlog.py resume                      # push results to Notion/QuickBooks
+    python src/backlog.py run                         # all of the above
+
+Only invoices with a text PDF attachment are queued; everything else is
+left for the regular pipeline (python src/main.py). Every step can be
+re-run safely. Set OPENAI_BASE_URL to the local stand-in
+(services/openai_standin.py) to try the flow offline.
+"""
+
+import argparse
+
+from openai import OpenAI
+
+from main import push_draft
+from parsers.ai_parser import draft_from_payload, invoice_label_batch
+from parsers.pdf_parser import extract_text_from_pdf
+from parsers.rule_classifier import preclassify
+from services.attachment_store import attachments_for_message, persist_async, wait_for_writes
+from services.batch_backlog import (
+    download_results,
+    iter_results,
+    pdf_invoice_request,
+    queue_requests,
+    submit_pending,
+    wait_for_batches,
+)
+from services.outlook_service import fetch_messages_with_attachments, get_sender, label_message
+from services.quickbooks_service import QuickbooksInvoiceService
+from services.tracker import is_processed, mark_processed
+
+
+def prepare(client: OpenAI, max_results: int):
+    """Classify the backlog and queue a batch request per text-PDF invoice."""
+    customer_index = QuickbooksInvoiceService().get_customer_index()
+
+    messages = [message for message in fetch_messages_with_attachments(max_results=max_results) if not is_processed(message[0])]
+
+    labels = {}
+    to_classify = []
+    for message_id, subject, message_text, attachments in messages:
+        rule_match = preclassify(message_text, attachments, subject=subject, sender=get_sender(message_id))
+        if rule_match:
+            labels[message_id] = rule_match.label
+        else:
+            to_classify.append((message_id, message_text, attachments))
+    batch_labels = invoice_label_batch([(text, attachments) for _, text, attachments in to_classify], client=client)
+    for (message_id, _, _), label in zip(to_classify, batch_labels):
+        labels[message_id] = label
+
+    requests = []
+    for message_id, subject, message_text, attachments in messages:
+        if labels.get(message_id) != "invoice":
+            continue
+        stored_files = attachments_for_message(message_id)
+        if not stored_files or not stored_files[0].filename.lower().endswith(".pdf"):
+            continue
+        stored_attachment = stored_files[0]
+        text = stored_attachment.text
+        if text is None:
+            with stored_attachment.open() as stream:
+                text = extract_text_from_pdf(stream)
+        if not text or len(text.strip()) < 10:
+            continue
+
+        # resume runs in a later process, so the attachment must be on disk
+        persist_async(stored_attachment, message_id)
+        requests.append((
+            pdf_invoice_request(message_id, text, customer_index.context_for(f"{text}\n{message_text}")),
+            {"message_id": message_id, "subject": subject},
+        ))
+
+    wait_for_writes()
+    paths = queue_requests(requests)
+    print(f"Queued {len(requests)} invoice extractions in {len(paths)} batch files")
+
+
+def resume(client: OpenAI):
+    """Push every successful batch result through the normal invoice flow."""
+    print(f"Downloaded {len(download_results(client))} result files")
+    qb_service = None
+
+    def get_qb_service():
+        nonlocal qb_service
+        if qb_service is None:
+            qb_service = QuickbooksInvoiceService()
+        return qb_service
+
+    pushed = failed = 0
+    for meta, payload, error in iter_results():
+        message_id = meta["message_id"]
+        if is_processed(message_id):
+            continue
+        if payload is None:
+            print(f"{message_id}: batch extraction failed ({error}), leaving for the regular pipeline")
+            failed += 1
+            continue
+
+        stored_files = attachments_for_message(message_id)
+        stored_attachment = stored_files[0] if stored_files else None
+        draft = draft_from_payload(payload)
+        push_draft(draft, meta["subject"], message_id, stored_attachment, get_qb_service, prefix=f"{message_id}:")
+
+        try:
+            label_message(message_id, "invoice")
+        except Exception as e:
+            print(f"{message_id}: Failed to set Outlook category: {e}")
+        mark_processed(message_id)
+        pushed += 1
+
+    wait_for_writes()
+    print(f"Backlog resume: {pushed} invoices pushed, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process an invoice backlog with the OpenAI Batch API")
+    parser.add_argument("step", choices=["prepare", "submit", "wait", "resume", "run"])
+    parser.add_argument("--max-results", type=int, default=500)
+    args = parser.parse_args()
+
+    client = OpenAI()
+
+    if args.step in ("prepare", "run"):
+        prepare(client, args.max_results)
+    if args.step in ("submit", "run"):
+        print(f"Submitted batches: {submit_pending(client)}")
+    if args.step in ("wait", "run"):
+        print(f"Batch status: {wait_for_batches(client)}")
+    if args.step in ("resume", "run"):
+        resume(client)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Throughput benchmarks for main() on a recorded corpus.
+
+    python src/benchmark.py record                     # live run, captured to data/corpus/
+    python src/benchmark.py replay                     # offline, at the recorded latencies
+    python src/benchmark.py replay --speed 0           # no network waits: local work only
+    python src/benchmark.py replay --repeat 5 --save after.json --baseline before.json
+
+record is a normal run of main() - messages are labelled and pushed to
+Notion and QuickBooks - with every Graph, OpenAI, Notion and QuickBooks
+response written to the corpus (services/recorder.py). It starts from an
+empty LLM cache so every model call is made and recorded. Because the
+pushes are real, record refuses to run while they would reach the live
+Notion databases or QuickBooks company (see live_push_targets) unless
+--allow-live-pushes is given.
+
+replay runs main() against the corpus with no network access, in a
+temporary workspace that starts from the state the recording started
+from, so the same messages are processed. --speed scales the recorded
+latencies (2 = twice as fast). The report gives messages/sec, latency
+per stage, time spent on local work and peak memory; --save writes it
+as JSON and --baseline compares against an earlier one.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+import main
+from services import llm_cache, notion_service
+from services.recorder import (
+    CORPUS_DIR,
+    STATE_DIR,
+    Recorder,
+    Replayer,
+    StageTimer,
+    isolated_state,
+    load_corpus,
+    offline_auth,
+    save_corpus,
+    snapshot_state,
+    stage_summary,
+)
+from services.tracker import load_processed_ids
+
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1.0"))
+
+# Settings that end up in request URLs, recorded so replay builds the same ones
+REPLAY_ENV = ("OPENAI_BASE_URL", "ENVIRONMENT", "QB_REALM_ID")
+
+# Notion databases main() pushes to; any left unset default to the live ones
+NOTION_DB_SETTINGS = ("NOTION_INVOICE_DB_ID", "NOTION_SHIPPING_DB_ID", "NOTION_CLIENT_DB_ID")
+
+
+@dataclass
+class RunStats:
+    """Messages seen and processed by one main() run, and how long it took."""
+    fetched: int = 0
+    processed: int = 0
+    wall_seconds: float = 0.0
+
+
+def run_pipeline(verbose: bool = False) -> RunStats:
+    """Run main() once, counting the messages it fetches and processes"""
+    stats = RunStats()
+    fetch = main.fetch_messages_with_attachments
+
+    def counted(*args, **kwargs):
+        for message in fetch(*args, **kwargs):
+            stats.fetched += 1
+            yield message
+
+    before = load_processed_ids()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with patch.object(main, "fetch_messages_with_attachments", counted), output:
+        main.main()
+    stats.wall_seconds = time.perf_counter() - started
+    stats.processed = len(load_processed_ids() - before)
+    return stats
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def build_report(mode: str, runs: List[Tuple[RunStats, StageTimer]], **extra) -> dict:
+    """Totals over the runs: throughput, per-stage latency and local time"""
+    samples: Dict[str, List[float]] = defaultdict(list)
+    for _, timer in runs:
+        for stage, values in timer.samples.items():
+            samples[stage].extend(values)
+    wall = sum(stats.wall_seconds for stats, _ in runs)
+    network = sum(timer.busy_seconds() for _, timer in runs)
+    processed = sum(stats.processed for stats, _ in runs)
+    report = {
+        "mode": mode,
+        "runs": len(runs),
+        "messages": sum(stats.fetched for stats, _ in runs),
+        "processed": processed,
+        "wall_seconds": wall,
+        "messages_per_second": processed / wall if wall else 0.0,
+        "network_seconds": network,
+        "local_seconds": max(wall - network, 0.0),
+        "stages": stage_summary(samples),
+        "peak_rss_mb": peak_rss_mb(),
+        "python_peak_mb": None,
+    }
+    report.update(extra)
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['mode'].capitalize()}: {report['processed']} of {report['messages']} messages processed "
+        f"in {report['wall_seconds']:.2f}s over {report['runs']} run(s) - {report['messages_per_second']:.2f} messages/sec",
+        f"{'Stage':<12} {'calls':>6} {'total s':>9} {'p50 s':>8} {'p95 s':>8}",
+    ]
+    for stage, row in report["stages"].items():
+        lines.append(f"{stage:<12} {row['calls']:>6} {row['total']:>9.2f} {row['p50']:>8.3f} {row['p95']:>8.3f}")
+    lines.append(f"Waiting on the network {report['network_seconds']:.2f}s, local work {report['local_seconds']:.2f}s")
+    memory = f"Peak memory: {report['peak_rss_mb']:.0f} MB resident"
+    if report.get("python_peak_mb") is not None:
+        memory += f", {report['python_peak_mb']:.1f} MB Python heap"
+    lines.append(memory)
+    if "replay" in report:
+        counts = report["replay"]
+        lines.append(
+            f"Replayed {counts['exact']} exact, {counts['schema']} by schema, {counts['url']} by URL, "
+            f"{counts['missed']} not in the corpus"
+        )
+    return "\n".join(lines)
+
+
+def _change(before: Optional[float], after: Optional[float]) -> str:
+    if before is None or after is None:
+        return "n/a"
+    if before == 0:
+        return "new" if after else "0.0%"
+    return f"{(after - before) / before:+.1%}"
+
+
+def compare_reports(report: dict, baseline: dict) -> str:
+    """Side-by-side of the headline numbers, with the relative change"""
+    rows = [
+        ("messages/sec", "messages_per_second"),
+        ("wall s", "wall_seconds"),
+        ("local s", "local_seconds"),
+        ("peak MB", "peak_rss_mb"),
+    ]
+    lines = ["Compared with baseline:"]
+    for label, key in rows:
+        before, after = baseline.get(key), report.get(key)
+        lines.append(f"  {label:<20} {before or 0:>9.2f} -> {after or 0:>9.2f}  {_change(before, after)}")
+    for stage in sorted(set(report["stages"]) | set(baseline.get("stages", {}))):
+        for statistic in ("p50", "p95"):
+            before = baseline.get("stages", {}).get(stage, {}).get(statistic)
+            after = report["stages"].get(stage, {}).get(statistic)
+            lines.append(f"  {stage + ' ' + statistic + ' s':<20} {before or 0:>9.3f} -> {after or 0:>9.3f}  {_change(before, after)}")
+    for key in ("speed", "processed"):
+        if baseline.get(key) != report.get(key):
+            lines.append(f"  Note: {key} differs ({baseline.get(key)} in the baseline, {report.get(key)} now)")
+    return "\n".join(lines)
+
+
+def live_push_targets() -> List[str]:
+    """Live systems a recording would create pages and invoices in
+
+    Notion is off without an API key and counts as a sandbox when every
+    database ID is set explicitly; QuickBooks is off without a refresh
+    token and safe with ENVIRONMENT=sandbox.
+    """
+    targets = []
+    if notion_service.NOTION_API_KEY and not all(os.getenv(name) for name in NOTION_DB_SETTINGS):
+        targets.append(f"Notion: set {', '.join(NOTION_DB_SETTINGS)} to test databases, or unset NOTION_API_KEY")
+    if os.getenv("REFRESH_TOKEN") and os.getenv("ENVIRONMENT") != "sandbox":
+        targets.append("QuickBooks: set ENVIRONMENT=sandbox, or unset REFRESH_TOKEN")
+    return targets
+
+
+def record(corpus: Path, verbose: bool = False, allow_live_pushes: bool = False) -> dict:
+    """Run main() live and write every response it gets to corpus"""
+    live = live_push_targets()
+    if live and not allow_live_pushes:
+        raise RuntimeError("Recording would push real invoices and pages. " + "; ".join(live))
+    corpus = Path(corpus)
+    snapshot_state(corpus / STATE_DIR)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with patch.object(llm_cache, "CACHE_FILE", Path(cache_dir) / "llm_cache.sqlite3"), Recorder() as recorder:
+            stats = run_pipeline(verbose)
+    report = build_report("record", [(stats, recorder.timer)], corpus=str(corpus), recorded=len(recorder.interactions))
+    manifest = {
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {name: os.environ[name] for name in REPLAY_ENV if name in os.environ},
+        "interactions": dict(Counter(interaction.stage for interaction in recorder.interactions)),
+        "report": report,
+    }
+    save_corpus(corpus, recorder.interactions, manifest)
+    return report
+
+
+def replay(corpus: Path, speed: float = REPLAY_SPEED, repeat: int = 1, verbose: bool = False, trace_memory: bool = False) -> dict:
+    """Run main() repeat times against corpus, each in a fresh workspace"""
+    corpus = Path(corpus)
+    manifest, interactions = load_corpus(corpus)
+    environment = {"OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "replay"), **manifest.get("environment", {})}
+
+    runs = []
+    counts = Counter()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with patch.dict(os.environ, environment), offline_auth():
+            for _ in range(repeat):
+                with tempfile.TemporaryDirectory() as workspace, isolated_state(Path(workspace), corpus / STATE_DIR):
+                    with Replayer(interactions, speed=speed) as replayer:
+                        stats = run_pipeline(verbose)
+                runs.append((stats, replayer.timer))
+                counts.update(replayer.counts)
+        python_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    report = build_report("replay", runs, corpus=str(corpus), speed=speed, replay=dict(counts))
+    report["python_peak_mb"] = python_peak
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark main() on a recorded corpus")
+    parser.add_argument("step", choices=["record", "replay"])
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--speed", type=float, default=REPLAY_SPEED, help="replay latency scale; 0 skips network waits")
+    parser.add_argument("--repeat", type=int, default=1, help="replay runs, each from the recorded state")
+    parser.add_argument("--trace-memory", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--save", type=Path, help="write the report as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show main()'s own output")
+    parser.add_argument("--allow-live-pushes", action="store_true", help="record even though Notion/QuickBooks are the live ones")
+    args = parser.parse_args()
+
+    if args.step == "record":
+        try:
+            report = record(args.corpus, verbose=args.verbose, allow_live_pushes=args.allow_live_pushes)
+        except RuntimeError as e:
+            parser.error(str(e))
+        print(f"Recorded {report['recorded']} responses to {args.corpus}")
+    else:
+        report = replay(args.corpus, speed=args.speed, repeat=args.repeat, verbose=args.verbose, trace_memory=args.trace_memory)
+
+    print(format_report(report))
+    if args.baseline:
+        print(compare_reports(report, json.loads(args.baseline.read_text())))
+    if args.save:
+        args.save.write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"Report saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main_cli()
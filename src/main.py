@@ -4,19 +4,88 @@ import tempfile
 from pathlib import Path
 
 # Third-party imports
-from openai import OpenAI
-from pdf2image import convert_from_path
+from openai import OpenAI, OpenAIError
+from pdf2image import convert_from_bytes
 
 # QuickBooks imports
 from quickbooks.exceptions import QuickbooksException
 
 # Local imports
-from parsers.pdf_parser import extract_text_from_pdf
-from parsers.ai_parser import invoice_label, pdf_invoice, ai_invoice, parse_shipping, parse_client_communication
+from parsers.pdf_parser import extract_pages_from_pdf, extract_text_from_pdf, open_pdf
+from parsers.page_selection import select_text_pages
+from parsers.invoice_layout import compact_invoice_text
+from parsers.chunked_invoice import MAP_REDUCE_MIN_TOKENS, chunked_pdf_invoice
+from parsers.ai_parser import FUSED_EXTRACTION, PDF_INVOICE_MODEL, classify_and_extract, draft_from_payload, invoice_label_batch, pdf_invoice, ai_invoice, parse_shipping, parse_client_communication
 from services.quickbooks_service import QuickbooksInvoiceService
-from services.outlook_service import fetch_messages_with_attachments, label_message
+from parsers.rule_classifier import RuleStats, preclassify
+from parsers.shipping_extractor import extract_shipping
+from parsers.vendor_templates import TemplateStore
+from services.outlook_service import fetch_messages_with_attachments, label_message, get_sender
 from services.notion_service import push_invoice_to_notion, push_shipping_to_notion, push_client_comm_to_notion, query_invoice_by_number
 from services.tracker import is_processed, mark_processed
+from services.attachment_store import attachments_for_message, is_attachment_processed, mark_attachment_processed, persist_async, wait_for_writes
+from services.vision_files import cleanup_stale_uploads
+from services.llm_cache import LLMCache
+from services import llm_metrics, llm_resilience
+from utils.tokens import estimate_tokens
+
+
+def push_draft(draft, subject, message_id, stored_attachment, get_qb_service, prefix=""):
+    """Push an extracted invoice draft to Notion and QuickBooks."""
+    # Write the attachment in the background; QuickBooks waits for it below
+    persisted = persist_async(stored_attachment, message_id) if stored_attachment else None
+
+    print(f"{prefix} line items:")
+
+    for line in draft.line_items:
+        print("   ", line.model_dump())
+
+    # Verify total
+    calculated_total = draft.total_amount
+    if draft.total_amount is not None:
+        if abs(draft.total_amount - calculated_total) > 0.01:
+            print(f"{prefix} total mismatch (draft={draft.total_amount}, calculated={calculated_total})")
+    else:
+        draft.total_amount = calculated_total
+        print(draft.total_amount)
+
+    # Push to Notion Invoice Tracking (skip if duplicate)
+    if draft.invoice_number and query_invoice_by_number(draft.invoice_number):
+        print(f"{prefix} duplicate invoice #{draft.invoice_number}, skipping Notion")
+    else:
+        try:
+            file_url = f"http://45.55.121.238/attachments/{stored_attachment.relative_path}" if stored_attachment else ""
+            notion_page = push_invoice_to_notion(draft, subject, message_id, file_url)
+            print(f"{prefix} pushed to Notion Invoice Tracking")
+        except Exception as e:
+            print(f"{prefix} failed to push to Notion: {e}")
+
+    # Route to correct QuickBooks transaction type
+    try:
+        qb = get_qb_service()
+        if hasattr(draft, 'is_receipt') and draft.is_receipt:
+            print(f"{prefix} RECEIPT detected - creating Purchase (already paid)")
+            transaction = qb.push_receipt(draft)
+        else:
+            transaction = qb.push_invoice(draft)
+
+        if persisted:
+            print(f"Attaching file: {stored_attachment.filename}")
+            stored_file = persisted.result()
+            qb.add_attachment(str(stored_file.path), transaction, filename=stored_attachment.filename)
+
+        transaction_id = getattr(transaction, "Id", None)
+        if transaction_id:
+            print(f"{prefix} QuickBooks transaction created (Id={transaction_id})")
+        else:
+            print(f"{prefix} QuickBooks transaction created")
+    except Exception as e:
+        # Not marked processed, so a duplicate of this attachment gets another try
+        print(f"{prefix} QuickBooks SKIPPED - {e}")
+        return
+
+    if stored_attachment:
+        mark_attachment_processed(stored_attachment.digest)
 
 
 # Main Processing Function
@@ -24,22 +93,183 @@ def main():
     project_root = Path(__file__).parent.parent
     download_dir = project_root / "attachments"
     download_dir.mkdir(exist_ok=True)
-    openai_client = OpenAI()
+    # Retries, deadlines and hedging are handled by the call layer, not the SDK
+    openai_client = OpenAI(max_retries=0)
+    call_layer = llm_resilience.CallLayer(llm_resilience.RetryPolicy(
+        model_deadlines={PDF_INVOICE_MODEL: llm_resilience.LLM_STRONG_MODEL_DEADLINE},
+    ))
+    llm_resilience.activate(call_layer)
+    llm_cache = LLMCache()
+    metrics = llm_metrics.MetricsStore()
+    llm_metrics.activate(metrics)
+    rule_stats = RuleStats()
+    vendor_templates = TemplateStore()
 
     # Lazy-init QuickBooks (only needed for invoices)
     qb_service = None
-    customers_context = ""
+    customer_index = None
 
     def get_qb_service():
-        nonlocal qb_service, customers_context
+        nonlocal qb_service
         if qb_service is None:
             qb_service = QuickbooksInvoiceService()
-            print("Loading customer addresses for AI matching...")
-            customers_context = qb_service.get_customers_context()
         return qb_service
 
+    def get_customer_index():
+        nonlocal customer_index
+        if customer_index is None:
+            print("Loading customer addresses for AI matching...")
+            customer_index = get_qb_service().get_customer_index()
+        return customer_index
+
+    def customers_context_for(text):
+        """Candidate customers for a document (all customers if none match)."""
+        try:
+            return get_customer_index().context_for(text)
+        except Exception as e:
+            print(f"Customer matching unavailable: {e}")
+            return ""
+
+    def customer_for(text):
+        """The customer a document clearly belongs to, for drafts no model saw."""
+        try:
+            return get_customer_index().best_match(text)
+        except Exception as e:
+            print(f"Customer matching unavailable: {e}")
+            return None
+
+    def classify_with_document(message_id, subject, message_text, attachments):
+        """Fused mode: label and extract in one call for a text PDF or image attachment."""
+        stored_files = attachments_for_message(message_id)
+        if not stored_files or is_attachment_processed(stored_files[0].digest):
+            return None
+        document = stored_files[0]
+        name = document.filename.lower()
+        if name.endswith('.pdf'):
+            text = document.text
+            if text is None:
+                with document.open() as stream:
+                    text = extract_text_from_pdf(stream)
+            # Scanned PDFs still take the label-then-extract route
+            if text is None or len(text.strip()) < 10:
+                return None
+            return classify_and_extract(message_text, attachments, client=openai_client, document_text=text, customers_context=customers_context_for(f"{text}\n{message_text}"), cache=llm_cache)
+        if name.endswith(('.jpeg', '.jpg', '.png')):
+            return classify_and_extract(message_text, attachments, client=openai_client, image_data=document.read_bytes(), image_name=document.filename, customers_context=customers_context_for(f"{subject}\n{message_text}"), cache=llm_cache)
+        return None
+
+    def read_text_pdf(stored_attachment):
+        """(page texts, compact layout or None) of a PDF, from a single pdfplumber parse"""
+        with stored_attachment.open() as stream, open_pdf(stream) as pdf:
+            pages = extract_pages_from_pdf(pdf)
+            text = "\n".join(pages)
+            compact = None
+            if len(text.strip()) >= 10 and estimate_tokens(text) <= MAP_REDUCE_MIN_TOKENS:
+                compact = compact_invoice_text(pdf, pages)
+        return pages, compact
+
+    def extract_invoice_draft(stored_attachment, subject, message_text):
+        """Extract a draft from a message's PDF or image attachment, or None"""
+        draft = None
+        attachment_name = stored_attachment.filename.lower()
+
+        if attachment_name.endswith('.pdf'):
+            # Text was already extracted from memory while fetching
+            text = stored_attachment.text
+            layout = None
+            if text is None:
+                layout = read_text_pdf(stored_attachment)
+                text = "\n".join(layout[0])
+
+            if len(text.strip()) < 10:
+                # Image-based PDF - convert to images
+                print("PDF is image-based, converting to images")
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    images_from_path = convert_from_bytes(stored_attachment.read_bytes(), output_folder=temp_dir, fmt='jpg')
+
+                    # pdf2image zero-pads page numbers, so sorting keeps page order
+                    image_files = sorted(glob.glob(f"{temp_dir}/*.jpg"))
+
+                    if image_files:
+                        print(f"Processing as image ({len(image_files)} pages)")
+                        customers_context = customers_context_for(f"{subject}\n{message_text}")
+                        draft = ai_invoice(message_text, page_paths=image_files, client=openai_client, customers_context=customers_context, cache=llm_cache)
+            else:
+                # Text-based PDF
+                print("PDF has extractable text")
+                draft = vendor_templates.extract(text)
+                if draft:
+                    print(f"Extracted locally with the {draft.vendor_display_name} template")
+                    # Customers change from job to job, so templates do not learn them
+                    draft.customer_name = customer_for(f"{text}\n{message_text}")
+                else:
+                    customers_context = customers_context_for(f"{text}\n{message_text}")
+                    pages, compact = layout or read_text_pdf(stored_attachment)
+                    document_text = None
+                    if compact:
+                        # Send only the header, line-item tables and totals when they can be found
+                        print(f"Sending header, line items and totals: {compact.compact_tokens} of {compact.full_tokens} tokens ({compact.saved_share:.0%} saved)")
+                        document_text = compact.text
+                    elif estimate_tokens(text) <= MAP_REDUCE_MIN_TOKENS:
+                        # Otherwise send the pages most likely to hold the invoice, within the token budget
+                        selected = select_text_pages(pages)
+                        if selected is None:
+                            print("Line-item pages alone are over the page budget")
+                        elif len(selected) < len(pages):
+                            print(f"Sending pages {', '.join(str(position + 1) for position in selected)} of {len(pages)}")
+                            document_text = "\n".join(pages[position] for position in selected)
+                        else:
+                            document_text = text
+                    if document_text is None:
+                        # Too long for one request: extract the line items in chunks, in parallel
+                        print(f"Extracting {len(pages)} pages in chunks")
+                        model_draft = chunked_pdf_invoice(pages, client=openai_client, customers_context=customers_context, cache=llm_cache)
+                    else:
+                        model_draft = pdf_invoice(message_text, text=document_text, client=openai_client, customers_context=customers_context, cache=llm_cache)
+                    # Templates learn from model extractions only, never from their own output
+                    if model_draft:
+                        vendor_templates.learn(text, model_draft)
+                    draft = model_draft
+
+        elif attachment_name.endswith(('.jpeg', '.jpg', '.png')):
+            print('THIS IS A JPEG')
+            customers_context = customers_context_for(f"{subject}\n{message_text}")
+            draft = ai_invoice(message_text=message_text, image_data=stored_attachment.read_bytes(), image_name=stored_attachment.filename, client=openai_client, customers_context=customers_context, cache=llm_cache)
+
+        return draft
+
     messages = list(fetch_messages_with_attachments(max_results=10))
 
+    # Settle obvious messages locally; the rest are classified in batches
+    rule_matches = {}
+    fused = {}
+    to_classify = []
+    for message_id, subject, message_text, attachments in messages:
+        if is_processed(message_id):
+            continue
+        rule_match = preclassify(message_text, attachments, subject=subject, sender=get_sender(message_id))
+        rule_stats.record(rule_match)
+        if rule_match:
+            rule_matches[message_id] = rule_match
+            continue
+        if FUSED_EXTRACTION:
+            result = classify_with_document(message_id, subject, message_text, attachments)
+            if result is not None:
+                fused[message_id] = result
+                continue
+        to_classify.append((message_id, message_text, attachments))
+
+    labels = {message_id: match.label for message_id, match in rule_matches.items()}
+    labels.update({message_id: result.label for message_id, result in fused.items()})
+    if to_classify:
+        batch_labels = invoice_label_batch(
+            [(message_text, attachments) for _, message_text, attachments in to_classify],
+            client=openai_client,
+            cache=llm_cache,
+        )
+        for (message_id, _, _), label in zip(to_classify, batch_labels):
+            labels[message_id] = label
+
     # Process each message
     for idx, (message_id, subject, message_text, attachments) in enumerate(messages, start=1):
         if is_processed(message_id):
@@ -47,8 +277,13 @@ def main():
             continue
 
         draft = None
-        label = invoice_label(message_text, attachments, client=openai_client)
-        print(f"[{idx}/{len(messages)}] {message_id}: subject -> {subject} label -> {label}")
+        label = labels.get(message_id)
+        if message_id in rule_matches:
+            print(f"[{idx}/{len(messages)}] {message_id}: subject -> {subject} label -> {label} (rule: {rule_matches[message_id].reason})")
+        elif message_id in fused:
+            print(f"[{idx}/{len(messages)}] {message_id}: subject -> {subject} label -> {label} (labelled and extracted in one call)")
+        else:
+            print(f"[{idx}/{len(messages)}] {message_id}: subject -> {subject} label -> {label}")
 
         # Apply the label to the email in Outlook
         try:
@@ -57,20 +292,27 @@ def main():
         except Exception as e:
             print(f"[{idx}/{len(messages)}] {message_id}: Failed to set Outlook category: {e}")
 
-        project_root = Path(__file__).parent.parent
-        attachments_dir = project_root / "attachments"
-
-        # Get the actual attachment file for this email
-        latest_file = None
-        if attachments:
-            attachment_filename = attachments[0][0]
-            latest_file = str(attachments_dir / attachment_filename)
-
-
+        # Get the in-memory attachment for this email (written to disk only if needed)
+        stored_attachment = None
+        stored_files = attachments_for_message(message_id)
+        if stored_files:
+            stored_attachment = stored_files[0]
 
         if label == "shipping":
             print(f"[{idx}/{len(messages)}] {message_id}: parsing shipping data...")
-            shipping_data = parse_shipping(message_text, attachments, client=openai_client)
+            if message_id in fused:
+                shipping_data = fused[message_id].shipping
+            else:
+                local_shipping = extract_shipping(message_text, attachments, subject=subject, sender=get_sender(message_id))
+                if local_shipping.confident:
+                    print(f"[{idx}/{len(messages)}] {message_id}: shipping data read locally (confidence {local_shipping.confidence:.2f})")
+                    shipping_data = local_shipping.data
+                else:
+                    try:
+                        shipping_data = parse_shipping(message_text, attachments, client=openai_client, cache=llm_cache)
+                    except OpenAIError as e:
+                        print(f"[{idx}/{len(messages)}] {message_id}: shipping extraction failed, skipping: {e}")
+                        continue
             if shipping_data:
                 print(f"  Carrier: {shipping_data.carrier}")
                 print(f"  Tracking: {shipping_data.tracking_number}")
@@ -91,7 +333,14 @@ def main():
 
         if label == "client_communications":
             print(f"[{idx}/{len(messages)}] {message_id}: parsing client communication...")
-            client_data = parse_client_communication(message_text, attachments, client=openai_client)
+            if message_id in fused:
+                client_data = fused[message_id].client
+            else:
+                try:
+                    client_data = parse_client_communication(message_text, attachments, client=openai_client, cache=llm_cache)
+                except OpenAIError as e:
+                    print(f"[{idx}/{len(messages)}] {message_id}: client communication extraction failed, skipping: {e}")
+                    continue
             if client_data:
                 print(f"  Client: {client_data.client_name}")
                 print(f"  Project: {client_data.project_name}")
@@ -121,90 +370,53 @@ def main():
             mark_processed(message_id)
             continue
 
-        if label == "invoice" and latest_file:
-            print("starting ai_invoice process")
-            draft = None
-
-            if latest_file.lower().endswith('.pdf'):
-                path = Path(latest_file)
-                text = extract_text_from_pdf(path)
-
-                if text is None or len(text.strip()) < 10:
-                    # Image-based PDF - convert to images
-                    print("PDF is image-based, converting to images")
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        images_from_path = convert_from_path(latest_file, output_folder=temp_dir, fmt='jpg')
-
-                        image_files = glob.glob(f"{temp_dir}/*.jpg")
-                        first_image = image_files[0] if image_files else None
-
-                        if first_image:
-                            print("Processing as image")
-                            draft = ai_invoice(message_text, file_path=first_image, client=openai_client, customers_context=customers_context)
-                else:
-                    # Text-based PDF
-                    print("PDF has extractable text")
-                    draft = pdf_invoice(message_text, text=text, client=openai_client, customers_context=customers_context)
+        if label == "invoice" and stored_attachment and is_attachment_processed(stored_attachment.digest):
+            print(f"[{idx}/{len(messages)}] {message_id}: attachment {stored_attachment.filename} already processed from another email, skipping")
+            mark_processed(message_id)
+            continue
 
-            elif latest_file.endswith(('.jpeg', '.jpg', '.png')):
-                print('THIS IS A JPEG')
-                draft = ai_invoice(message_text=message_text, file_path=latest_file, client=openai_client, customers_context=customers_context)
+        if label == "invoice" and message_id in fused:
+            draft = draft_from_payload(fused[message_id].invoice)
+            print(f"Draft result: {draft}")
 
+        elif label == "invoice" and stored_attachment:
+            print("starting ai_invoice process")
+            try:
+                draft = extract_invoice_draft(stored_attachment, subject, message_text)
+            except OpenAIError as e:
+                # Retries and the deadline are spent; leave the message for the next run
+                print(f"[{idx}/{len(messages)}] {message_id}: invoice extraction failed, skipping: {e}")
+                continue
             print(f"Draft result: {draft}")
 
         # Push to QuickBooks if valid draft
         if draft:
-            print(f"[{idx}/{len(messages)}] {message_id}: line items:")
-
-            for line in draft.line_items:
-                print("   ", line.model_dump())
-
-            # Verify total
-            calculated_total = draft.total_amount
-            if draft.total_amount is not None:
-                if abs(draft.total_amount - calculated_total) > 0.01:
-                    print(f"[{idx}/{len(messages)}] {message_id}: total mismatch (draft={draft.total_amount}, calculated={calculated_total})")
-            else:
-                draft.total_amount = calculated_total
-                print(draft.total_amount)
-
-            # Push to Notion Invoice Tracking (skip if duplicate)
-            if draft.invoice_number and query_invoice_by_number(draft.invoice_number):
-                print(f"[{idx}/{len(messages)}] {message_id}: duplicate invoice #{draft.invoice_number}, skipping Notion")
-            else:
-                try:
-                    attachment_filename = attachments[0][0] if attachments else ""
-                    file_url = f"http://45.55.121.238/attachments/{attachment_filename}" if attachment_filename else ""
-                    notion_page = push_invoice_to_notion(draft, subject, message_id, file_url)
-                    print(f"[{idx}/{len(messages)}] {message_id}: pushed to Notion Invoice Tracking")
-                except Exception as e:
-                    print(f"[{idx}/{len(messages)}] {message_id}: failed to push to Notion: {e}")
-
-            # Route to correct QuickBooks transaction type
-            try:
-                qb = get_qb_service()
-                if hasattr(draft, 'is_receipt') and draft.is_receipt:
-                    print(f"[{idx}/{len(messages)}] {message_id}: RECEIPT detected - creating Purchase (already paid)")
-                    transaction = qb.push_receipt(draft)
-                else:
-                    transaction = qb.push_invoice(draft)
-
-                if latest_file:
-                    print(f"Attaching file: {latest_file}")
-                    qb.add_attachment(latest_file, transaction)
-
-                transaction_id = getattr(transaction, "Id", None)
-                if transaction_id:
-                    print(f"[{idx}/{len(messages)}] {message_id}: QuickBooks transaction created (Id={transaction_id})")
-                else:
-                    print(f"[{idx}/{len(messages)}] {message_id}: QuickBooks transaction created")
-            except Exception as e:
-                print(f"[{idx}/{len(messages)}] {message_id}: QuickBooks SKIPPED - {e}")
+            push_draft(draft, subject, message_id, stored_attachment, get_qb_service, prefix=f"[{idx}/{len(messages)}] {message_id}:")
         else:
             print(f"[{idx}/{len(messages)}] {message_id}: no valid invoice data found")
 
         mark_processed(message_id)
 
+    wait_for_writes()
+
+    print(rule_stats.summary())
+    print(f"LLM cache: {llm_cache.hits} hits, {llm_cache.misses} misses")
+    llm_cache.close()
+    print(llm_metrics.format_summary(metrics.summary()))
+    print(llm_resilience.format_stats(call_layer.stats))
+    call_layer.close()
+    llm_metrics.activate(None)
+    llm_resilience.activate(None)
+    metrics.close()
+
+    # Delete old vision uploads so they do not pile up in the Files API
+    try:
+        removed = cleanup_stale_uploads(openai_client)
+        if removed:
+            print(f"Removed {removed} stale vision uploads")
+    except Exception as e:
+        print(f"Failed to clean up vision uploads: {e}")
+
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Union
 
 
 class InvoiceLine(BaseModel):
@@ -43,6 +43,34 @@ class InvoiceData(BaseModel):
     customer_name: Optional[str] = None  # AI-matched customer name
 
 
+class InvoiceHeader(BaseModel):
+    """InvoiceData without the line items (chunked extraction)"""
+    vendor_display_name: str
+    memo: Optional[str] = None
+    tax: Optional[float] = None
+    total_amount: Optional[float] = None
+    due_date: Optional[str] = None
+    invoice_number: Optional[str] = None
+    invoice_date: Optional[str] = None
+    is_receipt: Optional[bool] = False
+    job_site_address: Optional[str] = None
+    customer_name: Optional[str] = None
+
+
+class InvoiceFix(BaseModel):
+    """Corrected values for the fields of an extraction that failed its checks"""
+    vendor_display_name: Optional[str] = None
+    line_items: Optional[List[InvoiceLine]] = None
+    tax: Optional[float] = None
+    total_amount: Optional[float] = None
+    due_date: Optional[str] = None
+    invoice_date: Optional[str] = None
+
+
+class LineItemChunk(BaseModel):
+    line_items: List[InvoiceLine]  # in document order
+
+
 class ShippingItem(BaseModel):
     description: str
     quantity: Optional[float] = None
@@ -77,3 +105,38 @@ class ClientData(BaseModel):
 
 class LabelSort(BaseModel):
     label: Literal["invoice", "shipping", "insurance", "client_communications", "none"]
+
+
+class EmailLabel(LabelSort):
+    email: int  # the N of the "=== Email N ===" header this label answers
+
+
+class LabelBatch(BaseModel):
+    labels: List[EmailLabel]  # one per email
+
+
+# Fused classify-and-extract output: the label plus, for labels that have
+# one, the extracted payload. Structured outputs accept anyOf but not
+# oneOf, so the union carries no pydantic discriminator; each member's
+# Literal label keeps it unambiguous.
+class InvoiceResult(BaseModel):
+    label: Literal["invoice"]
+    invoice: InvoiceData
+
+
+class ShippingResult(BaseModel):
+    label: Literal["shipping"]
+    shipping: ShippingData
+
+
+class ClientResult(BaseModel):
+    label: Literal["client_communications"]
+    client: ClientData
+
+
+class OtherResult(BaseModel):
+    label: Literal["insurance", "none"]
+
+
+class ClassifiedEmail(BaseModel):
+    result: Union[InvoiceResult, ShippingResult, ClientResult, OtherResult]
@@ -1,90 +1,383 @@
-from typing import Optional
+import base64
+import os
+import time
+from typing import List, Optional, Tuple
 from openai import OpenAI, OpenAIError, AuthenticationError    
-from models.invoice import InvoiceData, InvoiceDraft, InvoiceLine, LabelSort, ShippingData, ClientData
+from models.invoice import ClassifiedEmail, InvoiceData, InvoiceDraft, InvoiceFix, InvoiceLine, InvoiceResult, LabelBatch, LabelSort, ShippingData, ClientData
+from parsers.page_selection import MAX_VISION_PAGES, select_invoice_pages
+from parsers.image_preprocess import PreparedImage, load_image, preprocess_image
+from services.vision_files import upload_vision_file
+from services.llm_cache import LLMCache, prompt_version
+from services import llm_metrics, llm_resilience
+from utils.tokens import estimate_tokens, truncate_to_tokens
+from parsers.invoice_checks import check_invoice
+from parsers.email_context import email_input
+from parsers.invoice_repair import apply_fix, current_values, fields_to_fix, repair_snippet
 import logging
 
 logger = logging.getLogger(__name__) 
 
-def invoice_label(message_text: str, attachments: list, client: Optional[OpenAI] = None):
-    """Classify email as invoice or not using OpenAI"""
-    if client is None:
+# Images up to this size are sent inline as base64 instead of uploaded first
+INLINE_IMAGE_MAX_BYTES = int(os.getenv("INLINE_IMAGE_MAX_BYTES", str(1024 * 1024)))
+
+# Batch classification: prompt tokens per request, emails per request, and
+# how much of each email body is kept in its summary
+LABEL_BATCH_TOKEN_BUDGET = int(os.getenv("LABEL_BATCH_TOKEN_BUDGET", "6000"))
+LABEL_BATCH_MAX_SIZE = int(os.getenv("LABEL_BATCH_MAX_SIZE", "25"))
+LABEL_SUMMARY_TOKENS = int(os.getenv("LABEL_SUMMARY_TOKENS", "300"))
+
+LABEL_MODEL = "gpt-4o-2024-08-06"
+PDF_INVOICE_MODEL = "gpt-5"
+
+# Invoice extraction tries the fast model first and escalates to the
+# strong model only when the result fails check_invoice()
+FAST_INVOICE_MODEL = os.getenv("FAST_INVOICE_MODEL", "gpt-5-mini")
+INVOICE_MODEL_ROUTING = os.getenv("INVOICE_MODEL_ROUTING", "true").lower() == "true"
+
+# Before that, an extraction failing the checks gets a small follow-up
+# request for just the failing fields (see parsers/invoice_repair.py)
+INVOICE_REPAIR = os.getenv("INVOICE_REPAIR", "true").lower() == "true"
+REPAIR_MODEL = os.getenv("INVOICE_REPAIR_MODEL", FAST_INVOICE_MODEL)
+
+LABEL_CATEGORIES = (
+    "Classify the following email into one of these categories:\n"
+    "- invoice: Bills, receipts, payment requests, invoices with attached documents requesting or confirming payment.\n"
+    "- shipping: Delivery confirmations, tracking numbers, shipment notifications, freight or courier updates.\n"
+    "- insurance: Insurance policies, claims, certificates of insurance, coverage documents, liability or workers comp.\n"
+    "- client_communications: General client emails, project updates, questions, scheduling, meeting requests, status reports.\n"
+    "- none: Spam, newsletters, promotions, or anything that does not fit the above categories.\n\n"
+    "IMPORTANT: Automated notifications from BuilderTrend (e.g. 'Boris Jovanov created/updated a $X invoice') "
+    "are NOT invoices. Classify them as 'none'.\n\n"
+)
+
+LABEL_PROMPT = LABEL_CATEGORIES + "Return only the label."
+
+# Prompts are laid out for provider-side prompt caching: each system
+# prompt below is a constant, so every call of an operation starts with
+# the same bytes. Per-document content (customer candidates, then the
+# document itself) always goes last, in the user message.
+
+CUSTOMER_MATCH_PROMPT = (
+    "\n\nIMPORTANT - If a customer list is provided, match the job site address on the invoice to one of those customers. "
+    "If you find a matching address, set customer_name to the exact customer name from the list."
+)
+
+LABEL_BATCH_PROMPT = LABEL_PROMPT + (
+    "\n\nYou will receive several emails, each starting with a header like '=== Email 3 ==='. "
+    "Classify each one independently and return exactly one label per email, with email set to the number "
+    "from that email's header."
+)
+
+PDF_INVOICE_PROMPT = (
+    "Extract structured invoice data from this document. "
+    "IMPORTANT: Determine if this is an INVOICE (requesting payment, unpaid) or RECEIPT (already paid, shows 'PAID', 'SOLD ON', etc.). "
+    "Set is_receipt=true if it's a receipt/already paid. "
+    "Look for any job site address, project address, or service location - extract as job_site_address. "
+    "For each line item, categorize it (e.g., Materials, Labor, Equipment, Fuel, Permits, Supplies, etc.) based on the item description. "
+    "REQUIRED: vendor_display_name, line_items (with item, rate, quantity, category), total_amount, is_receipt. "
+    "OPTIONAL: invoice_number, invoice_date (format: MM/DD/YYYY), due_date (format: MM/DD/YYYY), tax, memo, job_site_address, customer_name. "
+    "Return all dates in MM/DD/YYYY format."
+) + CUSTOMER_MATCH_PROMPT
+
+IMAGE_INVOICE_PROMPT = (
+    "Extract structured invoice data from this image. "
+    "IMPORTANT: Determine if this is an INVOICE (requesting payment) or RECEIPT (already paid, shows 'PAID', 'SOLD ON', etc.). "
+    "Set is_receipt=true if it's a receipt. "
+    "Look for any job site address, project address, or service location - extract as job_site_address. "
+    "For each line item, categorize it (e.g., Materials, Labor, Equipment, Fuel, Permits, Supplies, etc.). "
+    "REQUIRED: vendor_display_name, line_items (with item, rate, quantity, category), total_amount, is_receipt. "
+    "OPTIONAL: invoice_number, invoice_date, due_date, tax, memo, job_site_address, customer_name. "
+    "Return all dates in MM/DD/YYYY format."
+) + CUSTOMER_MATCH_PROMPT
+
+REPAIR_PROMPT = (
+    "An invoice extraction failed validation. You are given the problems found, the extracted values of the fields "
+    "concerned, and the lines of the invoice document those fields come from. "
+    "Return corrected values for the listed fields only and leave every other field null. "
+    "If line_items is listed, return the complete list of line items (with item, rate, quantity, category) "
+    "exactly as the document lists them; do not add, drop or change items to make them match the total. "
+    "Return all dates in MM/DD/YYYY format."
+)
+
+SHIPPING_PROMPT = (
+    "Extract structured shipping and delivery data from this email.\n"
+    "Look for:\n"
+    "- Carrier name (FedEx, UPS, USPS, freight company, etc.)\n"
+    "- Tracking number(s)\n"
+    "- Order or reference number\n"
+    "- Shipment date and estimated delivery date (format: MM/DD/YYYY)\n"
+    "- Delivery status (shipped, in transit, delivered, etc.)\n"
+    "- Origin and destination addresses\n"
+    "- Items being shipped with quantities and weights\n"
+    "- Vendor or sender name\n"
+    "- Any additional notes\n\n"
+    "REQUIRED: At least one of tracking_number, order_number, or carrier.\n"
+    "OPTIONAL: All other fields. Return all dates in MM/DD/YYYY format."
+)
+
+CLIENT_PROMPT = (
+    "Extract structured data from this client communication email.\n"
+    "Look for:\n"
+    "- Client name (who sent or is referenced in the email)\n"
+    "- Subject or main topic of the email\n"
+    "- Project name or reference if mentioned\n"
+    "- A brief summary of the email content (2-3 sentences)\n"
+    "- Action items: specific tasks or requests that need to be done\n"
+    "- Key dates: any dates or deadlines mentioned (format: MM/DD/YYYY - description)\n"
+    "- Whether a response is needed (true/false)\n"
+    "- Urgency level: low (general info), medium (needs attention soon), high (urgent/time-sensitive)\n"
+    "- Any additional notes\n\n"
+    "REQUIRED: summary.\n"
+    "OPTIONAL: All other fields. Return all dates in MM/DD/YYYY format."
+)
+
+# Fused mode: one call labels an email with a document attached and, for
+# invoice/shipping/client emails, extracts the matching payload too
+FUSED_EXTRACTION = os.getenv("FUSED_EXTRACTION", "false").lower() == "true"
+FUSED_MODEL = os.getenv("FUSED_MODEL", FAST_INVOICE_MODEL)
+
+FUSED_PROMPT = LABEL_CATEGORIES + (
+    "Return the label in result.label. For invoice, shipping and client_communications emails, also fill in "
+    "the matching payload (result.invoice, result.shipping or result.client) following the rules for that label "
+    "below. Insurance and none emails need only the label.\n\n"
+    "=== invoice ===\n" + PDF_INVOICE_PROMPT + "\n\n"
+    "=== shipping ===\n" + SHIPPING_PROMPT + "\n\n"
+    "=== client_communications ===\n" + CLIENT_PROMPT
+)
+
+
+def log_prompt_cache_usage(operation: str, usage) -> Optional[float]:
+    """Log how much of a call's input was served from the provider's prompt cache
+
+    Returns the cached share of input tokens, or None if the response
+    carried no usage information.
+    """
+    input_tokens = getattr(usage, "input_tokens", None)
+    cached_tokens = getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", None)
+    if not isinstance(input_tokens, int) or not isinstance(cached_tokens, int):
+        return None
+
+    share = cached_tokens / input_tokens if input_tokens else 0.0
+    logger.info("%s: %d of %d input tokens from prompt cache (%.0f%%)", operation, cached_tokens, input_tokens, share * 100)
+    return share
+
+
+def cache_entry(cache: Optional[LLMCache], operation: str, instructions: str, model: str, input: list, text_format) -> Tuple[Optional[str], Optional[str]]:
+    """(key, prompt version) a call is cached under, or (None, None) without a cache
+
+    The key covers the model, a version hash of the static instructions
+    and output schema, and the exact request input.
+    """
+    if cache is None:
+        return None, None
+    version = prompt_version(instructions, text_format)
+    return cache.make_key(operation, model, version, input), version
+
+
+def cached_output(cache: LLMCache, key: str, operation: str, model: str, text_format):
+    """The cached parsed output for key, counted as a cache hit, or None"""
+    cached = cache.get(key, text_format)
+    if cached is not None:
+        logger.info("LLM cache hit for %s", operation)
+        llm_metrics.record_cache_hit(operation, model)
+    return cached
+
+
+def store_output(cache: LLMCache, key: str, operation: str, model: str, version: str, parsed):
+    """Cache a parsed output; failed parses (None) are not kept"""
+    if parsed is not None:
+        cache.put(key, operation, model, version, parsed)
+
+
+def parsed_output(operation: str, response):
+    """The parsed output of a responses.parse call, logging its prompt cache usage"""
+    log_prompt_cache_usage(operation, getattr(response, "usage", None))
+    return response.output_parsed
+
+
+def _parse_response(client: OpenAI, operation: str, instructions: str, model: str, input: list, text_format, cache: Optional[LLMCache] = None):
+    """Call responses.parse and return the parsed output, going through the cache if given"""
+    key, version = cache_entry(cache, operation, instructions, model, input, text_format)
+    if key is not None:
+        cached = cached_output(cache, key, operation, model, text_format)
+        if cached is not None:
+            return cached
+
+    def attempt(timeout: Optional[float] = None):
+        started = time.perf_counter()
         try:
-            client = OpenAI()
-        except OpenAIError as e:
-            logger.error("OpenAI auth failed: %s", e)
-            return None
-    
-    context = message_text
+            response = client.responses.parse(
+                model=model,
+                input=input,
+                text_format=text_format,
+                prompt_cache_key=operation,
+                **({"timeout": timeout} if timeout is not None else {}),
+            )
+        except Exception as e:
+            llm_metrics.record_response(operation, model, time.perf_counter() - started, error=e)
+            raise
+        llm_metrics.record_response(operation, model, time.perf_counter() - started, response)
+        return response
+
+    # Retries, deadline and hedging when main() has activated a call layer
+    layer = llm_resilience.active_layer()
+    response = layer.call(operation, model, attempt) if layer is not None else attempt()
+    parsed = parsed_output(operation, response)
+    if key is not None:
+        store_output(cache, key, operation, model, version, parsed)
+    return parsed
+
+
+def repair_input(payload: InvoiceData, issues: list, fields: List[str], snippet: str) -> list:
+    """Build the request input for re-asking the failing fields of an extraction"""
+    problems = "".join(f"- {issue}\n" for issue in issues)
+    return [
+        {"role": "system", "content": REPAIR_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Problems:\n{problems}\n"
+                f"Fields to correct: {', '.join(fields)}\n\n"
+                f"Extracted values:\n{current_values(payload, fields)}\n\n"
+                f"Invoice document (relevant lines):\n{snippet}"
+            ),
+        },
+    ]
+
+
+def repair_request(payload: Optional[InvoiceData], document_text: Optional[str], issues: Optional[list] = None) -> Optional[tuple]:
+    """(fields, input) for re-asking the failing fields, or None if a fix cannot help"""
+    if payload is None or not document_text:
+        return None
+    issues = check_invoice(payload) if issues is None else issues
+    fields = fields_to_fix(issues)
+    snippet = repair_snippet(document_text, fields) if fields else ""
+    if not snippet:
+        return None
+    return fields, repair_input(payload, issues, fields, snippet)
 
-    if attachments:
-        context += "\n\nAttachments found:\n"
-        for filename, data in attachments:
-            context += f"- {filename}\n"
 
+def apply_repair(payload: InvoiceData, fix: Optional[InvoiceFix], fields: List[str], input: list, document_text: str) -> Optional[InvoiceData]:
+    """The patched extraction if it now passes check_invoice, else None"""
+    if fix is None:
+        return None
+    repaired = apply_fix(payload, fix, fields)
+    remaining = check_invoice(repaired)
+    if remaining:
+        logger.info("invoice_repair of %s did not help: %s", ", ".join(fields), "; ".join(str(issue) for issue in remaining))
+        return None
+    logger.info(
+        "invoice_repair fixed %s with ~%d input tokens (document: ~%d)",
+        ", ".join(fields), estimate_tokens(input[1]["content"]), estimate_tokens(document_text),
+    )
+    return repaired
+
+
+def repair_invoice(client: OpenAI, payload: Optional[InvoiceData], document_text: Optional[str], issues: Optional[list] = None, cache: Optional[LLMCache] = None, model: str = REPAIR_MODEL) -> Optional[InvoiceData]:
+    """Fix the fields of an extraction that fail check_invoice
+
+    Only the failing fields and the document lines they come from are
+    sent. Returns the patched extraction if it then passes the checks,
+    or None if there was nothing to fix from, the request failed, or the
+    fix did not help - the caller falls back to a full re-extraction.
+    """
+    request = repair_request(payload, document_text, issues)
+    if request is None:
+        return None
+    fields, input = request
     try:
-        response = client.responses.parse(
-            model="gpt-4o-2024-08-06",
-            input=[
-                {"role": "system", "content": (
-                    "Classify the following email into one of these categories:\n"
-                    "- invoice: Bills, receipts, payment requests, invoices with attached documents requesting or confirming payment.\n"
-                    "- shipping: Delivery confirmations, tracking numbers, shipment notifications, freight or courier updates.\n"
-                    "- insurance: Insurance policies, claims, certificates of insurance, coverage documents, liability or workers comp.\n"
-                    "- client_communications: General client emails, project updates, questions, scheduling, meeting requests, status reports.\n"
-                    "- none: Spam, newsletters, promotions, or anything that does not fit the above categories.\n\n"
-                    "IMPORTANT: Automated notifications from BuilderTrend (e.g. 'Boris Jovanov created/updated a $X invoice') "
-                    "are NOT invoices. Classify them as 'none'.\n\n"
-                    "Return only the label."
-                )},
-                {
-                    "role": "user",
-                    "content": context,
-                },
-            ],
-            text_format=LabelSort,
-        )
-    except AuthenticationError as e: 
-        logger.error("OpenAI auth failed: %s", e)
+        fix = _parse_response(client, "invoice_repair", REPAIR_PROMPT, model, input, InvoiceFix, cache=cache)
+    except AuthenticationError:
+        raise
+    except (OpenAIError, ValueError) as e:
+        logger.warning("invoice_repair failed: %s", e)
         return None
-    return response.output_parsed.label
+    return apply_repair(payload, fix, fields, input, document_text)
 
 
-def pdf_invoice(message_text: str, text, client: Optional[OpenAI] = None, customers_context: Optional[str] = None):
-    """Extract invoice data from PDF text"""
-    if client is None:
-        client = OpenAI()
+def repair_enabled(document_text: Optional[str]) -> bool:
+    """Whether failing fields may be re-asked on their own: needs the document text"""
+    return INVOICE_REPAIR and bool(document_text)
 
-    system_prompt = (
-        "Extract structured invoice data from this document. "
-        "IMPORTANT: Determine if this is an INVOICE (requesting payment, unpaid) or RECEIPT (already paid, shows 'PAID', 'SOLD ON', etc.). "
-        "Set is_receipt=true if it's a receipt/already paid. "
-        "Look for any job site address, project address, or service location - extract as job_site_address. "
-        "For each line item, categorize it (e.g., Materials, Labor, Equipment, Fuel, Permits, Supplies, etc.) based on the item description. "
-        "REQUIRED: vendor_display_name, line_items (with item, rate, quantity, category), total_amount, is_receipt. "
-        "OPTIONAL: invoice_number, invoice_date (format: MM/DD/YYYY), due_date (format: MM/DD/YYYY), tax, memo, job_site_address, customer_name. "
-        "Return all dates in MM/DD/YYYY format."
-    )
 
-    if customers_context:
-        system_prompt += (
-            f"\n\nIMPORTANT - Match the job site address on the invoice to one of these customers:\n{customers_context}\n\n"
-            "If you find a matching address, set customer_name to the exact customer name from the list above."
-        )
+def needs_repair(payload: Optional[InvoiceData], document_text: Optional[str]) -> bool:
+    """Whether a final extraction should go through repair_invoice"""
+    return repair_enabled(document_text) and bool(check_invoice(payload))
+
+
+def fast_issues(payload: Optional[InvoiceData] = None, error: Optional[Exception] = None) -> list:
+    """The reasons to go past the fast model's result: failed checks, or the call's error"""
+    if error is not None:
+        return [f"fast model call failed: {error}"]
+    return check_invoice(payload)
+
 
-    response = client.responses.parse(
-        model="gpt-5",
-        input=[
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": text,
-            },
-        ],
-        text_format=InvoiceData,
+def fast_accepted(operation: str, issues: list, seconds: float) -> bool:
+    """Whether the fast model's result is kept as is, logging it when it is"""
+    if issues:
+        return False
+    logger.info("%s routed to %s: accepted in %.2fs", operation, FAST_INVOICE_MODEL, seconds)
+    return True
+
+
+def log_escalation(operation: str, issues: list, seconds: float):
+    logger.info(
+        "%s escalating from %s to %s after %.2fs: %s",
+        operation, FAST_INVOICE_MODEL, PDF_INVOICE_MODEL, seconds, "; ".join(str(issue) for issue in issues),
     )
 
-    payload = response.output_parsed
 
+def log_escalated(operation: str, seconds: float):
+    logger.info("%s routed to %s: finished in %.2fs", operation, PDF_INVOICE_MODEL, seconds)
+
+
+def _checked(client: OpenAI, payload: Optional[InvoiceData], document_text: Optional[str], cache: Optional[LLMCache]) -> Optional[InvoiceData]:
+    """payload, or its repaired version when it fails the checks and a fix works"""
+    if not needs_repair(payload, document_text):
+        return payload
+    return repair_invoice(client, payload, document_text, cache=cache) or payload
+
+
+def _extract_invoice(client: OpenAI, operation: str, instructions: str, input: list, cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING, document_text: Optional[str] = None) -> Optional[InvoiceData]:
+    """Run an invoice extraction, escalating from the fast to the strong model
+
+    The fast model's result is kept when it passes check_invoice (line
+    items add up to the total, required fields present, dates parse).
+    Otherwise, when the document text is given, the failing fields are
+    first re-asked on their own (repair_invoice). If that does not fix
+    them - or if the fast call errors - the same input goes to the
+    strong model.
+    """
+    if not routing:
+        payload = _parse_response(client, operation, instructions, PDF_INVOICE_MODEL, input, InvoiceData, cache=cache)
+        return _checked(client, payload, document_text, cache)
+
+    started = time.perf_counter()
+    try:
+        payload = _parse_response(client, operation, instructions, FAST_INVOICE_MODEL, input, InvoiceData, cache=cache)
+        issues = fast_issues(payload)
+    except AuthenticationError:
+        raise
+    except (OpenAIError, ValueError) as e:
+        payload, issues = None, fast_issues(error=e)
+    fast_seconds = time.perf_counter() - started
+    if fast_accepted(operation, issues, fast_seconds):
+        return payload
+
+    if repair_enabled(document_text):
+        repaired = repair_invoice(client, payload, document_text, issues, cache=cache)
+        if repaired is not None:
+            return repaired
+
+    log_escalation(operation, issues, fast_seconds)
+    started = time.perf_counter()
+    payload = _parse_response(client, operation, instructions, PDF_INVOICE_MODEL, input, InvoiceData, cache=cache)
+    log_escalated(operation, time.perf_counter() - started)
+    return _checked(client, payload, document_text, cache)
+
+
+def draft_from_payload(payload: InvoiceData) -> InvoiceDraft:
+    """Convert the model's InvoiceData output into an InvoiceDraft"""
     line_items = [
         InvoiceLine(
             item=item.item,
@@ -105,88 +398,289 @@ def pdf_invoice(message_text: str, text, client: Optional[OpenAI] = None, custom
         due_date=payload.due_date,
         invoice_number=payload.invoice_number,
         invoice_date=payload.invoice_date,
+        is_receipt=payload.is_receipt,
         job_site_address=payload.job_site_address,
         customer_name=payload.customer_name,
     )
 
 
-def ai_invoice(message_text: str, file_path: str, client: Optional[OpenAI] = None, customers_context: Optional[str] = None) -> Optional[InvoiceDraft]:
-    """Extract invoice data from image using OpenAI vision API"""
+def label_input(message_text: str, attachments: list) -> list:
+    """Build the request input for classifying one email"""
+    context = message_text
+
+    if attachments:
+        context += "\n\nAttachments found:\n"
+        for filename, data in attachments:
+            context += f"- {filename}\n"
+
+    return [
+        {"role": "system", "content": LABEL_PROMPT},
+        {
+            "role": "user",
+            "content": context,
+        },
+    ]
+
+
+def invoice_label(message_text: str, attachments: list, client: Optional[OpenAI] = None, cache: Optional[LLMCache] = None):
+    """Classify email as invoice or not using OpenAI"""
     if client is None:
-        client = OpenAI()
+        try:
+            client = OpenAI()
+        except OpenAIError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return None
+    
+    try:
+        parsed = _parse_response(
+            client,
+            operation="invoice_label",
+            instructions=LABEL_PROMPT,
+            model=LABEL_MODEL,
+            input=label_input(message_text, attachments),
+            text_format=LabelSort,
+            cache=cache,
+        )
+    except AuthenticationError as e: 
+        logger.error("OpenAI auth failed: %s", e)
+        return None
+    return parsed.label
 
-    def create_file(file_path):
-        with open(file_path, "rb") as file_content:
-            result = client.files.create(
-                file=file_content,
-                purpose="vision",
-            )
-        return result.id
-
-    file_id = create_file(file_path)
-
-    prompt_text = (
-        "Extract structured invoice data from this image. "
-        "IMPORTANT: Determine if this is an INVOICE (requesting payment) or RECEIPT (already paid, shows 'PAID', 'SOLD ON', etc.). "
-        "Set is_receipt=true if it's a receipt. "
-        "Look for any job site address, project address, or service location - extract as job_site_address. "
-        "For each line item, categorize it (e.g., Materials, Labor, Equipment, Fuel, Permits, Supplies, etc.). "
-        "REQUIRED: vendor_display_name, line_items (with item, rate, quantity, category), total_amount, is_receipt. "
-        "OPTIONAL: invoice_number, invoice_date, due_date, tax, memo, job_site_address, customer_name. "
-        "Return all dates in MM/DD/YYYY format."
-    )
 
-    if customers_context:
-        prompt_text += (
-            f"\n\nIMPORTANT - Match the job site address on the invoice to one of these customers:\n{customers_context}\n\n"
-            "If you find a matching address, set customer_name to the exact customer name from the list above."
+def _label_summary(message_text: str, attachments: list, max_tokens: int = LABEL_SUMMARY_TOKENS) -> str:
+    """Short version of an email for batch classification"""
+    summary = truncate_to_tokens(message_text or "", max_tokens)
+    if attachments:
+        summary += "\nAttachments: " + ", ".join(filename for filename, _ in attachments)
+    return summary
+
+
+def plan_label_batches(summaries: List[str], token_budget: int = LABEL_BATCH_TOKEN_BUDGET, max_size: int = LABEL_BATCH_MAX_SIZE) -> List[List[int]]:
+    """Group email summaries into batches that fit the prompt token budget.
+
+    Returns lists of indexes into summaries. An email too large for the
+    budget on its own still gets a batch of one.
+    """
+    available = max(token_budget - estimate_tokens(LABEL_BATCH_PROMPT), 1)
+    batches = []
+    current = []
+    used = 0
+    for position, summary in enumerate(summaries):
+        # The per-email header adds a few tokens
+        cost = estimate_tokens(summary) + 8
+        if current and (used + cost > available or len(current) >= max_size):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(position)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def invoice_label_batch(emails: List[tuple], client: Optional[OpenAI] = None, cache: Optional[LLMCache] = None, token_budget: int = LABEL_BATCH_TOKEN_BUDGET, max_size: int = LABEL_BATCH_MAX_SIZE) -> List[Optional[str]]:
+    """Classify many emails with as few requests as possible
+
+    emails is a list of (message_text, attachments) pairs. Returns one
+    label per email, in order. Each label in a batch answer names the
+    email it is for; an answer that does not cover every email exactly
+    once cannot be used and is retried one email at a time with
+    invoice_label.
+    """
+    if client is None:
+        try:
+            client = OpenAI()
+        except OpenAIError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return [None] * len(emails)
+
+    summaries = [_label_summary(message_text, attachments) for message_text, attachments in emails]
+    labels: List[Optional[str]] = [None] * len(emails)
+
+    for batch in plan_label_batches(summaries, token_budget=token_budget, max_size=max_size):
+        if len(batch) == 1:
+            message_text, attachments = emails[batch[0]]
+            labels[batch[0]] = invoice_label(message_text, attachments, client=client, cache=cache)
+            continue
+
+        context = "\n\n".join(
+            f"=== Email {number} ===\n{summaries[position]}"
+            for number, position in enumerate(batch, start=1)
         )
+        try:
+            parsed = _parse_response(
+                client,
+                operation="invoice_label_batch",
+                instructions=LABEL_BATCH_PROMPT,
+                model=LABEL_MODEL,
+                input=[
+                    {"role": "system", "content": LABEL_BATCH_PROMPT},
+                    {"role": "user", "content": context},
+                ],
+                text_format=LabelBatch,
+                cache=cache,
+            )
+        except AuthenticationError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return labels
+        except (OpenAIError, ValueError) as e:
+            logger.warning("Batch of %d emails failed, classifying individually: %s", len(batch), e)
+            parsed = None
+
+        numbers = sorted(result.email for result in parsed.labels) if parsed is not None else None
+        if numbers == list(range(1, len(batch) + 1)):
+            for result in parsed.labels:
+                labels[batch[result.email - 1]] = result.label
+            continue
+
+        if parsed is not None:
+            logger.warning("Batch answered emails %s of 1-%d, classifying individually", numbers, len(batch))
+        for position in batch:
+            message_text, attachments = emails[position]
+            labels[position] = invoice_label(message_text, attachments, client=client, cache=cache)
+
+    return labels
 
-    response = client.responses.parse(
-        model="gpt-5",
-        input=[{
+
+def _customers_block(customers_context: Optional[str]) -> str:
+    if not customers_context:
+        return ""
+    return f"Customers:\n{customers_context}\n\n"
+
+
+def pdf_invoice_input(text: str, customers_context: Optional[str] = None) -> list:
+    """Build the request input for extracting an invoice from PDF text"""
+    return [
+        {"role": "system", "content": PDF_INVOICE_PROMPT},
+        {
             "role": "user",
-            "content": [
-                {
-                    "type": "input_text", "text": prompt_text},
-                {
-                    "type": "input_image",
-                    "file_id": file_id,
-
-                },
-            ],
-        }],
-        text_format=InvoiceData,
-    )
-    payload = response.output_parsed
+            "content": f"{_customers_block(customers_context)}Invoice document:\n{text}",
+        },
+    ]
 
-    print(payload)
 
-    line_items = [
-        InvoiceLine(
-            item=item.item,
-            rate=item.rate,
-            quantity=item.quantity,
-            description=item.description,
-            category=item.category,
+def pdf_invoice(message_text: str, text, client: Optional[OpenAI] = None, customers_context: Optional[str] = None, cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING):
+    """Extract invoice data from PDF text
+
+    With routing, the fast model is tried first and the strong model only
+    runs when the fast result fails the invoice checks.
+    """
+    if client is None:
+        client = OpenAI()
+
+    payload = _extract_invoice(
+        client,
+        operation="pdf_invoice",
+        instructions=PDF_INVOICE_PROMPT,
+        input=pdf_invoice_input(text, customers_context),
+        cache=cache,
+        routing=routing,
+        document_text=text,
+    )
+
+    return draft_from_payload(payload)
+
+
+def inline_image_part(image: PreparedImage) -> dict:
+    """Build an input_image part carrying the image as a base64 data URL"""
+    encoded = base64.b64encode(image.data).decode("ascii")
+    return {
+        "type": "input_image",
+        "image_url": f"data:{image.mime_type};base64,{encoded}",
+    }
+
+
+def _image_input(client: OpenAI, image: PreparedImage, inline_max_bytes: int) -> dict:
+    """Build an input_image part, inline when small enough to skip an upload"""
+    if len(image.data) <= inline_max_bytes:
+        return inline_image_part(image)
+
+    file_id = upload_vision_file(client, image.filename, image.data, image.mime_type)
+    return {
+        "type": "input_image",
+        "file_id": file_id,
+    }
+
+
+def prepare_invoice_images(file_path: Optional[str] = None, page_paths: Optional[List[str]] = None, max_pages: int = MAX_VISION_PAGES, preprocess: bool = True, image_data: Optional[bytes] = None, image_name: str = "image.jpg") -> List[PreparedImage]:
+    """Pick the pages to send and load (or shrink) each one"""
+    if page_paths:
+        pages = list(page_paths)
+    elif image_data is not None:
+        pages = [image_data]
+    else:
+        pages = [file_path]
+    if len(pages) > max_pages:
+        selected = select_invoice_pages(pages, max_pages=max_pages)
+        logger.info("Selected %d of %d pages for vision extraction", len(selected), len(pages))
+        pages = selected
+
+    name = image_name if image_data is not None and not page_paths else None
+    return [preprocess_image(page, name) if preprocess else load_image(page, name) for page in pages]
+
+
+def invoice_image_input(image_parts: List[dict], customers_context: Optional[str] = None) -> list:
+    """Build the request input for extracting an invoice from page images"""
+    if len(image_parts) > 1:
+        document_note = (
+            f"The {len(image_parts)} images are pages of the SAME document, in order. "
+            "Combine line items from every page into one invoice and do not repeat items that carry over between pages."
         )
-        for item in payload.line_items
+    else:
+        document_note = "The invoice image is attached."
+
+    content = [{"type": "input_text", "text": f"{_customers_block(customers_context)}{document_note}"}]
+    content.extend(image_parts)
+    return [
+        {"role": "system", "content": IMAGE_INVOICE_PROMPT},
+        {"role": "user", "content": content},
     ]
-    return InvoiceDraft(
-        vendor_display_name=payload.vendor_display_name,
-        memo=payload.memo,
-        line_items=line_items,
-        tax=payload.tax,
-        total_amount=payload.total_amount,
-        due_date=payload.due_date,
-        invoice_number=payload.invoice_number,
-        invoice_date=payload.invoice_date,
-        job_site_address=payload.job_site_address,
-        customer_name=payload.customer_name,
+
+
+def ai_invoice(message_text: str, file_path: Optional[str] = None, client: Optional[OpenAI] = None, customers_context: Optional[str] = None, page_paths: Optional[List[str]] = None, max_pages: int = MAX_VISION_PAGES, preprocess: bool = True, inline_max_bytes: int = INLINE_IMAGE_MAX_BYTES, image_data: Optional[bytes] = None, image_name: str = "image.jpg", cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING) -> Optional[InvoiceDraft]:
+    """Extract invoice data from one or more page images using OpenAI vision API
+
+    Multi-page scans are passed as page_paths and sent together in a single
+    request. When there are more pages than max_pages, the pages most likely
+    to hold line items and totals are kept. Images are downscaled and
+    re-encoded before upload unless preprocess is False. Images up to
+    inline_max_bytes are sent inline; larger ones go through the Files API
+    with uploads cached by content hash. An image already in memory can be
+    passed as image_data (named image_name) instead of a file path.
+    Model routing works as in pdf_invoice.
+    """
+    if client is None:
+        client = OpenAI()
+
+    images = prepare_invoice_images(file_path, page_paths, max_pages, preprocess, image_data, image_name)
+    image_parts = [_image_input(client, image, inline_max_bytes) for image in images]
+
+    payload = _extract_invoice(
+        client,
+        operation="ai_invoice",
+        instructions=IMAGE_INVOICE_PROMPT,
+        input=invoice_image_input(image_parts, customers_context),
+        cache=cache,
+        routing=routing,
     )
 
+    print(payload)
+
+    return draft_from_payload(payload)
 
-def parse_shipping(message_text: str, attachments: list, client: Optional[OpenAI] = None) -> Optional[ShippingData]:
+
+def shipping_input(message_text: str, attachments: list) -> list:
+    """Build the request input for extracting shipping data"""
+    return email_input(SHIPPING_PROMPT, message_text, attachments)
+
+
+def client_communication_input(message_text: str, attachments: list) -> list:
+    """Build the request input for extracting client communication data"""
+    return email_input(CLIENT_PROMPT, message_text, attachments)
+
+
+def parse_shipping(message_text: str, attachments: list, client: Optional[OpenAI] = None, cache: Optional[LLMCache] = None) -> Optional[ShippingData]:
     """Extract structured shipping data from an email and its attachments"""
     if client is None:
         try:
@@ -195,49 +689,22 @@ def parse_shipping(message_text: str, attachments: list, client: Optional[OpenAI
             logger.error("OpenAI auth failed: %s", e)
             return None
 
-    context = message_text
-
-    if attachments:
-        context += "\n\nAttachment contents:\n"
-        for filename, data in attachments:
-            if isinstance(data, str):
-                context += f"\n--- {filename} ---\n{data}\n"
-            else:
-                context += f"\n--- {filename} (binary file) ---\n"
-
-    system_prompt = (
-        "Extract structured shipping and delivery data from this email.\n"
-        "Look for:\n"
-        "- Carrier name (FedEx, UPS, USPS, freight company, etc.)\n"
-        "- Tracking number(s)\n"
-        "- Order or reference number\n"
-        "- Shipment date and estimated delivery date (format: MM/DD/YYYY)\n"
-        "- Delivery status (shipped, in transit, delivered, etc.)\n"
-        "- Origin and destination addresses\n"
-        "- Items being shipped with quantities and weights\n"
-        "- Vendor or sender name\n"
-        "- Any additional notes\n\n"
-        "REQUIRED: At least one of tracking_number, order_number, or carrier.\n"
-        "OPTIONAL: All other fields. Return all dates in MM/DD/YYYY format."
-    )
-
     try:
-        response = client.responses.parse(
-            model="gpt-4o-2024-08-06",
-            input=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context},
-            ],
+        return _parse_response(
+            client,
+            operation="parse_shipping",
+            instructions=SHIPPING_PROMPT,
+            model=LABEL_MODEL,
+            input=shipping_input(message_text, attachments),
             text_format=ShippingData,
+            cache=cache,
         )
     except AuthenticationError as e:
         logger.error("OpenAI auth failed: %s", e)
         return None
 
-    return response.output_parsed
 
-
-def parse_client_communication(message_text: str, attachments: list, client: Optional[OpenAI] = None) -> Optional[ClientData]:
+def parse_client_communication(message_text: str, attachments: list, client: Optional[OpenAI] = None, cache: Optional[LLMCache] = None) -> Optional[ClientData]:
     """Extract structured data from a client communication email"""
     if client is None:
         try:
@@ -246,43 +713,83 @@ def parse_client_communication(message_text: str, attachments: list, client: Opt
             logger.error("OpenAI auth failed: %s", e)
             return None
 
-    context = message_text
-
-    if attachments:
-        context += "\n\nAttachment contents:\n"
-        for filename, data in attachments:
-            if isinstance(data, str):
-                context += f"\n--- {filename} ---\n{data}\n"
-            else:
-                context += f"\n--- {filename} (binary file) ---\n"
-
-    system_prompt = (
-        "Extract structured data from this client communication email.\n"
-        "Look for:\n"
-        "- Client name (who sent or is referenced in the email)\n"
-        "- Subject or main topic of the email\n"
-        "- Project name or reference if mentioned\n"
-        "- A brief summary of the email content (2-3 sentences)\n"
-        "- Action items: specific tasks or requests that need to be done\n"
-        "- Key dates: any dates or deadlines mentioned (format: MM/DD/YYYY - description)\n"
-        "- Whether a response is needed (true/false)\n"
-        "- Urgency level: low (general info), medium (needs attention soon), high (urgent/time-sensitive)\n"
-        "- Any additional notes\n\n"
-        "REQUIRED: summary.\n"
-        "OPTIONAL: All other fields. Return all dates in MM/DD/YYYY format."
-    )
-
     try:
-        response = client.responses.parse(
-            model="gpt-4o-2024-08-06",
-            input=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context},
-            ],
+        return _parse_response(
+            client,
+            operation="parse_client_communication",
+            instructions=CLIENT_PROMPT,
+            model=LABEL_MODEL,
+            input=client_communication_input(message_text, attachments),
             text_format=ClientData,
+            cache=cache,
         )
     except AuthenticationError as e:
         logger.error("OpenAI auth failed: %s", e)
         return None
 
-    return response.output_parsed
+
+def fused_input(message_text: str, attachments: list, document_text: Optional[str] = None, image_parts: Optional[List[dict]] = None, customers_context: Optional[str] = None) -> list:
+    """Build the request input for classifying and extracting in one call"""
+    context = f"{_customers_block(customers_context)}Email:\n{message_text}"
+    if attachments:
+        context += "\n\nAttachments found:\n" + "".join(f"- {filename}\n" for filename, _ in attachments)
+    if document_text:
+        context += f"\n\nAttached document:\n{document_text}"
+
+    content = [{"type": "input_text", "text": context}]
+    content.extend(image_parts or [])
+    return [
+        {"role": "system", "content": FUSED_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+
+def classify_and_extract(message_text: str, attachments: list, client: Optional[OpenAI] = None, document_text: Optional[str] = None, image_data: Optional[bytes] = None, image_name: str = "image.jpg", customers_context: Optional[str] = None, cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING, inline_max_bytes: int = INLINE_IMAGE_MAX_BYTES):
+    """Classify an email and extract its payload in a single call
+
+    For emails with a PDF (pass its text as document_text) or an image
+    attachment (image_data), this replaces invoice_label followed by
+    pdf_invoice/ai_invoice, parse_shipping or parse_client_communication.
+    Returns the ClassifiedEmail result - an InvoiceResult, ShippingResult,
+    ClientResult or OtherResult, all with a .label - or None if the call
+    failed, in which case the caller should fall back to separate calls.
+
+    With routing, an invoice that fails the invoice checks is redone by
+    the strong model.
+    """
+    if client is None:
+        try:
+            client = OpenAI()
+        except OpenAIError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return None
+
+    try:
+        image_parts = []
+        if image_data is not None:
+            image_parts.append(_image_input(client, preprocess_image(image_data, image_name), inline_max_bytes))
+        input = fused_input(message_text, attachments, document_text, image_parts, customers_context)
+
+        parsed = _parse_response(client, "classify_and_extract", FUSED_PROMPT, FUSED_MODEL, input, ClassifiedEmail, cache=cache)
+        result = parsed.result if parsed is not None else None
+
+        if routing and isinstance(result, InvoiceResult) and FUSED_MODEL != PDF_INVOICE_MODEL:
+            issues = check_invoice(result.invoice)
+            repaired = repair_invoice(client, result.invoice, document_text, issues, cache=cache) if issues and INVOICE_REPAIR else None
+            if repaired is not None:
+                result = InvoiceResult(label="invoice", invoice=repaired)
+            elif issues:
+                logger.info(
+                    "classify_and_extract escalating from %s to %s: %s",
+                    FUSED_MODEL, PDF_INVOICE_MODEL, "; ".join(str(issue) for issue in issues),
+                )
+                escalated = _parse_response(client, "classify_and_extract", FUSED_PROMPT, PDF_INVOICE_MODEL, input, ClassifiedEmail, cache=cache)
+                if escalated is not None:
+                    result = escalated.result
+    except AuthenticationError as e:
+        logger.error("OpenAI auth failed: %s", e)
+        return None
+    except (OpenAIError, ValueError) as e:
+        logger.warning("classify_and_extract failed: %s", e)
+        return None
+    return result
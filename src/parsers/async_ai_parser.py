@@ -0,0 +1,311 @@
+"""Async versions of the ai_parser functions.
+
+Each function mirrors its blocking counterpart in ai_parser - same
+prompts, inputs, cache, model routing and return values - but takes an
+AsyncOpenAI client so many messages can be processed at once:
+
+    client = AsyncOpenAI()
+    labels = await asyncio.gather(*(invoice_label_async(text, atts, client=client) for text, atts in emails))
+
+All calls share a limiter (semaphore plus token-rate bucket, see
+utils/rate_limit.py) so running many at once stays under the account's
+request and token limits.
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from openai import AsyncOpenAI, AuthenticationError, OpenAIError, RateLimitError
+
+from models.invoice import ClientData, InvoiceData, InvoiceDraft, InvoiceFix, LabelSort, ShippingData
+from parsers.ai_parser import (
+    CLIENT_PROMPT,
+    FAST_INVOICE_MODEL,
+    IMAGE_INVOICE_PROMPT,
+    INLINE_IMAGE_MAX_BYTES,
+    INVOICE_MODEL_ROUTING,
+    LABEL_MODEL,
+    LABEL_PROMPT,
+    PDF_INVOICE_MODEL,
+    PDF_INVOICE_PROMPT,
+    REPAIR_MODEL,
+    REPAIR_PROMPT,
+    SHIPPING_PROMPT,
+    apply_repair,
+    cache_entry,
+    cached_output,
+    client_communication_input,
+    draft_from_payload,
+    fast_accepted,
+    fast_issues,
+    inline_image_part,
+    invoice_image_input,
+    label_input,
+    log_escalated,
+    log_escalation,
+    needs_repair,
+    parsed_output,
+    pdf_invoice_input,
+    prepare_invoice_images,
+    repair_enabled,
+    repair_request,
+    shipping_input,
+    store_output,
+)
+from parsers.image_preprocess import PreparedImage
+from parsers.page_selection import MAX_VISION_PAGES
+from services.llm_cache import LLMCache
+from services import llm_metrics, llm_resilience
+from services.vision_files import upload_vision_file_async
+from utils.rate_limit import AsyncRateLimiter, shared_limiter
+from utils.tokens import estimate_input_tokens
+
+logger = logging.getLogger(__name__)
+
+# Output tokens reserved per request when charging the rate limiter
+_OUTPUT_TOKEN_RESERVE = 500
+
+
+async def _parse_response_async(client: AsyncOpenAI, operation: str, instructions: str, model: str, input: list, text_format,
+                                cache: Optional[LLMCache] = None, limiter: Optional[AsyncRateLimiter] = None):
+    """Async counterpart of ai_parser._parse_response, gated by the limiter"""
+    key, version = cache_entry(cache, operation, instructions, model, input, text_format)
+    if key is not None:
+        # SQLite reads and writes block, so they run off the event loop
+        cached = await asyncio.to_thread(cached_output, cache, key, operation, model, text_format)
+        if cached is not None:
+            return cached
+
+    limiter = limiter or shared_limiter()
+
+    async def attempt(timeout: Optional[float] = None):
+        async with limiter.slot(estimate_input_tokens(input) + _OUTPUT_TOKEN_RESERVE):
+            # Latency is measured inside the slot, so limiter waits are not counted
+            started = time.perf_counter()
+            try:
+                response = await client.responses.parse(
+                    model=model,
+                    input=input,
+                    text_format=text_format,
+                    prompt_cache_key=operation,
+                    **({"timeout": timeout} if timeout is not None else {}),
+                )
+            except RateLimitError as e:
+                llm_metrics.record_response(operation, model, time.perf_counter() - started, error=e)
+                # Back everyone off, not just this request
+                limiter.drain()
+                raise
+            except Exception as e:
+                llm_metrics.record_response(operation, model, time.perf_counter() - started, error=e)
+                raise
+        llm_metrics.record_response(operation, model, time.perf_counter() - started, response)
+        return response
+
+    layer = llm_resilience.active_layer()
+    response = await layer.call_async(operation, model, attempt) if layer is not None else await attempt()
+    parsed = parsed_output(operation, response)
+    if key is not None:
+        await asyncio.to_thread(store_output, cache, key, operation, model, version, parsed)
+    return parsed
+
+
+async def repair_invoice_async(client: AsyncOpenAI, payload: Optional[InvoiceData], document_text: Optional[str],
+                               issues: Optional[list] = None, cache: Optional[LLMCache] = None, model: str = REPAIR_MODEL,
+                               limiter: Optional[AsyncRateLimiter] = None) -> Optional[InvoiceData]:
+    """Async counterpart of ai_parser.repair_invoice"""
+    request = repair_request(payload, document_text, issues)
+    if request is None:
+        return None
+    fields, input = request
+    try:
+        fix = await _parse_response_async(client, "invoice_repair", REPAIR_PROMPT, model, input, InvoiceFix, cache, limiter)
+    except AuthenticationError:
+        raise
+    except (OpenAIError, ValueError) as e:
+        logger.warning("invoice_repair failed: %s", e)
+        return None
+    return apply_repair(payload, fix, fields, input, document_text)
+
+
+async def _checked_async(client: AsyncOpenAI, payload: Optional[InvoiceData], document_text: Optional[str],
+                         cache: Optional[LLMCache], limiter: Optional[AsyncRateLimiter]) -> Optional[InvoiceData]:
+    if not needs_repair(payload, document_text):
+        return payload
+    return await repair_invoice_async(client, payload, document_text, cache=cache, limiter=limiter) or payload
+
+
+async def _extract_invoice_async(client: AsyncOpenAI, operation: str, instructions: str, input: list,
+                                 cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING,
+                                 limiter: Optional[AsyncRateLimiter] = None,
+                                 document_text: Optional[str] = None) -> Optional[InvoiceData]:
+    """Async counterpart of ai_parser._extract_invoice"""
+    if not routing:
+        payload = await _parse_response_async(client, operation, instructions, PDF_INVOICE_MODEL, input, InvoiceData, cache, limiter)
+        return await _checked_async(client, payload, document_text, cache, limiter)
+
+    started = time.perf_counter()
+    try:
+        payload = await _parse_response_async(client, operation, instructions, FAST_INVOICE_MODEL, input, InvoiceData, cache, limiter)
+        issues = fast_issues(payload)
+    except AuthenticationError:
+        raise
+    except (OpenAIError, ValueError) as e:
+        payload, issues = None, fast_issues(error=e)
+    fast_seconds = time.perf_counter() - started
+    if fast_accepted(operation, issues, fast_seconds):
+        return payload
+
+    if repair_enabled(document_text):
+        repaired = await repair_invoice_async(client, payload, document_text, issues, cache=cache, limiter=limiter)
+        if repaired is not None:
+            return repaired
+
+    log_escalation(operation, issues, fast_seconds)
+    started = time.perf_counter()
+    payload = await _parse_response_async(client, operation, instructions, PDF_INVOICE_MODEL, input, InvoiceData, cache, limiter)
+    log_escalated(operation, time.perf_counter() - started)
+    return await _checked_async(client, payload, document_text, cache, limiter)
+
+
+async def invoice_label_async(message_text: str, attachments: list, client: Optional[AsyncOpenAI] = None,
+                              cache: Optional[LLMCache] = None, limiter: Optional[AsyncRateLimiter] = None):
+    """Classify an email (async invoice_label)"""
+    if client is None:
+        try:
+            client = AsyncOpenAI()
+        except OpenAIError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return None
+
+    try:
+        parsed = await _parse_response_async(
+            client,
+            operation="invoice_label",
+            instructions=LABEL_PROMPT,
+            model=LABEL_MODEL,
+            input=label_input(message_text, attachments),
+            text_format=LabelSort,
+            cache=cache,
+            limiter=limiter,
+        )
+    except AuthenticationError as e:
+        logger.error("OpenAI auth failed: %s", e)
+        return None
+    return parsed.label
+
+
+async def pdf_invoice_async(message_text: str, text, client: Optional[AsyncOpenAI] = None, customers_context: Optional[str] = None,
+                            cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING,
+                            limiter: Optional[AsyncRateLimiter] = None) -> InvoiceDraft:
+    """Extract invoice data from PDF text (async pdf_invoice)"""
+    if client is None:
+        client = AsyncOpenAI()
+
+    payload = await _extract_invoice_async(
+        client,
+        operation="pdf_invoice",
+        instructions=PDF_INVOICE_PROMPT,
+        input=pdf_invoice_input(text, customers_context),
+        cache=cache,
+        routing=routing,
+        limiter=limiter,
+        document_text=text,
+    )
+    return draft_from_payload(payload)
+
+
+async def _image_input_async(client: AsyncOpenAI, image: PreparedImage, inline_max_bytes: int) -> dict:
+    if len(image.data) <= inline_max_bytes:
+        return inline_image_part(image)
+
+    file_id = await upload_vision_file_async(client, image.filename, image.data, image.mime_type)
+    return {
+        "type": "input_image",
+        "file_id": file_id,
+    }
+
+
+async def ai_invoice_async(message_text: str, file_path: Optional[str] = None, client: Optional[AsyncOpenAI] = None,
+                           customers_context: Optional[str] = None, page_paths: Optional[List[str]] = None,
+                           max_pages: int = MAX_VISION_PAGES, preprocess: bool = True,
+                           inline_max_bytes: int = INLINE_IMAGE_MAX_BYTES, image_data: Optional[bytes] = None,
+                           image_name: str = "image.jpg", cache: Optional[LLMCache] = None,
+                           routing: bool = INVOICE_MODEL_ROUTING,
+                           limiter: Optional[AsyncRateLimiter] = None) -> Optional[InvoiceDraft]:
+    """Extract invoice data from page images (async ai_invoice)
+
+    Image decoding and resizing run in a worker thread so they do not
+    block other calls on the event loop.
+    """
+    if client is None:
+        client = AsyncOpenAI()
+
+    images = await asyncio.to_thread(prepare_invoice_images, file_path, page_paths, max_pages, preprocess, image_data, image_name)
+    image_parts = [await _image_input_async(client, image, inline_max_bytes) for image in images]
+
+    payload = await _extract_invoice_async(
+        client,
+        operation="ai_invoice",
+        instructions=IMAGE_INVOICE_PROMPT,
+        input=invoice_image_input(image_parts, customers_context),
+        cache=cache,
+        routing=routing,
+        limiter=limiter,
+    )
+    return draft_from_payload(payload)
+
+
+async def parse_shipping_async(message_text: str, attachments: list, client: Optional[AsyncOpenAI] = None,
+                               cache: Optional[LLMCache] = None,
+                               limiter: Optional[AsyncRateLimiter] = None) -> Optional[ShippingData]:
+    """Extract shipping data from an email (async parse_shipping)"""
+    if client is None:
+        try:
+            client = AsyncOpenAI()
+        except OpenAIError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return None
+
+    try:
+        return await _parse_response_async(
+            client,
+            operation="parse_shipping",
+            instructions=SHIPPING_PROMPT,
+            model=LABEL_MODEL,
+            input=shipping_input(message_text, attachments),
+            text_format=ShippingData,
+            cache=cache,
+            limiter=limiter,
+        )
+    except AuthenticationError as e:
+        logger.error("OpenAI auth failed: %s", e)
+        return None
+
+
+async def parse_client_communication_async(message_text: str, attachments: list, client: Optional[AsyncOpenAI] = None,
+                                           cache: Optional[LLMCache] = None,
+                                           limiter: Optional[AsyncRateLimiter] = None) -> Optional[ClientData]:
+    """Extract client communication data from an email (async parse_client_communication)"""
+    if client is None:
+        try:
+            client = AsyncOpenAI()
+        except OpenAIError as e:
+            logger.error("OpenAI auth failed: %s", e)
+            return None
+
+    try:
+        return await _parse_response_async(
+            client,
+            operation="parse_client_communication",
+            instructions=CLIENT_PROMPT,
+            model=LABEL_MODEL,
+            input=client_communication_input(message_text, attachments),
+            text_format=ClientData,
+            cache=cache,
+            limiter=limiter,
+        )
+    except AuthenticationError as e:
+        logger.error("OpenAI auth failed: %s", e)
+        return None
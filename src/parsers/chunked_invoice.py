@@ -0,0 +1,207 @@
+"""Map-reduce extraction for very long text-PDF invoices.
+
+A takeoff or statement running to dozens of pages of line items is too
+long to send as one pdf_invoice request, and page selection would drop
+the item pages that do not fit. Instead:
+
+- map: the pages holding line items are cut into chunks of about
+  MAP_REDUCE_CHUNK_TOKENS and each chunk's items are extracted in its
+  own request, in parallel
+- header: the first and last pages go in one more request for the
+  vendor, invoice number, dates, job site and totals
+- reduce: the chunks' items are joined in page order. Each chunk repeats
+  the last few lines of the one before it so a row cut at a boundary is
+  seen whole; items read twice there are dropped. The merged items are
+  then checked against total_amount like any other extraction.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from openai import OpenAI, OpenAIError, AuthenticationError
+
+from models.invoice import InvoiceData, InvoiceDraft, InvoiceHeader, LineItemChunk
+from parsers.ai_parser import (
+    CUSTOMER_MATCH_PROMPT,
+    FAST_INVOICE_MODEL,
+    INVOICE_MODEL_ROUTING,
+    PDF_INVOICE_MODEL,
+    _customers_block,
+    _parse_response,
+    draft_from_payload,
+)
+from parsers.invoice_checks import check_invoice
+from parsers.page_selection import score_page_text
+from services.llm_cache import LLMCache
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Documents above this many tokens are extracted in chunks
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "12000"))
+# Line-item text per chunk request, and lines repeated at each boundary
+MAP_REDUCE_CHUNK_TOKENS = int(os.getenv("MAP_REDUCE_CHUNK_TOKENS", "4000"))
+MAP_REDUCE_OVERLAP_LINES = int(os.getenv("MAP_REDUCE_OVERLAP_LINES", "3"))
+MAP_REDUCE_WORKERS = int(os.getenv("MAP_REDUCE_WORKERS", "4"))
+
+HEADER_PROMPT = (
+    "Extract the invoice header from the first and last pages of a long invoice. "
+    "The line items are extracted separately - do not list them. "
+    "IMPORTANT: Determine if this is an INVOICE (requesting payment, unpaid) or RECEIPT (already paid, shows 'PAID', 'SOLD ON', etc.). "
+    "Set is_receipt=true if it's a receipt/already paid. "
+    "Look for any job site address, project address, or service location - extract as job_site_address. "
+    "Take tax and total_amount from the invoice totals. "
+    "REQUIRED: vendor_display_name, total_amount, is_receipt. "
+    "OPTIONAL: invoice_number, invoice_date (format: MM/DD/YYYY), due_date (format: MM/DD/YYYY), tax, memo, job_site_address, customer_name. "
+    "Return all dates in MM/DD/YYYY format."
+) + CUSTOMER_MATCH_PROMPT
+
+CHUNK_ITEMS_PROMPT = (
+    "Extract the line items from this excerpt of a long invoice, in the order they appear. "
+    "The excerpt may start or end partway through the line-item table; extract every complete item row it contains, "
+    "including rows at the very start that repeat the end of the previous excerpt. "
+    "Do not include subtotal, tax, total, balance or payment rows. "
+    "For each line item, categorize it (e.g., Materials, Labor, Equipment, Fuel, Permits, Supplies, etc.) based on the item description. "
+    "REQUIRED for each item: item, rate, quantity, category. If the excerpt holds no line items, return an empty list."
+)
+
+
+def header_input(pages: List[str], customers_context: Optional[str] = None) -> list:
+    """Build the request input for the header fields: first and last page"""
+    shown = pages[:1] + pages[-1:] if len(pages) > 1 else pages
+    labels = f"pages 1 and {len(pages)}" if len(pages) > 1 else "page 1"
+    return [
+        {"role": "system", "content": HEADER_PROMPT},
+        {
+            "role": "user",
+            "content": f"{_customers_block(customers_context)}Invoice document ({labels} of {len(pages)}):\n" + "\n\n".join(shown),
+        },
+    ]
+
+
+def chunk_input(chunk: str) -> list:
+    """Build the request input for the line items in one chunk"""
+    return [
+        {"role": "system", "content": CHUNK_ITEMS_PROMPT},
+        {"role": "user", "content": f"Invoice excerpt:\n{chunk}"},
+    ]
+
+
+def plan_chunks(pages: List[str], chunk_tokens: int = MAP_REDUCE_CHUNK_TOKENS, overlap_lines: int = MAP_REDUCE_OVERLAP_LINES) -> List[str]:
+    """Cut the line-item pages into chunks of about chunk_tokens
+
+    Pages scoring zero in score_page_text (terms, marketing, blank
+    pages) are left out. Chunks break between lines, and every chunk
+    after the first starts with the last overlap_lines lines of the one
+    before it.
+    """
+    lines = [
+        line
+        for page in pages
+        if score_page_text(page) > 0
+        for line in page.splitlines()
+        if line.strip()
+    ]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    tokens = 0
+    fresh = 0  # lines in the current chunk not carried over from the last one
+    for line in lines:
+        line_tokens = estimate_tokens(line) + 1
+        if fresh and tokens + line_tokens > chunk_tokens:
+            chunks.append("\n".join(current))
+            current = current[-overlap_lines:] if overlap_lines > 0 else []
+            tokens = sum(estimate_tokens(carried) + 1 for carried in current)
+            fresh = 0
+        current.append(line)
+        tokens += line_tokens
+        fresh += 1
+    if fresh:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _item_key(line) -> tuple:
+    return (" ".join(line.item.lower().split()), round(line.rate, 2), round(line.quantity, 4))
+
+
+def merge_line_items(chunks: List[list], max_overlap: int = MAP_REDUCE_OVERLAP_LINES) -> list:
+    """Join the chunks' line items, dropping rows read twice at a boundary
+
+    Where the start of a chunk repeats the end of the items so far (same
+    item, rate and quantity, at most max_overlap rows), the repeat is
+    dropped. Identical rows elsewhere are kept - invoices do list the
+    same item twice.
+    """
+    merged: list = []
+    for items in chunks:
+        keys = [_item_key(line) for line in items]
+        tail = [_item_key(line) for line in merged[-max_overlap:]] if max_overlap > 0 else []
+        overlap = 0
+        for size in range(min(len(tail), len(keys)), 0, -1):
+            if tail[-size:] == keys[:size]:
+                overlap = size
+                break
+        if overlap:
+            logger.debug("Dropped %d line items repeated at a chunk boundary", overlap)
+        merged.extend(items[overlap:])
+    return merged
+
+
+def _map_reduce(client: OpenAI, model: str, pages: List[str], chunks: List[str], customers_context: Optional[str], cache: Optional[LLMCache], workers: int) -> Optional[InvoiceData]:
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks) + 1))) as pool:
+        header_future = pool.submit(
+            _parse_response, client, "pdf_invoice_header", HEADER_PROMPT, model,
+            header_input(pages, customers_context), InvoiceHeader, cache,
+        )
+        chunk_futures = [
+            pool.submit(_parse_response, client, "pdf_invoice_chunk", CHUNK_ITEMS_PROMPT, model, chunk_input(chunk), LineItemChunk, cache)
+            for chunk in chunks
+        ]
+        header = header_future.result()
+        items = [future.result() for future in chunk_futures]
+
+    if header is None or any(chunk is None for chunk in items):
+        return None
+    line_items = merge_line_items([chunk.line_items for chunk in items])
+    return InvoiceData(line_items=line_items, **header.model_dump())
+
+
+def chunked_pdf_invoice(pages: List[str], client: Optional[OpenAI] = None, customers_context: Optional[str] = None, cache: Optional[LLMCache] = None, routing: bool = INVOICE_MODEL_ROUTING, chunk_tokens: int = MAP_REDUCE_CHUNK_TOKENS, overlap_lines: int = MAP_REDUCE_OVERLAP_LINES, workers: int = MAP_REDUCE_WORKERS) -> Optional[InvoiceDraft]:
+    """Extract a long text-PDF invoice in chunks (one text per page)
+
+    With routing, every request goes to the fast model first; if the
+    merged invoice fails check_invoice (most often: the items do not add
+    up to total_amount) the whole document is redone by the strong model.
+    """
+    if client is None:
+        client = OpenAI()
+
+    chunks = plan_chunks(pages, chunk_tokens, overlap_lines)
+    logger.info("Extracting a %d-page invoice in %d chunks", len(pages), len(chunks))
+
+    if routing and FAST_INVOICE_MODEL != PDF_INVOICE_MODEL:
+        try:
+            payload = _map_reduce(client, FAST_INVOICE_MODEL, pages, chunks, customers_context, cache, workers)
+            issues = check_invoice(payload)
+        except AuthenticationError:
+            raise
+        except (OpenAIError, ValueError) as e:
+            payload, issues = None, [f"fast model call failed: {e}"]
+        if not issues:
+            return draft_from_payload(payload)
+        logger.info(
+            "chunked pdf_invoice escalating from %s to %s: %s",
+            FAST_INVOICE_MODEL, PDF_INVOICE_MODEL, "; ".join(str(issue) for issue in issues),
+        )
+
+    payload = _map_reduce(client, PDF_INVOICE_MODEL, pages, chunks, customers_context, cache, workers)
+    if payload is None:
+        return None
+    issues = check_invoice(payload)
+    if issues:
+        logger.warning("Chunked invoice extraction has problems: %s", "; ".join(str(issue) for issue in issues))
+    return draft_from_payload(payload)
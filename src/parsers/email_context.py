@@ -0,0 +1,122 @@
+"""Token-budgeted email context for parse_shipping and parse_client_communication.
+
+Both used to send the email body followed by the full text of every
+attachment, so a 40-page PDF on a client email became a 40-page prompt.
+build_email_context keeps the same layout but fits it into a budget:
+
+- the email body comes first and is guaranteed EMAIL_BODY_MAX_TOKENS,
+  plus whatever the attachments leave unused
+- each text attachment gets at most ATTACHMENT_MAX_TOKENS, and the
+  attachments share what is left fairly - a short one keeps all of its
+  text, long ones split the rest
+- anything cut is cut from the middle, so a document keeps its opening
+  (sender, references) and its end (totals, signatures, tracking footers)
+
+Tokens are estimated locally (utils/tokens.py). email_input builds the
+full request and keeps system prompt plus context under
+EMAIL_PROMPT_MAX_TOKENS.
+"""
+
+import logging
+import os
+from typing import List, Optional
+
+from utils.tokens import CHARS_PER_TOKEN, estimate_tokens, truncate_middle
+
+logger = logging.getLogger(__name__)
+
+# Whole prompt (instructions + email), the body's reserved share, and the cap per attachment
+EMAIL_PROMPT_MAX_TOKENS = int(os.getenv("EMAIL_PROMPT_MAX_TOKENS", "8000"))
+EMAIL_BODY_MAX_TOKENS = int(os.getenv("EMAIL_BODY_MAX_TOKENS", "4000"))
+ATTACHMENT_MAX_TOKENS = int(os.getenv("ATTACHMENT_MAX_TOKENS", "3000"))
+
+ATTACHMENTS_HEADING = "\n\nAttachment contents:\n"
+
+
+def _header(filename: str, data) -> str:
+    if isinstance(data, str):
+        return f"\n--- {filename} ---\n"
+    return f"\n--- {filename} (binary file) ---\n"
+
+
+def share_budget(sizes: List[int], budget: int, cap: int) -> List[int]:
+    """Split budget over items of the given sizes, each getting at most cap
+
+    Items needing less than an equal share keep all they need; what they
+    leave over is split among the rest.
+    """
+    wants = [min(size, cap) for size in sizes]
+    shares = [0] * len(sizes)
+    pending = sorted(range(len(sizes)), key=lambda index: wants[index])
+    remaining = max(budget, 0)
+    while pending:
+        fair = remaining // len(pending)
+        index = pending.pop(0)
+        shares[index] = min(wants[index], fair)
+        remaining -= shares[index]
+    return shares
+
+
+def build_email_context(message_text: str, attachments: list, max_tokens: int = EMAIL_PROMPT_MAX_TOKENS,
+                        body_tokens: int = EMAIL_BODY_MAX_TOKENS, attachment_tokens: int = ATTACHMENT_MAX_TOKENS) -> str:
+    """Email body followed by the text of each attachment, within max_tokens
+
+    Binary attachments are listed by name only. When nothing is over its
+    budget the text is exactly what the unbounded version produced.
+    """
+    message_text = message_text or ""
+    attachments = list(attachments or [])
+
+    # Headings are small but not free. Past the body's reserve, attachments
+    # whose heading no longer fits are left out.
+    overhead = estimate_tokens(ATTACHMENTS_HEADING) if attachments else 0
+    reserve = min(body_tokens, estimate_tokens(message_text))
+    headers: List[str] = []
+    for filename, data in attachments:
+        header = _header(filename, data)
+        cost = estimate_tokens(header) + 1  # +1: the newline after the text
+        if overhead + cost > max_tokens - reserve:
+            break
+        headers.append(header)
+        overhead += cost
+    kept = attachments[:len(headers)]
+    if not kept:
+        overhead = 0
+
+    available = max(max_tokens - overhead, 0)
+    texts = [data if isinstance(data, str) else "" for _, data in kept]
+    sizes = [estimate_tokens(text) for text in texts]
+    needed = sum(min(size, attachment_tokens) for size in sizes)
+
+    # The body keeps its reserve, plus anything the attachments do not need
+    body = truncate_middle(message_text, min(available, max(body_tokens, available - needed)))
+    shares = share_budget(sizes, available - estimate_tokens(body), attachment_tokens)
+
+    context = body
+    if kept:
+        context += ATTACHMENTS_HEADING
+        for header, text, share in zip(headers, texts, shares):
+            context += header
+            if text:
+                context += f"{truncate_middle(text, share)}\n"
+
+    # Per-piece rounding should already keep it under; the limit is hard regardless
+    context = context[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+
+    cut = len(body) < len(message_text) or len(kept) < len(attachments) or any(share < size for share, size in zip(shares, sizes))
+    if cut:
+        logger.info(
+            "Email context cut to %d tokens (limit %d): %d of %d attachments included",
+            estimate_tokens(context), max_tokens, len(kept), len(attachments),
+        )
+    return context
+
+
+def email_input(instructions: str, message_text: str, attachments: list, max_prompt_tokens: Optional[int] = None) -> list:
+    """Request input for an email extraction, system prompt plus budgeted context"""
+    max_prompt_tokens = EMAIL_PROMPT_MAX_TOKENS if max_prompt_tokens is None else max_prompt_tokens
+    context = build_email_context(message_text, attachments, max_tokens=max_prompt_tokens - estimate_tokens(instructions))
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": context},
+    ]
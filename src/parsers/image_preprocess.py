@@ -0,0 +1,170 @@
+"""Shrink invoice images before they are sent to the vision model.
+
+Phone photos of receipts are often 12MP PNGs. The vision model only
+sees a downscaled copy anyway, so uploading the full image just costs
+upload time and latency. This stage resizes to the resolution the model
+actually uses, optionally drops colour and re-encodes as JPEG.
+"""
+
+import io
+import logging
+import math
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# High-detail vision inputs are scaled to fit 2048x2048 and then to a
+# 768px shortest side, so anything larger is thrown away by the provider.
+VISION_MAX_LONG_SIDE = int(os.getenv("VISION_MAX_LONG_SIDE", "2048"))
+VISION_MAX_SHORT_SIDE = int(os.getenv("VISION_MAX_SHORT_SIDE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+VISION_GRAYSCALE = os.getenv("VISION_GRAYSCALE", "true").lower() in ("1", "true", "yes")
+
+_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+@dataclass
+class PreparedImage:
+    """An image ready for upload, with before/after size accounting."""
+    filename: str
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_tokens: int
+    tokens: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+def estimate_vision_tokens(width: int, height: int) -> int:
+    """Estimate high-detail vision input tokens for an image size.
+
+    Mirrors the provider's tiling rules: fit within 2048x2048, scale the
+    shortest side down to 768, then charge 170 tokens per 512px tile
+    plus a fixed 85.
+    """
+    if width <= 0 or height <= 0:
+        return 0
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def _target_size(width: int, height: int, max_long: int, max_short: int):
+    """Return the downscaled size that fits both side limits."""
+    scale = min(
+        1.0,
+        max_long / max(width, height),
+        max_short / min(width, height),
+    )
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def _read_source(source: Union[str, Path, bytes], filename: Optional[str]) -> Tuple[bytes, str]:
+    """Return (bytes, filename) for a path or for raw image bytes."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source), filename or "image"
+    path = Path(source)
+    return path.read_bytes(), filename or path.name
+
+
+def load_image(source: Union[str, Path, bytes], filename: Optional[str] = None) -> PreparedImage:
+    """Wrap an image unchanged, for callers that skip preprocessing."""
+    data, filename = _read_source(source, filename)
+    with Image.open(io.BytesIO(data)) as img:
+        tokens = estimate_vision_tokens(img.width, img.height)
+    return PreparedImage(
+        filename=filename,
+        data=data,
+        mime_type=_MIME_TYPES.get(Path(filename).suffix.lower(), "application/octet-stream"),
+        original_bytes=len(data),
+        original_tokens=tokens,
+        tokens=tokens,
+    )
+
+
+def preprocess_image(
+    source: Union[str, Path, bytes],
+    filename: Optional[str] = None,
+    max_long_side: int = VISION_MAX_LONG_SIDE,
+    max_short_side: int = VISION_MAX_SHORT_SIDE,
+    quality: int = VISION_JPEG_QUALITY,
+    grayscale: bool = VISION_GRAYSCALE,
+) -> PreparedImage:
+    """Downscale, optionally grayscale and JPEG re-encode an image.
+
+    source is a file path or the raw image bytes (with filename used for
+    naming and content type). If re-encoding would not make the file
+    smaller and no resize was needed, the original bytes are kept.
+    """
+    original, filename = _read_source(source, filename)
+    path = Path(filename)
+
+    with Image.open(io.BytesIO(original)) as img:
+        # Phone photos store rotation in EXIF; bake it in before resizing
+        img = ImageOps.exif_transpose(img)
+        original_tokens = estimate_vision_tokens(img.width, img.height)
+
+        size = _target_size(img.width, img.height, max_long_side, max_short_side)
+        resized = size != (img.width, img.height)
+        if resized:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+
+        img = img.convert("L") if grayscale else img.convert("RGB")
+
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        encoded = buffer.getvalue()
+        tokens = estimate_vision_tokens(img.width, img.height)
+
+    if not resized and len(encoded) >= len(original):
+        prepared = PreparedImage(
+            filename=path.name,
+            data=original,
+            mime_type=_MIME_TYPES.get(path.suffix.lower(), "application/octet-stream"),
+            original_bytes=len(original),
+            original_tokens=original_tokens,
+            tokens=original_tokens,
+        )
+    else:
+        prepared = PreparedImage(
+            filename=f"{path.stem}.jpg",
+            data=encoded,
+            mime_type="image/jpeg",
+            original_bytes=len(original),
+            original_tokens=original_tokens,
+            tokens=tokens,
+        )
+
+    logger.info(
+        "Prepared %s: %d -> %d bytes (saved %d), ~%d -> ~%d vision tokens (saved %d)",
+        path.name,
+        prepared.original_bytes,
+        len(prepared.data),
+        prepared.bytes_saved,
+        prepared.original_tokens,
+        prepared.tokens,
+        prepared.tokens_saved,
+    )
+    return prepared
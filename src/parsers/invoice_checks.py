@@ -0,0 +1,80 @@
+"""Sanity checks on extracted invoice data.
+
+Used to decide whether a cheap model's extraction can be trusted or has
+to be redone by a stronger model. Each problem is reported against the
+InvoiceData field it concerns.
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from models.invoice import InvoiceData
+
+# Allowed gap between the line items (plus tax) and the stated total
+TOTAL_TOLERANCE = float(os.getenv("INVOICE_TOTAL_TOLERANCE", "0.02"))
+TOTAL_TOLERANCE_RATIO = float(os.getenv("INVOICE_TOTAL_TOLERANCE_RATIO", "0.005"))
+
+DATE_FORMAT = "%m/%d/%Y"
+
+
+@dataclass
+class InvoiceIssue:
+    """One problem with an extraction, tied to the field it concerns."""
+    field: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.field}: {self.message}"
+
+
+def parse_invoice_date(value: str) -> Optional[datetime]:
+    """Parse an MM/DD/YYYY date, returning None if it does not parse."""
+    try:
+        return datetime.strptime(value.strip(), DATE_FORMAT)
+    except (ValueError, AttributeError):
+        return None
+
+
+def line_items_total(payload: InvoiceData) -> float:
+    return sum(line.amount for line in payload.line_items)
+
+
+def totals_match(payload: InvoiceData) -> bool:
+    """Check the line items add up to the total, with or without tax."""
+    if payload.total_amount is None:
+        return False
+    subtotal = line_items_total(payload)
+    tolerance = max(TOTAL_TOLERANCE, abs(payload.total_amount) * TOTAL_TOLERANCE_RATIO)
+    candidates = [subtotal]
+    if payload.tax:
+        candidates.append(subtotal + payload.tax)
+    return any(abs(candidate - payload.total_amount) <= tolerance for candidate in candidates)
+
+
+def check_invoice(payload: Optional[InvoiceData]) -> List[InvoiceIssue]:
+    """Return every problem found in an extraction (empty if it looks right)."""
+    if payload is None:
+        return [InvoiceIssue("*", "no output")]
+
+    issues = []
+    if not payload.vendor_display_name or not payload.vendor_display_name.strip():
+        issues.append(InvoiceIssue("vendor_display_name", "missing"))
+    if not payload.line_items:
+        issues.append(InvoiceIssue("line_items", "no line items"))
+    if payload.total_amount is None:
+        issues.append(InvoiceIssue("total_amount", "missing"))
+    elif payload.line_items and not totals_match(payload):
+        issues.append(InvoiceIssue(
+            "total_amount",
+            f"line items sum to {line_items_total(payload):.2f}"
+            f"{f' (+{payload.tax:.2f} tax)' if payload.tax else ''}, total is {payload.total_amount:.2f}",
+        ))
+
+    for field in ("invoice_date", "due_date"):
+        value = getattr(payload, field)
+        if value and parse_invoice_date(value) is None:
+            issues.append(InvoiceIssue(field, f"{value!r} is not MM/DD/YYYY"))
+
+    return issues
@@ -0,0 +1,173 @@
+"""Cut a text PDF down to the parts an invoice extraction needs.
+
+pdf_invoice used to receive the whole text layer, including pages of
+terms and conditions, remittance stubs and marketing. Here pdfplumber's
+table detection finds the line-item table (a table whose first row
+reads like "Qty / Description / Price / Amount"), and only three
+regions are kept:
+
+- the header block: everything above the line-item table on its first
+  page (vendor, invoice number, dates, bill-to and job site), plus the
+  full text of any cover or summary pages before it
+- the line-item table on every page it continues onto: a table with its
+  own item headings, or a page's first table when it has the columns of
+  the first line-item table
+- the totals: the lines below the table that carry a total keyword or
+  an amount
+
+When no line-item table is found, or nothing that looks like a total
+survives, compact_invoice_text returns None and the full text is sent
+as before.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from parsers.pdf_parser import PdfSource, open_pdf
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Lines kept from below the line-item table
+TOTALS_MAX_LINES = int(os.getenv("TOTALS_MAX_LINES", "15"))
+
+# Column headings that mark a line-item table (two are needed)
+LINE_ITEM_HEADINGS = re.compile(
+    r"\b(qty|quantity|description|item|items|price|rate|unit|amount|total|ext|extended|hours|um|each)\b",
+    re.IGNORECASE,
+)
+
+TOTAL_WORDS = re.compile(r"\b(sub\s?total|total|tax|amount due|balance|please pay|paid|deposit|freight|shipping|discount)\b", re.IGNORECASE)
+AMOUNT = re.compile(r"\$?\d[\d,]*\.\d{2}\b")
+
+# Continuation tables on later pages line up with the first one
+_COLUMN_SLACK = 12.0
+
+
+@dataclass
+class CompactInvoice:
+    """The regions sent to the model, and what leaving the rest out saved."""
+    text: str
+    full_tokens: int
+    compact_tokens: int
+    pages: int
+    item_tables: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(self.full_tokens - self.compact_tokens, 0)
+
+    @property
+    def saved_share(self) -> float:
+        return self.saved_tokens / self.full_tokens if self.full_tokens else 0.0
+
+
+def _clean(text: Optional[str]) -> str:
+    lines = (" ".join(line.split()) for line in (text or "").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _is_item_table(table) -> bool:
+    rows = table.extract()
+    if not rows or len(rows) < 2:
+        return False
+    heading = " ".join(cell or "" for cell in rows[0])
+    return len({match.lower() for match in LINE_ITEM_HEADINGS.findall(heading)}) >= 2
+
+
+def _columns(table) -> int:
+    return max((len(row) for row in table.extract()), default=0)
+
+
+def _continuation(tables: list, first):
+    """The table carrying the line items over from an earlier page, or None
+
+    Only a page's first table can be one. Terms grids and remittance stubs
+    lower down often span the same width, so the edges alone are not
+    enough: the column count has to match too.
+    """
+    if not tables:
+        return None
+    table = tables[0]
+    lined_up = abs(table.bbox[0] - first.bbox[0]) <= _COLUMN_SLACK and abs(table.bbox[2] - first.bbox[2]) <= _COLUMN_SLACK
+    return table if lined_up and _columns(table) == _columns(first) else None
+
+
+def _totals_lines(text: str, max_lines: int = TOTALS_MAX_LINES) -> List[str]:
+    kept = [line for line in _clean(text).splitlines() if TOTAL_WORDS.search(line) or AMOUNT.search(line)]
+    return kept[:max_lines]
+
+
+def compact_invoice_text(pdf_source: PdfSource, pages: Optional[List[str]] = None) -> Optional[CompactInvoice]:
+    """Header, line-item tables and totals of a text PDF, or None to send it all.
+
+    pages is the text of each page when the caller has already extracted
+    it, so it is not extracted again. None is also returned when the
+    regions are no smaller than the text.
+    """
+
+    full_text = []
+    cover_pages: List[str] = []
+    header = ""
+    item_sections = []
+    totals: List[str] = []
+    first_table = None
+    with open_pdf(pdf_source) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            full_text.append(pages[number - 1] if pages is not None else page.extract_text() or "")
+            tables = sorted(page.find_tables(), key=lambda table: table.bbox[1])
+            items = [table for table in tables if _is_item_table(table)]
+            if first_table is not None:
+                carried = _continuation(tables, first_table)
+                if carried is not None and carried not in items:
+                    items.insert(0, carried)
+            if not items:
+                if first_table is None:
+                    # Cover and summary pages hold header fields too
+                    cover_pages.append(_clean(full_text[-1]))
+                continue
+
+            if first_table is None:
+                first_table = items[0]
+                above = _clean(page.crop((0, 0, page.width, items[0].bbox[1])).extract_text())
+                header = "\n".join(part for part in cover_pages + [above] if part)
+            for table in items:
+                item_sections.append(f"Line items (page {number}):\n{_clean(page.crop(table.bbox).extract_text())}")
+
+            # Only the last page with line items has the totals below them
+            below = page.crop((0, min(items[-1].bbox[3], page.height), page.width, page.height))
+            totals = _totals_lines(below.extract_text())
+        page_count = len(pdf.pages)
+
+    if first_table is None:
+        return None
+
+    sections = [f"Header:\n{header}"] if header else []
+    sections.extend(item_sections)
+    if totals:
+        sections.append("Totals:\n" + "\n".join(totals))
+    text = "\n\n".join(sections)
+
+    # Totals printed inside the table are fine; none anywhere means we cut too much
+    if not TOTAL_WORDS.search("\n".join(item_sections + totals)):
+        logger.info("No totals found next to the line-item table, sending the full text")
+        return None
+
+    compact = CompactInvoice(
+        text=text,
+        full_tokens=estimate_tokens("\n".join(full_text)),
+        compact_tokens=estimate_tokens(text),
+        pages=page_count,
+        item_tables=len(item_sections),
+    )
+    if compact.compact_tokens >= compact.full_tokens:
+        logger.info("Layout extraction saved nothing on a %d-token document, sending the full text", compact.full_tokens)
+        return None
+    logger.info(
+        "Layout extraction kept %d of %d tokens (%.0f%% saved) from %d pages",
+        compact.compact_tokens, compact.full_tokens, compact.saved_share * 100, page_count,
+    )
+    return compact
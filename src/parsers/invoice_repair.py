@@ -0,0 +1,144 @@
+"""Targeted fixes for invoice extractions that fail check_invoice.
+
+Redoing the whole extraction on the strong model to fix one bad date or
+a total that does not add up resends the entire document. Instead, each
+InvoiceIssue is mapped to the InvoiceData fields that can fix it, and a
+small follow-up request gets only those fields' current values and the
+lines of the document they come from:
+
+- vendor_display_name: the first lines of the document
+- invoice_date / due_date: the lines mentioning dates
+- line_items / tax / total_amount: the lines carrying amounts
+
+The corrected values are patched into the draft; every other field is
+left as extracted. One repair never changes both the line items and the
+total, so the check that they agree still means something, and line
+items are only re-asked when every amount line fits in the snippet.
+Anything else goes to a full re-extraction. The request itself is made
+by ai_parser.repair_invoice.
+"""
+
+import json
+import os
+import re
+from typing import Iterable, List
+
+from models.invoice import InvoiceData, InvoiceFix
+from parsers.invoice_checks import InvoiceIssue
+from parsers.invoice_layout import AMOUNT
+from utils.tokens import estimate_tokens
+
+# Document text sent with a repair request, and header lines kept for the vendor
+REPAIR_SNIPPET_TOKENS = int(os.getenv("REPAIR_SNIPPET_TOKENS", "1500"))
+REPAIR_HEADER_LINES = int(os.getenv("REPAIR_HEADER_LINES", "8"))
+
+# Fields a follow-up request may change for a problem with each field. A
+# total that does not match the items is checked against the items again
+# with the total held as read; a missing total is read on its own.
+REPAIR_FIELDS = {
+    "vendor_display_name": ("vendor_display_name",),
+    "line_items": ("line_items",),
+    "total_amount": ("line_items", "tax"),
+    "invoice_date": ("invoice_date",),
+    "due_date": ("due_date",),
+}
+MISSING_TOTAL_FIELDS = ("tax", "total_amount")
+
+_DATE_LINE = re.compile(
+    r"\b(date|dated|due (date|on|by)|terms|net \d+)\b|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|"
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}",
+    re.IGNORECASE,
+)
+
+
+def fields_to_fix(issues: Iterable) -> List[str]:
+    """The InvoiceData fields to re-ask for, or [] if a targeted fix cannot help
+
+    Issues that are not tied to a field (no output at all, a failed call)
+    need a full re-extraction, and so do issues that would reopen both
+    the line items and the total.
+    """
+    fields: List[str] = []
+    for issue in issues:
+        if not isinstance(issue, InvoiceIssue) or issue.field not in REPAIR_FIELDS:
+            return []
+        missing_total = issue.field == "total_amount" and issue.message == "missing"
+        for field in MISSING_TOTAL_FIELDS if missing_total else REPAIR_FIELDS[issue.field]:
+            if field not in fields:
+                fields.append(field)
+    if "line_items" in fields and "total_amount" in fields:
+        return []
+    return fields
+
+
+def _fits(lines: List[str], max_tokens: int) -> bool:
+    return estimate_tokens("\n".join(lines)) <= max_tokens
+
+
+def _fit(lines: List[str], max_tokens: int) -> List[str]:
+    """Keep lines from both ends (header and totals) until max_tokens is used"""
+    if _fits(lines, max_tokens):
+        return lines
+    head: List[str] = []
+    tail: List[str] = []
+    used = 0
+    low, high = 0, len(lines) - 1
+    take_head = True
+    while low <= high:
+        line = lines[low] if take_head else lines[high]
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        used += cost
+        if take_head:
+            head.append(line)
+            low += 1
+        else:
+            tail.insert(0, line)
+            high -= 1
+        take_head = not take_head
+    return head + ["..."] + tail
+
+
+def repair_snippet(text: str, fields: Iterable[str], max_tokens: int = REPAIR_SNIPPET_TOKENS) -> str:
+    """The lines of the document relevant to fields, in document order
+
+    Returns "" when none of the document speaks to the fields - a
+    targeted fix has nothing to work from then - and when line items are
+    asked for but their lines do not all fit in max_tokens, since items
+    missing from the snippet would be dropped by the fix.
+    """
+    fields = set(fields)
+    lines = [" ".join(line.split()) for line in (text or "").splitlines()]
+    lines = [line for line in lines if line]
+
+    keep = set()
+    if "vendor_display_name" in fields:
+        keep.update(range(min(REPAIR_HEADER_LINES, len(lines))))
+    if fields & {"invoice_date", "due_date"}:
+        keep.update(number for number, line in enumerate(lines) if _DATE_LINE.search(line))
+    if fields & {"line_items", "tax", "total_amount"}:
+        keep.update(number for number, line in enumerate(lines) if AMOUNT.search(line))
+
+    relevant = [lines[number] for number in sorted(keep)]
+    if "line_items" in fields and not _fits(relevant, max_tokens):
+        return ""
+    return "\n".join(_fit(relevant, max_tokens))
+
+
+def current_values(payload: InvoiceData, fields: Iterable[str]) -> str:
+    """The extracted values of fields, as JSON for the repair request"""
+    return json.dumps(payload.model_dump(include=set(fields)), indent=1, default=str)
+
+
+def apply_fix(payload: InvoiceData, fix: InvoiceFix, fields: Iterable[str]) -> InvoiceData:
+    """payload with the fixed values of fields patched in
+
+    Fields the fix leaves empty keep their extracted value.
+    """
+    update = {}
+    for field in fields:
+        value = getattr(fix, field)
+        if value is not None and value != []:
+            update[field] = value
+    return payload.model_copy(update=update)
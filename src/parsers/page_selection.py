@@ -0,0 +1,185 @@
+"""Pick which pages of a multi-page document are worth sending to the model.
+
+Scanned invoices often carry cover sheets, remittance stubs or blank
+backs alongside the pages that actually hold the line items and totals.
+Every image sent to the vision model costs tokens and latency, so we
+score pages cheaply with Pillow and keep the best ones up to a cap.
+
+Text PDFs get the same treatment from their text layer: pages are scored
+on invoice keywords and rows of figures, and the best are kept within a
+token budget. A page with rows of figures may hold line items, so it is
+never dropped; when those pages alone are over the budget the document
+has to be extracted in chunks (parsers/chunked_invoice.py) instead.
+"""
+
+import io
+import os
+import re
+from typing import List, Optional, Sequence, Union
+
+from PIL import Image
+
+from utils.tokens import estimate_tokens
+
+# A page image given as a file path or as raw encoded bytes
+PageSource = Union[str, bytes]
+
+# Maximum number of page images sent in a single vision call
+MAX_VISION_PAGES = int(os.getenv("MAX_VISION_PAGES", "4"))
+
+# Width the page is shrunk to before scoring (keeps scoring fast)
+_SCORE_WIDTH = 400
+
+# Row ink density thresholds: ruled table lines vs ordinary text rows
+_RULE_DENSITY = 0.6
+_TEXT_DENSITY = 0.02
+
+
+def _row_densities(image_path: PageSource) -> List[float]:
+    """Return the fraction of dark pixels in each row of a shrunken page."""
+    if isinstance(image_path, bytes):
+        image_path = io.BytesIO(image_path)
+    with Image.open(image_path) as img:
+        gray = img.convert("L")
+        ratio = _SCORE_WIDTH / max(gray.width, 1)
+        height = max(int(gray.height * ratio), 1)
+        gray = gray.resize((_SCORE_WIDTH, height))
+
+        # Dark pixels become 255 so a row's mean is its ink density
+        ink = gray.point(lambda p: 255 if p < 128 else 0)
+        rows = ink.resize((1, height), Image.Resampling.BOX)
+        return [value / 255 for value in rows.getdata()]
+
+
+def score_page_image(image_path: PageSource) -> float:
+    """Score how likely a page image is to hold line items or totals.
+
+    Ruled horizontal lines are a strong sign of a line-item table, and
+    the number of separate text bands reflects how much tabular content
+    the page carries. Blank or near-blank pages score zero.
+    """
+    densities = _row_densities(image_path)
+    if not densities:
+        return 0.0
+
+    ruled_lines = 0
+    text_bands = 0
+    previous = None
+    for density in densities:
+        if density >= _RULE_DENSITY:
+            kind = "rule"
+        elif density >= _TEXT_DENSITY:
+            kind = "text"
+        else:
+            kind = None
+
+        # Count runs of consecutive rows, not individual pixel rows
+        if kind != previous:
+            if kind == "rule":
+                ruled_lines += 1
+            elif kind == "text":
+                text_bands += 1
+        previous = kind
+
+    return ruled_lines * 2.0 + text_bands * 0.5
+
+
+def select_invoice_pages(image_paths: Sequence[PageSource], max_pages: int = MAX_VISION_PAGES) -> List[PageSource]:
+    """Choose up to max_pages page images, preserving document order.
+
+    The first page (vendor, invoice number, dates) and the last page
+    (totals) are always kept when they have any content. The remaining
+    slots go to the highest scoring pages in between.
+    """
+    paths = list(image_paths)
+    if max_pages <= 0 or len(paths) <= max_pages:
+        return paths
+
+    scores = [score_page_image(path) for path in paths]
+
+    chosen = []
+    for position in (0, len(paths) - 1):
+        if scores[position] > 0 and position not in chosen and len(chosen) < max_pages:
+            chosen.append(position)
+
+    middle = sorted(
+        (position for position in range(len(paths)) if position not in chosen),
+        key=lambda position: scores[position],
+        reverse=True,
+    )
+    for position in middle:
+        if len(chosen) >= max_pages:
+            break
+        if scores[position] > 0:
+            chosen.append(position)
+
+    # Every page was blank - fall back to the first pages
+    if not chosen:
+        chosen = list(range(max_pages))
+
+    return [paths[position] for position in sorted(chosen)]
+
+
+# Prompt tokens allowed for the pages of a text PDF
+PDF_PAGE_TOKEN_BUDGET = int(os.getenv("PDF_PAGE_TOKEN_BUDGET", "6000"))
+
+INVOICE_KEYWORDS = re.compile(
+    r"\b(total|sub\s?total|amount due|balance due|qty|quantity|invoice\s*(?:#|no\.?|number)|"
+    r"unit price|price|rate|amount|tax|due date|bill to|ship to|description)\b",
+    re.IGNORECASE,
+)
+_FIGURE = re.compile(r"(?<![\w.])\$?\d[\d,]*\.\d{2}(?![\w.])")
+
+
+def table_density(text: str) -> float:
+    """Share of a page's lines carrying two or more figures, like line-item rows"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    return sum(1 for line in lines if len(_FIGURE.findall(line)) >= 2) / len(lines)
+
+
+def score_page_text(text: str) -> float:
+    """Score how likely a page's text is to hold line items or totals.
+
+    Combines the density of invoice keywords (per 100 words) with the
+    share of lines carrying two or more figures, which is what line-item
+    rows look like. Terms and conditions, marketing and blank pages
+    score near zero.
+    """
+    words = len(text.split())
+    if not words or not text.strip():
+        return 0.0
+
+    keyword_density = len(INVOICE_KEYWORDS.findall(text)) * 100 / words
+    return min(keyword_density, 10.0) / 10 + table_density(text)
+
+
+def select_text_pages(page_texts: Sequence[str], token_budget: int = PDF_PAGE_TOKEN_BUDGET) -> Optional[List[int]]:
+    """Choose which pages of a text PDF to send, within a token budget.
+
+    Returns page indexes in document order. Documents that fit the budget
+    are sent whole. Otherwise the first page (vendor, invoice number,
+    dates) and every page with rows of figures are kept, and the highest
+    scoring other pages are added while they fit; pages scoring zero are
+    never sent. Returns None when the kept pages are already over the
+    budget, since trimming would lose line items.
+    """
+    costs = [estimate_tokens(text) for text in page_texts]
+    if sum(costs) <= token_budget:
+        return list(range(len(page_texts)))
+
+    chosen = [0] + [position for position in range(1, len(page_texts)) if table_density(page_texts[position]) > 0]
+    used = sum(costs[position] for position in chosen)
+    if used > token_budget:
+        return None
+
+    scores = [score_page_text(text) for text in page_texts]
+    others = [position for position in range(1, len(page_texts)) if position not in chosen]
+    for position in sorted(others, key=lambda position: scores[position], reverse=True):
+        if scores[position] <= 0:
+            break
+        if used + costs[position] <= token_budget:
+            chosen.append(position)
+            used += costs[position]
+    return sorted(chosen)
@@ -1,10 +1,49 @@
+import contextlib
+import io
+import mmap
+import os
 from pathlib import Path
+from typing import BinaryIO, Iterator, List, Union
 
 import pdfplumber
 
+# Files at least this large are memory-mapped instead of read into memory
+MMAP_THRESHOLD_BYTES = int(os.getenv("MMAP_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
 
-def extract_text_from_pdf(pdf_path: Path) -> str:
+# An already open pdfplumber document is accepted too, so one parse can serve several readers
+PdfSource = Union[str, Path, bytes, bytearray, memoryview, BinaryIO, pdfplumber.PDF]
+
+
+def open_file_stream(path: Union[str, Path]) -> BinaryIO:
+    """Open a file as a seekable stream, memory-mapping large files.
+
+    The caller closes the stream; use it in a with block.
+    """
+    path = Path(path)
+    if path.stat().st_size >= MMAP_THRESHOLD_BYTES:
+        with open(path, "rb") as handle:
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return io.BytesIO(path.read_bytes())
+
+
+@contextlib.contextmanager
+def open_pdf(pdf_path: PdfSource) -> Iterator[pdfplumber.PDF]:
+    """Open a PDF with pdfplumber; a document that is already open is used as is and left open."""
+    if isinstance(pdf_path, pdfplumber.PDF):
+        yield pdf_path
+        return
+    if isinstance(pdf_path, (bytes, bytearray, memoryview)):
+        pdf_path = io.BytesIO(pdf_path)
     with pdfplumber.open(pdf_path) as pdf:
-        return "\n".join(page.extract_text() or "" for page in pdf.pages)
+        yield pdf
+
+
+def extract_pages_from_pdf(pdf_path: PdfSource) -> List[str]:
+    """Extract the text layer of each page of a PDF, in page order."""
+    with open_pdf(pdf_path) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
 
 
+def extract_text_from_pdf(pdf_path: PdfSource) -> str:
+    """Extract the text layer of a PDF from a path, raw bytes or a stream."""
+    return "\n".join(extract_pages_from_pdf(pdf_path))
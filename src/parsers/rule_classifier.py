@@ -0,0 +1,170 @@
+"""Local rules that label obvious emails without calling the model.
+
+Most of the inbox is easy: BuilderTrend notifications, carrier tracking
+emails, newsletters, vendor invoices with the invoice attached. Those
+are settled here from the sender domain, subject, tracking-number
+patterns and attachment types. Anything the rules are not sure about -
+no rule fired, or rules disagree - returns None and goes to
+invoice_label as before.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from parsers.tracking_numbers import AMBIGUOUS_CARRIERS, TRACKING_FORMATS
+
+# Senders whose mail is always automated noise for this pipeline
+NONE_SENDER_DOMAINS = {
+    "buildertrend.com",
+    "buildertrend.net",
+}
+
+# Carriers that only ever email us about shipments
+CARRIER_SENDER_DOMAINS = {
+    "ups.com": "UPS",
+    "fedex.com": "FedEx",
+    "usps.com": "USPS",
+    "email.usps.com": "USPS",
+    "dhl.com": "DHL",
+}
+
+# FedEx numbers are plain digits, so they only count next to the carrier name
+FEDEX_TRACKING = re.compile(r"\bfedex\b.{0,80}?\b(\d{12}|\d{15})\b", re.IGNORECASE | re.DOTALL)
+
+BUILDERTREND_NOTIFICATION = re.compile(r"\b(created|updated)\s+an?\s+\$[\d,]+(\.\d{2})?\s+invoice\b", re.IGNORECASE)
+
+INVOICE_SUBJECT = re.compile(r"\b(invoice|inv\s*#|bill|statement|receipt|payment due)\b", re.IGNORECASE)
+# "bill" only as a word of its own, so billing_dispute.pdf or billboard.jpg do not count
+INVOICE_FILENAME = re.compile(r"(invoice|inv[-_ ]?\d|receipt|(?<![a-z])bill(?![a-z]))", re.IGNORECASE)
+
+SHIPPING_WORDS = re.compile(r"\b(shipped|shipment|tracking|out for delivery|delivered|in transit)\b", re.IGNORECASE)
+
+INSURANCE_SUBJECT = re.compile(
+    r"\b(certificate of insurance|COI|policy renewal|workers'? comp(ensation)?|insurance claim)\b",
+    re.IGNORECASE,
+)
+
+NEWSLETTER_WORDS = re.compile(r"\bunsubscribe\b", re.IGNORECASE)
+
+DOCUMENT_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
+
+
+@dataclass
+class RuleMatch:
+    """A label decided locally and the rule that decided it."""
+    label: str
+    reason: str
+
+
+def sender_domain(sender: Optional[str]) -> str:
+    """Return the lower-cased domain of an email address ('' if none)."""
+    if not sender or "@" not in sender:
+        return ""
+    return sender.rsplit("@", 1)[1].strip().strip(">").lower()
+
+
+def _domain_matches(domain: str, domains) -> Optional[str]:
+    """Match a domain or any of its subdomains against a set of domains."""
+    for candidate in domains:
+        if domain == candidate or domain.endswith("." + candidate):
+            return candidate
+    return None
+
+
+def carrier_for_sender(sender: Optional[str]) -> Optional[str]:
+    """Return the carrier a sender address belongs to, if any."""
+    domain = _domain_matches(sender_domain(sender), CARRIER_SENDER_DOMAINS)
+    return CARRIER_SENDER_DOMAINS[domain] if domain else None
+
+
+def find_tracking_numbers(text: str) -> List[Tuple[str, str]]:
+    """Return (carrier, tracking_number) pairs found in text."""
+    found = []
+    for tracking_format in TRACKING_FORMATS:
+        if tracking_format.carrier in AMBIGUOUS_CARRIERS:
+            continue
+        for match in tracking_format.pattern.finditer(text):
+            found.append((tracking_format.carrier, match.group(0)))
+    for match in FEDEX_TRACKING.finditer(text):
+        found.append(("FedEx", match.group(1)))
+    return found
+
+
+def _document_attachments(attachments: Sequence) -> List[str]:
+    return [name for name, _ in attachments if name.lower().endswith(DOCUMENT_EXTENSIONS)]
+
+
+def preclassify(message_text: str, attachments: Sequence, subject: str = "", sender: Optional[str] = None) -> Optional[RuleMatch]:
+    """Label a message from local rules, or return None if it needs the model.
+
+    Every rule is collected first; a message is only labelled when all
+    rules that fired agree.
+    """
+    text = f"{subject}\n{message_text or ''}"
+    domain = sender_domain(sender)
+    documents = _document_attachments(attachments)
+    matches: List[RuleMatch] = []
+
+    none_domain = _domain_matches(domain, NONE_SENDER_DOMAINS)
+    if none_domain:
+        matches.append(RuleMatch("none", f"sender domain {none_domain}"))
+    if BUILDERTREND_NOTIFICATION.search(text):
+        matches.append(RuleMatch("none", "BuilderTrend invoice notification"))
+
+    carrier_domain = _domain_matches(domain, CARRIER_SENDER_DOMAINS)
+    tracking = find_tracking_numbers(text)
+    if carrier_domain and not documents and not INVOICE_SUBJECT.search(subject):
+        matches.append(RuleMatch("shipping", f"carrier sender {carrier_domain}"))
+    elif tracking and SHIPPING_WORDS.search(text) and not INVOICE_SUBJECT.search(subject):
+        carrier, number = tracking[0]
+        matches.append(RuleMatch("shipping", f"{carrier} tracking number {number}"))
+
+    if INSURANCE_SUBJECT.search(subject):
+        matches.append(RuleMatch("insurance", "insurance subject"))
+
+    invoice_files = [name for name in documents if INVOICE_FILENAME.search(name)]
+    if invoice_files and INVOICE_SUBJECT.search(subject):
+        matches.append(RuleMatch("invoice", f"invoice subject with attachment {invoice_files[0]}"))
+
+    if not matches and NEWSLETTER_WORDS.search(text) and not attachments and not tracking \
+            and not INVOICE_SUBJECT.search(subject):
+        matches.append(RuleMatch("none", "newsletter"))
+
+    labels = {match.label for match in matches}
+    if len(labels) != 1:
+        return None
+    return matches[0]
+
+
+class RuleStats:
+    """Count how many messages the rules settled versus sent to the model."""
+
+    def __init__(self) -> None:
+        self.rule_labelled = 0
+        self.llm_labelled = 0
+        self.by_label: Dict[str, int] = {}
+
+    def record(self, match: Optional[RuleMatch]):
+        if match is None:
+            self.llm_labelled += 1
+            return
+        self.rule_labelled += 1
+        self.by_label[match.label] = self.by_label.get(match.label, 0) + 1
+
+    @property
+    def total(self) -> int:
+        return self.rule_labelled + self.llm_labelled
+
+    @property
+    def avoided_share(self) -> float:
+        """Fraction of classification calls the rules made unnecessary."""
+        if not self.total:
+            return 0.0
+        return self.rule_labelled / self.total
+
+    def summary(self) -> str:
+        return (
+            f"Rule classifier: {self.rule_labelled}/{self.total} messages labelled locally "
+            f"({self.avoided_share:.0%} of classification calls avoided)"
+        )
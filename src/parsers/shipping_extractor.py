@@ -0,0 +1,159 @@
+"""Local shipping-data extraction for standard carrier notifications.
+
+Most shipping emails are UPS, FedEx or USPS notices that carry a tracking
+number, a status line and a delivery date. Those are read here with
+carrier-specific patterns whose check digits are verified, so a random
+string of digits is never taken for a tracking number. The result comes
+with a confidence score; only when it is below
+SHIPPING_LOCAL_MIN_CONFIDENCE does parse_shipping need to run.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models.invoice import ShippingData
+from parsers.rule_classifier import carrier_for_sender
+from parsers.tracking_numbers import AMBIGUOUS_CARRIERS, find_valid_tracking_numbers
+
+SHIPPING_LOCAL_MIN_CONFIDENCE = float(os.getenv("SHIPPING_LOCAL_MIN_CONFIDENCE", "0.8"))
+
+# Confidence earned by each piece of evidence
+TRACKING_WEIGHT = 0.6
+STATUS_WEIGHT = 0.2
+DATE_WEIGHT = 0.1
+CARRIER_WEIGHT = 0.1
+
+
+CARRIER_NAMES: Dict[str, re.Pattern] = {
+    "UPS": re.compile(r"\bUPS\b|\bUnited Parcel Service\b", re.IGNORECASE),
+    "FedEx": re.compile(r"\bFed\s?Ex\b", re.IGNORECASE),
+    "USPS": re.compile(r"\bUSPS\b|\bUnited States Postal Service\b|\bPostal Service\b", re.IGNORECASE),
+}
+
+# Checked in order: a "delivered" notice often also says "out for delivery"
+STATUS_KEYWORDS: List[Tuple[str, re.Pattern]] = [
+    # "will be delivered" is a promise, not a status
+    ("delivered", re.compile(r"(?<!be )\bdelivered\b|\bdelivery confirmation\b", re.IGNORECASE)),
+    ("exception", re.compile(r"\b(delivery exception|delivery attempt|unable to deliver|delayed|exception)\b", re.IGNORECASE)),
+    ("out for delivery", re.compile(r"\bout for delivery\b", re.IGNORECASE)),
+    ("in transit", re.compile(r"\b(in transit|on (its|the) way|arriving)\b", re.IGNORECASE)),
+    ("shipped", re.compile(r"\b(has shipped|shipped|shipment|picked up)\b", re.IGNORECASE)),
+    ("label created", re.compile(r"\b(label (was )?created|shipping label)\b", re.IGNORECASE)),
+]
+
+_WEEKDAY = r"(?:(?:mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)[a-z]*\.?,?\s+)?"
+DATE_VALUE = (
+    _WEEKDAY + r"(\d{1,2}/\d{1,2}/\d{2,4}|\d{4}-\d{2}-\d{2}|[A-Za-z]{3,9}\.?\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})"
+)
+ESTIMATED_DELIVERY = re.compile(
+    r"\b(?:estimated|expected|scheduled|anticipated)\s+delivery(?:\s+date)?\s*(?:is|:|-|by|on)?\s*(?:by\s+)?" + DATE_VALUE,
+    re.IGNORECASE,
+)
+DELIVERED_ON = re.compile(r"\bdelivered\s*(?:on|:)\s*" + DATE_VALUE, re.IGNORECASE)
+SHIPMENT_DATE = re.compile(r"\b(?:ship(?:ped)?|ship date|shipment date)\s*(?:on|:)?\s*" + DATE_VALUE, re.IGNORECASE)
+
+ORDER_NUMBER = re.compile(r"\border\s*(?:#|no\.?|number)\s*:?\s*([A-Z0-9][A-Z0-9-]{3,})", re.IGNORECASE)
+
+DATE_FORMATS = ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%B %d %Y", "%b %d %Y")
+
+
+def parse_date(value: str) -> Optional[str]:
+    """Normalise a date found in an email to MM/DD/YYYY (None if unparseable)."""
+    cleaned = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", value.replace(",", " ").replace(".", " "))
+    cleaned = " ".join(cleaned.split())
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).strftime("%m/%d/%Y")
+        except ValueError:
+            continue
+    # "Sept 14 2026" and similar four-letter abbreviations
+    month, _, rest = cleaned.partition(" ")
+    if len(month) > 3:
+        try:
+            return datetime.strptime(f"{month[:3]} {rest}", "%b %d %Y").strftime("%m/%d/%Y")
+        except ValueError:
+            pass
+    return None
+
+
+def _first_date(pattern: re.Pattern, text: str) -> Optional[str]:
+    for match in pattern.finditer(text):
+        parsed = parse_date(match.group(1))
+        if parsed:
+            return parsed
+    return None
+
+
+@dataclass
+class LocalShipping:
+    """Shipping data read locally, with how sure the extractor is."""
+    data: ShippingData
+    confidence: float
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= SHIPPING_LOCAL_MIN_CONFIDENCE
+
+
+def extract_shipping(message_text: str, attachments: Sequence = (), subject: str = "", sender: Optional[str] = None) -> LocalShipping:
+    """Read carrier, tracking number, status and dates from a shipping email.
+
+    Text attachments are searched along with the subject and body.
+    Confidence adds up from a check-digit-valid tracking number, a status
+    keyword, a delivery or ship date and the carrier being named (or
+    being the sender).
+    """
+    parts = [subject or "", message_text or ""]
+    parts.extend(data for _, data in attachments if isinstance(data, str))
+    text = "\n".join(parts)
+
+    mentioned = {carrier for carrier, pattern in CARRIER_NAMES.items() if pattern.search(text)}
+    sender_carrier = carrier_for_sender(sender)
+    if sender_carrier:
+        mentioned.add(sender_carrier)
+
+    tracking = [
+        (carrier, number) for carrier, number in find_valid_tracking_numbers(text)
+        if carrier not in AMBIGUOUS_CARRIERS or carrier in mentioned
+    ]
+
+    confidence = 0.0
+    reasons = []
+    data = ShippingData()
+
+    if tracking:
+        data.carrier, data.tracking_number = tracking[0]
+        confidence += TRACKING_WEIGHT
+        reasons.append(f"{data.carrier} tracking number {data.tracking_number} (check digit valid)")
+        others = [number for _, number in tracking[1:]]
+        if others:
+            data.notes = "Other tracking numbers: " + ", ".join(others)
+    elif len(mentioned) == 1:
+        data.carrier = next(iter(mentioned))
+
+    if data.carrier and data.carrier in mentioned:
+        confidence += CARRIER_WEIGHT
+        reasons.append(f"carrier {data.carrier} named")
+
+    for status, pattern in STATUS_KEYWORDS:
+        if pattern.search(text):
+            data.delivery_status = status
+            confidence += STATUS_WEIGHT
+            reasons.append(f"status '{status}'")
+            break
+
+    data.estimated_delivery = _first_date(ESTIMATED_DELIVERY, text) or _first_date(DELIVERED_ON, text)
+    data.shipment_date = _first_date(SHIPMENT_DATE, text)
+    if data.estimated_delivery or data.shipment_date:
+        confidence += DATE_WEIGHT
+        reasons.append("date found")
+
+    order = ORDER_NUMBER.search(text)
+    if order:
+        data.order_number = order.group(1)
+
+    return LocalShipping(data=data, confidence=round(min(confidence, 1.0), 2), reasons=reasons)
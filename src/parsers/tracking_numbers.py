@@ -0,0 +1,92 @@
+"""Carrier tracking-number formats shared by the local parsers.
+
+One table of UPS, USPS and FedEx formats, each with its check-digit
+test. rule_classifier uses the patterns to spot shipping emails and
+shipping_extractor additionally verifies the check digit before taking
+a number as the shipment's tracking number, so the two always agree on
+what a tracking number looks like.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+
+
+def _char_value(char: str) -> int:
+    """UPS maps letters onto digits: A=2, B=3, ... cycling through 0-9."""
+    if char.isdigit():
+        return int(char)
+    return (ord(char) - ord("A") + 2) % 10
+
+
+def ups_check_digit_valid(number: str) -> bool:
+    """1Z + 15 characters + a mod-10 check digit (even positions doubled)."""
+    body, check = number[2:17], number[17]
+    total = sum(_char_value(char) * (2 if position % 2 else 1) for position, char in enumerate(body))
+    return (10 - total % 10) % 10 == int(check)
+
+
+def mod10_check_digit(digits: str) -> int:
+    """GS1 mod-10 check digit: weights 3, 1, 3, ... from the rightmost digit."""
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(digits)))
+    return (10 - total % 10) % 10
+
+
+def mod10_valid(number: str) -> bool:
+    return mod10_check_digit(number[:-1]) == int(number[-1])
+
+
+def fedex_express_check_digit(digits: str) -> int:
+    """FedEx 12-digit check digit: weights 1, 3, 7, ... from the right, mod 11."""
+    weights = (1, 3, 7)
+    total = sum(int(digit) * weights[position % 3] for position, digit in enumerate(reversed(digits)))
+    return total % 11 % 10
+
+
+def fedex_express_valid(number: str) -> bool:
+    return fedex_express_check_digit(number[:11]) == int(number[11])
+
+
+def s10_check_digit(digits: str) -> int:
+    """UPU S10 (USPS international) check digit over the 8 serial digits."""
+    total = sum(int(digit) * weight for digit, weight in zip(digits, (8, 6, 4, 2, 3, 5, 9, 7)))
+    check = 11 - total % 11
+    return {10: 0, 11: 5}.get(check, check)
+
+
+def s10_valid(number: str) -> bool:
+    return s10_check_digit(number[2:10]) == int(number[10])
+
+
+@dataclass
+class TrackingFormat:
+    carrier: str
+    pattern: re.Pattern
+    valid: Callable[[str], bool]
+
+
+# Ordered so the most distinctive formats are tried first
+TRACKING_FORMATS: List[TrackingFormat] = [
+    TrackingFormat("UPS", re.compile(r"\b1Z[0-9A-Z]{16}\b"), ups_check_digit_valid),
+    TrackingFormat("USPS", re.compile(r"\b(?:9[1-5]\d{20}|9[1-5]\d{24})\b"), mod10_valid),
+    TrackingFormat("USPS", re.compile(r"\b[A-Z]{2}\d{9}US\b"), s10_valid),
+    TrackingFormat("FedEx", re.compile(r"\b\d{12}\b"), fedex_express_valid),
+    TrackingFormat("FedEx", re.compile(r"\b96\d{20}\b|\b\d{15}\b"), mod10_valid),
+]
+
+# Bare 12/15-digit FedEx numbers are only trusted when FedEx is mentioned
+AMBIGUOUS_CARRIERS = {"FedEx"}
+
+
+def find_valid_tracking_numbers(text: str) -> List[Tuple[str, str]]:
+    """(carrier, number) for every tracking number whose check digit verifies."""
+    found: List[Tuple[str, str]] = []
+    seen = set()
+    for tracking_format in TRACKING_FORMATS:
+        for match in tracking_format.pattern.finditer(text):
+            number = match.group(0)
+            if number in seen or not tracking_format.valid(number):
+                continue
+            seen.add(number)
+            found.append((tracking_format.carrier, number))
+    return found
@@ -0,0 +1,479 @@
+"""Learned per-vendor templates for extracting repeat invoices locally.
+
+Most invoices come from a few dozen vendors whose PDFs always have the
+same text layout. After an LLM extraction passes check_invoice, learn()
+records where each value sat in the text layer:
+
+- a layout fingerprint: the document's lines with every digit masked,
+  minus the line items
+- field anchors: the label printed next to (or above) the invoice
+  number, dates, tax and total
+- the line-item table: the header row above it, the label of the row
+  below it, and which numeric columns hold quantity, rate and amount
+
+A template is only kept if it re-extracts the invoice it was learned
+from, and only used once it has also extracted a later verified invoice
+of the same vendor correctly (VENDOR_TEMPLATE_MIN_SAMPLES). extract()
+then reads matching invoices without the model; anything that does not
+pass check_invoice returns None so the caller falls back to pdf_invoice.
+Templates live in data/vendor_templates.json.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from models.invoice import InvoiceData, InvoiceDraft, InvoiceLine
+from parsers.invoice_checks import check_invoice
+from parsers.shipping_extractor import parse_date
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+TEMPLATES_FILE = DATA_DIR / "vendor_templates.json"
+
+# Share of a template's fingerprint lines a document must contain
+VENDOR_TEMPLATE_MIN_SIMILARITY = float(os.getenv("VENDOR_TEMPLATE_MIN_SIMILARITY", "0.7"))
+
+# Verified invoices a template must have extracted correctly before use
+VENDOR_TEMPLATE_MIN_SAMPLES = int(os.getenv("VENDOR_TEMPLATE_MIN_SAMPLES", "2"))
+
+# Scalar fields located through anchors, and the kind of token each holds
+ANCHORED_FIELDS = {
+    "invoice_number": "id",
+    "invoice_date": "date",
+    "due_date": "date",
+    "tax": "amount",
+    "total_amount": "amount",
+    "job_site_address": "line",
+}
+
+# Fields a template must be able to read whenever the invoice has them
+REQUIRED_FIELDS = ("invoice_number", "invoice_date", "total_amount")
+
+AMOUNT_TOLERANCE = 0.005
+
+NUMBER_TOKEN = re.compile(r"(?<![\w./-])-?\$?\d[\d,]*(?:\.\d+)?(?![\w./%-])")
+DATE_TOKEN = re.compile(r"\b(?:\d{1,2}/\d{1,2}/\d{2,4}|\d{4}-\d{2}-\d{2}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4})\b")
+ID_TOKEN = re.compile(r"\b[A-Za-z0-9][\w/-]*\d[\w/-]*\b")
+
+
+def _normalise(line: str) -> str:
+    return " ".join(line.lower().split())
+
+
+def _mask(line: str) -> str:
+    """A line's layout with its variable digits removed."""
+    return _normalise(re.sub(r"\d+", "#", line))
+
+
+def _number(token: str) -> Optional[float]:
+    try:
+        return float(token.replace("$", "").replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _close(a: Optional[float], b: Optional[float]) -> bool:
+    return a is not None and b is not None and abs(a - b) <= max(AMOUNT_TOLERANCE, abs(b) * 1e-6)
+
+
+def _tokens(kind: str, text: str) -> List[Tuple[int, int, str]]:
+    """(start, end, token) for every token of a kind in text."""
+    if kind == "line":
+        stripped = text.strip()
+        if not stripped:
+            return []
+        start = text.index(stripped)
+        return [(start, start + len(stripped), stripped)]
+    pattern = {"amount": NUMBER_TOKEN, "date": DATE_TOKEN, "id": ID_TOKEN}[kind]
+    return [(match.start(), match.end(), match.group(0)) for match in pattern.finditer(text)]
+
+
+def _token_value(kind: str, token: str):
+    if kind == "amount":
+        return _number(token)
+    if kind == "date":
+        return parse_date(token)
+    return token.strip()
+
+
+def _value_starts(kind: str, line: str, value) -> List[int]:
+    """Where a known value appears in a line."""
+    if kind == "line":
+        # Addresses come back from the model on one line, comma separated
+        words = str(value).split(",")[0].split()
+        if not words:
+            return []
+        pattern = re.compile(r"\s+".join(re.escape(word) for word in words), re.IGNORECASE)
+        return [match.start() for match in pattern.finditer(line)]
+    if kind == "amount":
+        return [start for start, _, token in _tokens(kind, line) if _close(_number(token), float(value))]
+    if kind == "date":
+        wanted = parse_date(str(value))
+        return [start for start, _, token in _tokens(kind, line) if wanted and parse_date(token) == wanted]
+    return [start for start, _, token in _tokens(kind, line) if token.lower() == str(value).strip().lower()]
+
+
+def _label_pattern(label: str) -> re.Pattern:
+    return re.compile(r"(?<![A-Za-z])" + re.escape(label), re.IGNORECASE)
+
+
+def _has_letters(text: str) -> bool:
+    return len(re.findall(r"[A-Za-z]", text)) >= 2
+
+
+def _learn_anchor(lines: List[str], kind: str, value) -> Optional[dict]:
+    """Find where a known value sits and the label that leads to it."""
+    for number, line in enumerate(lines):
+        for start in _value_starts(kind, line, value):
+            # Label on the same line: the text after the last number before the value
+            prefix = line[:start]
+            label = re.split(r"\S*\d\S*", prefix)[-1].strip()
+            if _has_letters(label):
+                pattern = _label_pattern(label)
+                label_end = max(match.end() for match in pattern.finditer(prefix))
+                return {
+                    "kind": kind,
+                    "label": label,
+                    "offset": 0,
+                    "occurrence": sum(1 for earlier in lines[:number] if pattern.search(earlier)),
+                    "index": len(_tokens(kind, line[label_end:start])) if kind != "line" else 0,
+                }
+
+            # Label on the line above (a row of headings over a row of values)
+            above = number - 1
+            while above >= 0 and not lines[above].strip():
+                above -= 1
+            if above >= 0 and _has_letters(lines[above]) and not re.search(r"\d", lines[above]):
+                label = _normalise(lines[above])
+                return {
+                    "kind": kind,
+                    "label": label,
+                    "offset": 1,
+                    "occurrence": sum(1 for earlier in lines[:above] if _normalise(earlier) == label),
+                    "index": len(_tokens(kind, line[:start])) if kind != "line" else 0,
+                }
+    return None
+
+
+def _read_anchor(lines: List[str], anchor: dict):
+    """Read a field's value through its anchor, or None."""
+    kind = anchor["kind"]
+    seen = 0
+    for number, line in enumerate(lines):
+        if anchor["offset"] == 0:
+            match = _label_pattern(anchor["label"]).search(line)
+            if not match:
+                continue
+            segment = line[match.end():]
+        else:
+            if _normalise(line) != anchor["label"]:
+                continue
+            following = [candidate for candidate in lines[number + 1:] if candidate.strip()]
+            if not following:
+                return None
+            segment = following[0]
+
+        if seen < anchor["occurrence"]:
+            seen += 1
+            continue
+        tokens = _tokens(kind, segment)
+        if anchor["index"] >= len(tokens):
+            return None
+        return _token_value(kind, tokens[anchor["index"]][2])
+    return None
+
+
+def _numbers(line: str) -> List[Tuple[int, int, float]]:
+    found = []
+    for start, end, token in _tokens("amount", line):
+        value = _number(token)
+        if value is not None:
+            found.append((start, end, value))
+    return found
+
+
+def _row_label(line: str) -> str:
+    """The text of a row before its first number, e.g. 'subtotal'."""
+    numbers = _numbers(line)
+    head = line[:numbers[0][0]] if numbers else line
+    return _normalise(head).rstrip(":").strip()
+
+
+def _parse_row(line: str, columns: Dict[str, Optional[int]]) -> Optional[InvoiceLine]:
+    """Read one line-item row using the learned numeric columns."""
+    numbers = _numbers(line)
+    used = [index for index in columns.values() if index is not None]
+    if not used or len(numbers) < max(-index for index in used):
+        return None
+
+    amount = numbers[columns["amount"]][2]
+    quantity = numbers[columns["quantity"]][2] if columns.get("quantity") is not None else 1.0
+    if columns.get("rate") is not None:
+        rate = numbers[columns["rate"]][2]
+    elif quantity:
+        rate = amount / quantity
+    else:
+        return None
+    if quantity <= 0 or not _close(rate * quantity, amount):
+        return None
+
+    # The description is whatever is left once the numeric columns are cut out
+    description = line
+    for index in sorted({len(numbers) + index for index in used}, reverse=True):
+        start, end, _ = numbers[index]
+        description = description[:start] + " " + description[end:]
+    description = " ".join(description.replace("$", " ").split())
+    if not _has_letters(description):
+        return None
+    return InvoiceLine(item=description, rate=round(rate, 4), quantity=quantity)
+
+
+def _find_item_rows(lines: List[str], items: Sequence[InvoiceLine]) -> Optional[List[int]]:
+    """Line numbers of the rows holding each verified line item, in order."""
+    rows = []
+    position = 0
+    for item in items:
+        for number in range(position, len(lines)):
+            values = [value for _, _, value in _numbers(lines[number])]
+            if any(_close(value, item.amount) for value in values) and any(_close(value, item.rate) for value in values):
+                rows.append(number)
+                position = number + 1
+                break
+        else:
+            return None
+    return rows
+
+
+def _learn_columns(lines: List[str], rows: List[int], items: Sequence[InvoiceLine]) -> Optional[Dict[str, Optional[int]]]:
+    """Which numeric column (counted from the right) holds each value."""
+    votes: Dict[str, Counter] = {"amount": Counter(), "rate": Counter(), "quantity": Counter()}
+    for number, item in zip(rows, items):
+        numbers = _numbers(lines[number])
+        count = len(numbers)
+        taken = set()
+        for column, value in (("amount", item.amount), ("rate", item.rate), ("quantity", item.quantity)):
+            # Prefer the rightmost match not already claimed by another column
+            for index in range(count - 1, -1, -1):
+                if index not in taken and _close(numbers[index][2], value):
+                    votes[column][index - count] += 1
+                    taken.add(index)
+                    break
+
+    if not votes["amount"]:
+        return None
+    columns: Dict[str, Optional[int]] = {"amount": votes["amount"].most_common(1)[0][0]}
+    for column in ("rate", "quantity"):
+        # A column only counts if it was found on most rows
+        if votes[column] and votes[column].most_common(1)[0][1] * 2 > len(rows):
+            columns[column] = votes[column].most_common(1)[0][0]
+        else:
+            columns[column] = None
+    return columns
+
+
+class TemplateStore:
+    """Vendor templates persisted as JSON, keyed by vendor name."""
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = Path(path) if path else TEMPLATES_FILE
+        self.templates: Dict[str, dict] = {}
+        if self.path.exists():
+            try:
+                self.templates = json.loads(self.path.read_text())
+            except json.JSONDecodeError:
+                logger.warning("Ignoring unreadable vendor template file %s", self.path)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_suffix(".tmp")
+        temp.write_text(json.dumps(self.templates, indent=2))
+        os.replace(temp, self.path)
+
+    @staticmethod
+    def similarity(template: dict, lines: List[str]) -> float:
+        """Share of the template's fingerprint lines present in a document."""
+        fingerprint = set(template["fingerprint"])
+        if not fingerprint:
+            return 0.0
+        return len(fingerprint & {_mask(line) for line in lines}) / len(fingerprint)
+
+    def match(self, text: str, min_similarity: float = VENDOR_TEMPLATE_MIN_SIMILARITY) -> Optional[dict]:
+        """The best matching template for a document, if any is close enough."""
+        lines = text.splitlines()
+        best, best_score = None, 0.0
+        for template in self.templates.values():
+            if template["vendor_in_text"] and template["vendor_display_name"].lower() not in text.lower():
+                continue
+            score = self.similarity(template, lines)
+            if score >= min_similarity and score > best_score:
+                best, best_score = template, score
+        return best
+
+    @staticmethod
+    def apply(template: dict, text: str) -> Optional[InvoiceData]:
+        """Extract an invoice with a template; None if it does not check out."""
+        lines = text.splitlines()
+        fields = {name: _read_anchor(lines, anchor) for name, anchor in template["anchors"].items()}
+
+        table = template["table"]
+        start = 0
+        if table["header"]:
+            headers = [number for number, line in enumerate(lines) if _normalise(line) == table["header"]]
+            if not headers:
+                return None
+            start = headers[0] + 1
+
+        items = []
+        for line in lines[start:]:
+            if table["end"] and _row_label(line) == table["end"]:
+                break
+            # Repeated table headers on later pages are skipped like any other non-row
+            row = _parse_row(line, table["columns"])
+            if row is None:
+                continue
+            key = _normalise(row.item)
+            row.category = template["categories"].get(key, template["default_category"])
+            items.append(row)
+
+        try:
+            payload = InvoiceData(
+                vendor_display_name=template["vendor_display_name"],
+                line_items=items,
+                is_receipt=template["is_receipt"],
+                **{name: value for name, value in fields.items() if value is not None},
+            )
+        except ValueError:
+            return None
+        issues = check_invoice(payload)
+        if issues:
+            logger.info("Template for %s rejected: %s", template["vendor_display_name"], "; ".join(str(issue) for issue in issues))
+            return None
+        return payload
+
+    def extract(self, text: str, min_samples: int = VENDOR_TEMPLATE_MIN_SAMPLES) -> Optional[InvoiceDraft]:
+        """Extract an invoice locally if a trusted template matches.
+
+        customer_name is left unset: it changes with every job, so the
+        caller matches the customer (CustomerIndex.best_match).
+        """
+        template = self.match(text)
+        if template is None or template["samples"] < min_samples:
+            return None
+        payload = self.apply(template, text)
+        if payload is None:
+            return None
+        logger.info("Invoice extracted with the %s template", template["vendor_display_name"])
+        return InvoiceDraft(**payload.model_dump())
+
+    @staticmethod
+    def _agrees(payload: Optional[InvoiceData], verified: Union[InvoiceData, InvoiceDraft]) -> bool:
+        """Does a template extraction reproduce a verified one?"""
+        if payload is None or len(payload.line_items) != len(verified.line_items):
+            return False
+        if not _close(payload.total_amount, verified.total_amount):
+            return False
+        if any(not _close(ours.amount, theirs.amount) for ours, theirs in zip(payload.line_items, verified.line_items)):
+            return False
+        for name in ("invoice_number", "invoice_date", "due_date"):
+            if getattr(verified, name) and str(getattr(payload, name) or "").lower() != str(getattr(verified, name)).lower():
+                return False
+        return True
+
+    def build(self, text: str, verified: Union[InvoiceData, InvoiceDraft]) -> Optional[dict]:
+        """Learn a template from one verified extraction (None if it cannot be done)."""
+        lines = text.splitlines()
+        rows = _find_item_rows(lines, verified.line_items)
+        if not rows:
+            return None
+        columns = _learn_columns(lines, rows, verified.line_items)
+        if columns is None:
+            return None
+
+        header = None
+        for number in range(rows[0] - 1, max(rows[0] - 4, -1), -1):
+            if lines[number].strip() and not re.search(r"\d", lines[number]):
+                header = _normalise(lines[number])
+                break
+
+        # The table ends at the first labelled figure after it, e.g. "Subtotal 450.00"
+        end = None
+        for line in lines[rows[-1] + 1:]:
+            if _numbers(line) and _has_letters(_row_label(line)):
+                end = _row_label(line)
+                break
+
+        anchors = {}
+        for name, kind in ANCHORED_FIELDS.items():
+            value = getattr(verified, name)
+            if value in (None, ""):
+                continue
+            anchor = _learn_anchor(lines, kind, value)
+            if anchor is None and name in REQUIRED_FIELDS:
+                return None
+            if anchor is not None:
+                anchors[name] = anchor
+
+        item_rows = set(rows)
+        categories = {}
+        for number, item in zip(rows, verified.line_items):
+            row = _parse_row(lines[number], columns)
+            if row is not None and item.category:
+                categories[_normalise(row.item)] = item.category
+        known = [item.category for item in verified.line_items if item.category]
+
+        template = {
+            "vendor_display_name": verified.vendor_display_name,
+            "vendor_in_text": verified.vendor_display_name.lower() in text.lower(),
+            "fingerprint": sorted({_mask(line) for number, line in enumerate(lines) if number not in item_rows and line.strip()}),
+            "anchors": anchors,
+            "table": {"header": header, "end": end, "columns": columns},
+            "categories": categories,
+            "default_category": Counter(known).most_common(1)[0][0] if known else None,
+            "is_receipt": bool(verified.is_receipt),
+            "samples": 1,
+        }
+        if not self._agrees(self.apply(template, text), verified):
+            return None
+        return template
+
+    def learn(self, text: str, verified: Union[InvoiceData, InvoiceDraft]) -> bool:
+        """Update the vendor's template from an extraction that passed check_invoice.
+
+        Returns True if the vendor now has a template covering this layout.
+        """
+        if check_invoice(verified):
+            return False
+        key = verified.vendor_display_name.strip().lower()
+        existing = self.templates.get(key)
+
+        payload = self.apply(existing, text) if existing is not None else None
+        if existing is not None and self._agrees(payload, verified):
+            # The template handled a new invoice: count it and drop fingerprint
+            # lines that turned out to vary between invoices
+            lines = {_mask(line) for line in text.splitlines()}
+            narrowed = [line for line in existing["fingerprint"] if line in lines]
+            if narrowed:
+                existing["fingerprint"] = narrowed
+            existing["samples"] += 1
+            for ours, theirs in zip(payload.line_items, verified.line_items):
+                if theirs.category:
+                    existing["categories"].setdefault(_normalise(ours.item), theirs.category)
+            self.save()
+            return True
+
+        template = self.build(text, verified)
+        if template is None:
+            logger.info("Could not learn a template for %s", verified.vendor_display_name)
+            return False
+        # A new layout replaces the old one; it has to earn trust again
+        self.templates[key] = template
+        self.save()
+        logger.info("Learned a template for %s", verified.vendor_display_name)
+        return True
@@ -0,0 +1,386 @@
+"""Content-addressed storage for email attachments.
+
+Attachments are stored once per unique content, keyed by SHA-256, in a
+sharded layout under attachments/objects/:
+
+    attachments/objects/3f/a2/3fa2...c9.pdf
+
+Two vendors both sending "invoice.pdf" no longer overwrite each other,
+and the same PDF forwarded three times is written once. A JSON index in
+data/attachment_index.json records which filenames and messages refer
+to each blob, the name it had in each message, and whether the
+attachment has already been processed. Extracted PDF text is cached next
+to the blob, so duplicates are only parsed, extracted and pushed once.
+
+Fetchers only register attachments in memory (read_attachment);
+nothing is written while fetching. Blobs are written on a background
+thread by persist_async() when something needs a file on disk - the
+QuickBooks upload and the public file URL. All index writes go through
+the same single-worker queue so they never race.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+from parsers.pdf_parser import extract_text_from_pdf, open_file_stream
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+ATTACHMENTS_DIR = PROJECT_ROOT / "attachments"
+OBJECTS_DIR = ATTACHMENTS_DIR / "objects"
+DATA_DIR = PROJECT_ROOT / "data"
+INDEX_FILE = DATA_DIR / "attachment_index.json"
+
+
+@dataclass
+class StoredAttachment:
+    """A reference to one blob under the name it arrived with.
+
+    data holds the bytes while the attachment is in memory; path is where
+    the blob lives (or will live once persisted).
+    """
+    digest: str
+    filename: str
+    path: Path
+    size: int
+    is_new: bool = False
+    data: Optional[bytes] = field(default=None, repr=False)
+    text: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def relative_path(self) -> str:
+        """Path relative to the attachments directory, for public URLs."""
+        return self.path.relative_to(ATTACHMENTS_DIR).as_posix()
+
+    def read_bytes(self) -> bytes:
+        """Return the attachment bytes from memory, falling back to disk."""
+        if self.data is not None:
+            return self.data
+        return self.path.read_bytes()
+
+    def open(self) -> BinaryIO:
+        """Return a seekable stream to use in a with block; large on-disk blobs are memory-mapped."""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open_file_stream(self.path)
+
+
+# In-memory attachments for the current run, keyed by message and digest
+_registry_lock = threading.Lock()
+_by_message: Dict[str, List[StoredAttachment]] = {}
+_by_digest: Dict[str, StoredAttachment] = {}
+_processed_digests = set()
+
+# Single worker so blob and index writes are serialised in order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="attachment-writer")
+# Persist futures keyed by (digest, message_id)
+_pending: Dict[tuple, Future] = {}
+
+
+def _ensure_data_dir():
+    DATA_DIR.mkdir(exist_ok=True)
+
+
+def _empty_index() -> dict:
+    return {"blobs": {}, "filenames": {}, "messages": {}, "message_filenames": {}}
+
+
+def load_index() -> dict:
+    """Load the attachment index from disk."""
+    _ensure_data_dir()
+    if not INDEX_FILE.exists():
+        return _empty_index()
+    try:
+        data = json.loads(INDEX_FILE.read_text())
+    except (json.JSONDecodeError, TypeError):
+        return _empty_index()
+    if not isinstance(data, dict):
+        return _empty_index()
+    for key, value in _empty_index().items():
+        data.setdefault(key, value)
+    return data
+
+
+def save_index(index: dict):
+    """Write the full attachment index to disk."""
+    _ensure_data_dir()
+    _write_atomic(INDEX_FILE, json.dumps(index, indent=2, sort_keys=True).encode())
+
+
+def content_hash(data: bytes) -> str:
+    """Return the SHA-256 hex digest that addresses a blob."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(digest: str, filename: str = "") -> Path:
+    """Return the sharded on-disk path for a digest.
+
+    The original extension is kept so downstream code can still route
+    on .pdf/.jpg and serve the right content type.
+    """
+    suffix = Path(filename).suffix.lower()
+    return OBJECTS_DIR / digest[:2] / digest[2:4] / f"{digest}{suffix}"
+
+
+def _write_atomic(path: Path, data: bytes):
+    """Write data to path via a temp file so readers never see partial blobs."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+def _add_unique(items: list, value: str):
+    if value not in items:
+        items.append(value)
+
+
+def store_attachment(filename: str, data: bytes, message_id: Optional[str] = None) -> StoredAttachment:
+    """Store attachment bytes once and record the filename/message reference."""
+    digest = content_hash(data)
+    index = load_index()
+
+    record = index["blobs"].get(digest)
+    if record:
+        path = ATTACHMENTS_DIR / record["path"]
+    else:
+        path = blob_path(digest, filename)
+        record = {
+            "path": path.relative_to(ATTACHMENTS_DIR).as_posix(),
+            "size": len(data),
+            "filenames": [],
+            "processed": False,
+        }
+        index["blobs"][digest] = record
+
+    # The index may outlive the blob (e.g. attachments/ was cleaned out)
+    is_new = not path.exists()
+    if is_new:
+        _write_atomic(path, data)
+
+    _add_unique(record["filenames"], filename)
+    _add_unique(index["filenames"].setdefault(filename, []), digest)
+    if message_id:
+        _add_unique(index["messages"].setdefault(message_id, []), digest)
+        # The same content can arrive under a different name in each message
+        index["message_filenames"].setdefault(message_id, {})[digest] = filename
+    save_index(index)
+
+    return StoredAttachment(digest=digest, filename=filename, path=path, size=len(data), is_new=is_new)
+
+
+def register_attachment(filename: str, data: bytes, message_id: Optional[str] = None) -> StoredAttachment:
+    """Keep an attachment in memory for this run without touching disk.
+
+    Identical content seen earlier in the run shares the same buffer (and
+    any text already extracted from it).
+    """
+    digest = content_hash(data)
+    with _registry_lock:
+        existing = _by_digest.get(digest)
+        if existing is None:
+            existing = StoredAttachment(
+                digest=digest,
+                filename=filename,
+                path=blob_path(digest, filename),
+                size=len(data),
+                data=data,
+            )
+            _by_digest[digest] = existing
+
+        attachment = StoredAttachment(
+            digest=digest,
+            filename=filename,
+            path=existing.path,
+            size=existing.size,
+            data=existing.data,
+            text=existing.text,
+        )
+        if message_id:
+            refs = _by_message.setdefault(message_id, [])
+            if all(ref.digest != digest for ref in refs):
+                refs.append(attachment)
+    return attachment
+
+
+def read_attachment(message_id: str, filename: str, data: bytes) -> tuple:
+    """Register a fetched attachment and return its (filename, content) pair for the pipeline.
+
+    PDFs are returned as extracted text, parsed from memory once per
+    content: duplicates reuse the text from this run or from the cache.
+    """
+    stored = register_attachment(filename, data, message_id=message_id)
+    if not filename.lower().endswith(".pdf"):
+        return filename, data
+    text = stored.text
+    if text is None:
+        text = get_cached_text(stored.digest)
+    if text is None:
+        text = extract_text_from_pdf(data)
+    remember_text(stored, text)
+    return filename, text
+
+
+def remember_text(attachment: StoredAttachment, text: Optional[str]):
+    """Record extracted text on the in-memory attachment and its duplicates."""
+    attachment.text = text
+    with _registry_lock:
+        shared = _by_digest.get(attachment.digest)
+        if shared is not None:
+            shared.text = text
+        for refs in _by_message.values():
+            for ref in refs:
+                if ref.digest == attachment.digest:
+                    ref.text = text
+
+
+def persist_async(attachment: StoredAttachment, message_id: Optional[str] = None) -> Future:
+    """Write an in-memory attachment to the store on the background writer.
+
+    Returns a Future resolving to the StoredAttachment. Every message's
+    reference (and the name the attachment had in it) is recorded, but the
+    blob itself is only written once: store_attachment skips blobs already
+    on disk, and the single writer runs the first write before any other.
+    """
+    key = (attachment.digest, message_id)
+    with _registry_lock:
+        future = _pending.get(key)
+        if future is None:
+            data = attachment.read_bytes()
+            text = attachment.text
+
+            def write():
+                stored = store_attachment(attachment.filename, data, message_id=message_id)
+                if text is not None and get_cached_text(stored.digest) is None:
+                    set_cached_text(stored.digest, text)
+                return stored
+
+            future = _writer.submit(write)
+            _pending[key] = future
+    return future
+
+
+def wait_for_writes():
+    """Block until every queued attachment and index write has finished."""
+    # An empty task runs after everything already queued on the writer
+    _writer.submit(lambda: None).result()
+    for future in list(_pending.values()):
+        exc = future.exception()
+        if exc is not None:
+            logger.error("Failed to persist attachment: %s", exc)
+
+
+def clear_registry():
+    """Forget in-memory attachments (used between runs and in tests)."""
+    with _registry_lock:
+        _by_message.clear()
+        _by_digest.clear()
+        _processed_digests.clear()
+        _pending.clear()
+
+
+def _reference(index: dict, digest: str, filename: str) -> Optional[StoredAttachment]:
+    record = index["blobs"].get(digest)
+    if not record:
+        return None
+    return StoredAttachment(
+        digest=digest,
+        filename=filename,
+        path=ATTACHMENTS_DIR / record["path"],
+        size=record.get("size", 0),
+    )
+
+
+def attachments_for_message(message_id: str) -> List[StoredAttachment]:
+    """Return the attachments referenced by a message, in arrival order.
+
+    Attachments fetched in this run come from memory; older ones are read
+    back from the index.
+    """
+    with _registry_lock:
+        in_memory = list(_by_message.get(message_id, []))
+    if in_memory:
+        return in_memory
+
+    index = load_index()
+    names = index["message_filenames"].get(message_id, {})
+    results = []
+    for digest in index["messages"].get(message_id, []):
+        # Indexes written before per-message names fall back to the first name seen
+        filename = names.get(digest) or (index["blobs"].get(digest, {}).get("filenames") or [""])[0]
+        reference = _reference(index, digest, filename)
+        if reference:
+            results.append(reference)
+    return results
+
+
+def find_by_filename(filename: str) -> List[StoredAttachment]:
+    """Return every stored blob that has arrived under this filename."""
+    index = load_index()
+    results = []
+    for digest in index["filenames"].get(filename, []):
+        reference = _reference(index, digest, filename)
+        if reference:
+            results.append(reference)
+    return results
+
+
+def _text_path(digest: str) -> Path:
+    return OBJECTS_DIR / digest[:2] / digest[2:4] / f"{digest}.extracted.txt"
+
+
+def get_cached_text(digest: str) -> Optional[str]:
+    """Return previously extracted PDF text for a blob, if any."""
+    path = _text_path(digest)
+    if not path.exists():
+        return None
+    return path.read_text()
+
+
+def set_cached_text(digest: str, text: Optional[str]):
+    """Remember extracted PDF text so duplicates are not re-parsed."""
+    _write_atomic(_text_path(digest), (text or "").encode())
+
+
+def is_attachment_processed(digest: str) -> bool:
+    """Check whether this content has already been extracted and pushed."""
+    if digest in _processed_digests:
+        return True
+    record = load_index()["blobs"].get(digest)
+    return bool(record and record.get("processed"))
+
+
+def mark_attachment_processed(digest: str) -> Future:
+    """Flag a blob as processed so later copies are skipped.
+
+    Queued behind any pending persist of the same blob, so the index
+    entry exists by the time the flag is written.
+    """
+    with _registry_lock:
+        _processed_digests.add(digest)
+
+    def write():
+        index = load_index()
+        record = index["blobs"].get(digest)
+        if record is None:
+            return
+        record["processed"] = True
+        save_index(index)
+
+    return _writer.submit(write)
@@ -0,0 +1,315 @@
+"""Offline invoice extraction through the OpenAI Batch API.
+
+Backfills (a year of vendor mail, say) are cheaper and kinder to rate
+limits as Batch API jobs than as one synchronous pdf_invoice call per
+message. The flow has four resumable steps, all tracked in
+data/batches/state.json:
+
+    queue_requests()   write extraction requests as JSONL files
+    submit_pending()   upload each file and create a batch job
+    wait_for_batches() poll until every batch has finished
+    download_results() save output/error files next to the inputs
+
+iter_results() then yields the parsed InvoiceData per request, so the
+pipeline can carry on exactly as if pdf_invoice had returned it. Every
+step skips work already recorded in the state, so a crash or Ctrl-C can
+be followed by simply running the same step again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from openai import OpenAI
+from pydantic import BaseModel, ValidationError
+
+from models.invoice import InvoiceData
+from parsers.ai_parser import PDF_INVOICE_MODEL, pdf_invoice_input
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+BATCH_DIR = DATA_DIR / "batches"
+STATE_FILE = BATCH_DIR / "state.json"
+
+BATCH_ENDPOINT = "/v1/responses"
+
+# Requests per JSONL file (the API allows up to 50,000 per batch)
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "500"))
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "60"))
+
+# Batch statuses after which nothing more will happen
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _empty_state() -> dict:
+    return {"requests": {}, "files": {}}
+
+
+def load_state() -> dict:
+    """Load the backlog state from disk."""
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    if not STATE_FILE.exists():
+        return _empty_state()
+    try:
+        state = json.loads(STATE_FILE.read_text())
+    except json.JSONDecodeError:
+        return _empty_state()
+    for key, value in _empty_state().items():
+        state.setdefault(key, value)
+    return state
+
+
+def save_state(state: dict):
+    """Write the backlog state atomically."""
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    temp = STATE_FILE.with_suffix(".tmp")
+    temp.write_text(json.dumps(state, indent=2))
+    os.replace(temp, STATE_FILE)
+
+
+def custom_id_for(operation: str, message_id: str) -> str:
+    """Short, stable request ID for a message (Graph IDs are very long)."""
+    return f"{operation}-{hashlib.sha256(message_id.encode()).hexdigest()[:24]}"
+
+
+def strict_json_schema(schema: dict, root: Optional[dict] = None) -> dict:
+    """schema made acceptable to Structured Outputs strict mode, in place.
+
+    Every object gets additionalProperties false and all its properties
+    required, single-entry allOf wrappers and null defaults are dropped,
+    and $refs that carry extra keys (descriptions) are inlined.
+    """
+    root = schema if root is None else root
+    for definition in schema.get("$defs", {}).values():
+        strict_json_schema(definition, root)
+
+    if schema.get("type") == "object":
+        schema.setdefault("additionalProperties", False)
+    properties = schema.get("properties")
+    if isinstance(properties, dict):
+        schema["required"] = list(properties)
+        for value in properties.values():
+            strict_json_schema(value, root)
+    if isinstance(schema.get("items"), dict):
+        strict_json_schema(schema["items"], root)
+    for variant in schema.get("anyOf", []):
+        strict_json_schema(variant, root)
+
+    all_of = schema.get("allOf")
+    if isinstance(all_of, list):
+        if len(all_of) == 1:
+            schema.update(strict_json_schema(schema.pop("allOf")[0], root))
+        else:
+            for entry in all_of:
+                strict_json_schema(entry, root)
+
+    if "default" in schema and schema["default"] is None:
+        del schema["default"]
+
+    ref = schema.get("$ref")
+    if ref and len(schema) > 1:
+        resolved = root
+        for part in ref.removeprefix("#/").split("/"):
+            resolved = resolved[part]
+        del schema["$ref"]
+        schema.update({**resolved, **schema})
+        return strict_json_schema(schema, root)
+    return schema
+
+
+def text_format_param(text_format: Type[BaseModel]) -> dict:
+    """The text.format of a /v1/responses request for a pydantic output model"""
+    return {
+        "type": "json_schema",
+        "name": text_format.__name__,
+        "schema": strict_json_schema(text_format.model_json_schema()),
+        "strict": True,
+    }
+
+
+def build_request(custom_id: str, operation: str, model: str, input: list, text_format) -> dict:
+    """Build one JSONL line for a structured-output /v1/responses request."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "input": input,
+            "text": {"format": text_format_param(text_format)},
+            "prompt_cache_key": operation,
+        },
+    }
+
+
+def pdf_invoice_request(message_id: str, text: str, customers_context: Optional[str] = None) -> dict:
+    """The batch equivalent of a pdf_invoice call for one message."""
+    return build_request(
+        custom_id_for("pdf_invoice", message_id),
+        "pdf_invoice",
+        PDF_INVOICE_MODEL,
+        pdf_invoice_input(text, customers_context),
+        InvoiceData,
+    )
+
+
+def queue_requests(requests: List[Tuple[dict, dict]], max_requests: int = BATCH_MAX_REQUESTS) -> List[Path]:
+    """Write (request, metadata) pairs to JSONL files ready for submission.
+
+    metadata is stored against the request's custom_id (message_id,
+    subject, ...) and handed back with the result. Requests already
+    queued in an earlier run are skipped.
+    """
+    state = load_state()
+    fresh = [(request, meta) for request, meta in requests if request["custom_id"] not in state["requests"]]
+
+    paths = []
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    for number, start in enumerate(range(0, len(fresh), max_requests), start=1):
+        chunk = fresh[start:start + max_requests]
+        path = BATCH_DIR / f"requests-{stamp}-{number:03d}.jsonl"
+        path.write_text("".join(json.dumps(request) + "\n" for request, _ in chunk))
+
+        state["files"][path.name] = {"custom_ids": [request["custom_id"] for request, _ in chunk], "batch_id": None}
+        for request, meta in chunk:
+            state["requests"][request["custom_id"]] = dict(meta, file=path.name)
+        paths.append(path)
+
+    save_state(state)
+    logger.info("Queued %d requests in %d batch files", len(fresh), len(paths))
+    return paths
+
+
+def submit_pending(client: OpenAI) -> List[str]:
+    """Upload and submit every queued file that has no batch yet."""
+    state = load_state()
+    submitted = []
+    for name, record in state["files"].items():
+        if record.get("batch_id"):
+            continue
+        with open(BATCH_DIR / name, "rb") as handle:
+            uploaded = client.files.create(file=handle, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata={"source": "invoice-backlog", "file": name},
+        )
+        record.update(batch_id=batch.id, input_file_id=uploaded.id, status=batch.status)
+        # Save after each submit so a crash never submits a file twice
+        save_state(state)
+        submitted.append(batch.id)
+    return submitted
+
+
+def refresh_batches(client: OpenAI) -> Dict[str, int]:
+    """Fetch the status of unfinished batches; returns counts per status."""
+    state = load_state()
+    counts: Dict[str, int] = {}
+    for record in state["files"].values():
+        batch_id = record.get("batch_id")
+        if not batch_id:
+            continue
+        if record.get("status") not in TERMINAL_STATUSES:
+            batch = client.batches.retrieve(batch_id)
+            record.update(
+                status=batch.status,
+                output_file_id=batch.output_file_id,
+                error_file_id=batch.error_file_id,
+            )
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+    save_state(state)
+    return counts
+
+
+def wait_for_batches(client: OpenAI, poll_seconds: float = BATCH_POLL_SECONDS, timeout: Optional[float] = None,
+                     sleep: Callable[[float], None] = time.sleep) -> Dict[str, int]:
+    """Poll until every submitted batch is in a terminal state.
+
+    Returns the final status counts. Raises TimeoutError if timeout
+    seconds pass first; polling can be resumed later.
+    """
+    started = time.monotonic()
+    while True:
+        counts = refresh_batches(client)
+        active = sum(count for status, count in counts.items() if status not in TERMINAL_STATUSES)
+        if not active:
+            return counts
+        if timeout is not None and time.monotonic() - started >= timeout:
+            raise TimeoutError(f"{active} batches still running")
+        logger.info("Waiting on %d batches: %s", active, counts)
+        sleep(poll_seconds)
+
+
+def _result_path(name: str, kind: str) -> Path:
+    return BATCH_DIR / name.replace("requests-", f"{kind}-")
+
+
+def download_results(client: OpenAI) -> List[Path]:
+    """Save output and error files of finished batches next to their inputs."""
+    state = load_state()
+    saved = []
+    for name, record in state["files"].items():
+        if record.get("status") not in TERMINAL_STATUSES:
+            continue
+        for kind in ("output", "error"):
+            file_id = record.get(f"{kind}_file_id")
+            path = _result_path(name, kind)
+            if not file_id or path.exists():
+                continue
+            path.write_bytes(client.files.content(file_id).content)
+            saved.append(path)
+    return saved
+
+
+def output_text(body: dict) -> str:
+    """Concatenate the output_text parts of a raw Responses API body."""
+    texts = []
+    for item in body.get("output", []):
+        if item.get("type") != "message":
+            continue
+        for part in item.get("content", []):
+            if part.get("type") == "output_text":
+                texts.append(part.get("text", ""))
+    return "".join(texts)
+
+
+def parse_result_line(line: str, text_format=InvoiceData) -> Tuple[str, Optional[BaseModel], Optional[str]]:
+    """Parse one output/error line into (custom_id, parsed output, error)."""
+    record = json.loads(line)
+    custom_id = record.get("custom_id", "")
+    if record.get("error"):
+        return custom_id, None, record["error"].get("message", "unknown error")
+
+    response = record.get("response") or {}
+    if response.get("status_code") != 200:
+        return custom_id, None, f"HTTP {response.get('status_code')}"
+    try:
+        return custom_id, text_format.model_validate_json(output_text(response.get("body", {}))), None
+    except ValidationError as e:
+        return custom_id, None, f"invalid output: {e.error_count()} errors"
+
+
+def iter_results(text_format=InvoiceData) -> Iterator[Tuple[dict, Optional[BaseModel], Optional[str]]]:
+    """Yield (metadata, parsed output, error) for every downloaded result."""
+    state = load_state()
+    for name in state["files"]:
+        for kind in ("output", "error"):
+            path = _result_path(name, kind)
+            if not path.exists():
+                continue
+            for line in path.read_text().splitlines():
+                if not line.strip():
+                    continue
+                custom_id, parsed, error = parse_result_line(line, text_format)
+                meta = state["requests"].get(custom_id)
+                if meta is None:
+                    logger.warning("Result for unknown request %s", custom_id)
+                    continue
+                yield meta, parsed, error
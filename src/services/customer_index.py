@@ -0,0 +1,145 @@
+"""Local index for picking candidate customers for a document.
+
+Sending the whole customer list with every extraction makes the prompt
+grow with the number of jobs. Instead we score customers against the
+document text by their name and address tokens and only send the best
+few. Tokens are weighted by how rare they are across customers (a city
+everyone shares counts for little), and a matching house number plus
+street name counts for a lot. When nothing scores high enough the full
+list is sent as before.
+"""
+
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Number of candidate customers sent to the model
+CUSTOMER_TOP_K = int(os.getenv("CUSTOMER_TOP_K", "10"))
+
+# Minimum score for a customer to count as a candidate
+CUSTOMER_MIN_SCORE = float(os.getenv("CUSTOMER_MIN_SCORE", "3.0"))
+
+# House number + street name match
+_STREET_MATCH_BONUS = 6.0
+
+_SUFFIXES = {
+    "street": "st", "avenue": "ave", "av": "ave", "road": "rd", "drive": "dr",
+    "lane": "ln", "court": "ct", "boulevard": "blvd", "place": "pl", "circle": "cir",
+    "highway": "hwy", "parkway": "pkwy", "terrace": "ter", "north": "n", "south": "s",
+    "east": "e", "west": "w", "suite": "ste", "apartment": "apt",
+}
+
+_STOPWORDS = {"the", "and", "of", "inc", "llc", "co", "corp", "company", "a", "to", "for"}
+
+NO_CUSTOMERS = "No customers with addresses found."
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens with street suffixes normalised."""
+    tokens = re.findall(r"[a-z0-9]+", text.lower())
+    return [_SUFFIXES.get(token, token) for token in tokens if token not in _STOPWORDS]
+
+
+def street_keys(tokens: Sequence[str]) -> Set[Tuple[str, str]]:
+    """(house number, street word) pairs, e.g. ('1423', 'maple')."""
+    keys = set()
+    for current, following in zip(tokens, tokens[1:]):
+        if current.isdigit() and not following.isdigit():
+            keys.add((current, following))
+    return keys
+
+
+@dataclass
+class CustomerEntry:
+    name: str
+    addresses: List[str]
+    tokens: Set[str] = field(default_factory=set, repr=False)
+    streets: Set[Tuple[str, str]] = field(default_factory=set, repr=False)
+
+    def line(self) -> str:
+        """Format the customer the way the extraction prompt expects."""
+        return f"- {self.name}: {' | '.join(self.addresses)}"
+
+
+class CustomerIndex:
+    """Token index over customer names and addresses."""
+
+    def __init__(self, customers: Sequence[Tuple[str, List[str]]]) -> None:
+        # Sorted so the full-list fallback is byte-identical across runs
+        self.entries: List[CustomerEntry] = []
+        for name, addresses in sorted(customers, key=lambda customer: customer[0].lower()):
+            entry = CustomerEntry(name=name, addresses=list(addresses))
+            for text in [name, *addresses]:
+                tokens = tokenize(text)
+                entry.tokens.update(tokens)
+                entry.streets.update(street_keys(tokens))
+            self.entries.append(entry)
+
+        document_frequency: Dict[str, int] = {}
+        for entry in self.entries:
+            for token in entry.tokens:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        total = max(len(self.entries), 1)
+        self.idf = {token: math.log(1 + total / count) for token, count in document_frequency.items()}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def full_context(self) -> str:
+        """Every customer, one per line - the old get_customers_context output."""
+        if not self.entries:
+            return NO_CUSTOMERS
+        return "\n".join(entry.line() for entry in self.entries)
+
+    def score(self, text: str) -> List[Tuple[float, CustomerEntry]]:
+        """Score every customer against a document, best first."""
+        tokens = tokenize(text)
+        present = set(tokens)
+        streets = street_keys(tokens)
+
+        scored = []
+        for entry in self.entries:
+            score = sum(self.idf[token] for token in entry.tokens & present)
+            score += _STREET_MATCH_BONUS * len(entry.streets & streets)
+            if score > 0:
+                scored.append((score, entry))
+        scored.sort(key=lambda item: (-item[0], item[1].name.lower()))
+        return scored
+
+    def top_k(self, text: str, k: int = CUSTOMER_TOP_K, min_score: float = CUSTOMER_MIN_SCORE) -> List[CustomerEntry]:
+        """Best matching customers for a document, at most k."""
+        return [entry for score, entry in self.score(text)[:k] if score >= min_score]
+
+    def best_match(self, text: str, min_score: float = CUSTOMER_MIN_SCORE) -> Optional[str]:
+        """Name of the one customer a document clearly belongs to.
+
+        Used where no model picks the customer (template extractions).
+        None when nothing scores high enough or the best two tie.
+        """
+        scored = self.score(text)
+        if not scored or scored[0][0] < min_score:
+            return None
+        if len(scored) > 1 and scored[1][0] == scored[0][0]:
+            return None
+        return scored[0][1].name
+
+    def context_for(self, text: str, k: int = CUSTOMER_TOP_K, min_score: float = CUSTOMER_MIN_SCORE) -> str:
+        """Customer list for an extraction prompt.
+
+        Only the top candidates are sent; the full list is the fallback
+        when no customer matches the document well enough.
+        """
+        candidates = self.top_k(text, k=k, min_score=min_score)
+        if not candidates:
+            logger.info("No customer candidates found, sending all %d customers", len(self.entries))
+            return self.full_context()
+
+        logger.info("Sending %d of %d customers as candidates", len(candidates), len(self.entries))
+        # Keep list order stable regardless of score order
+        candidates.sort(key=lambda entry: entry.name.lower())
+        return "\n".join(entry.line() for entry in candidates)
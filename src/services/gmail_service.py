@@ -1,24 +1,20 @@
-import os.path
-import base64
-from pathlib import Path
 from typing import Optional
 from bs4 import BeautifulSoup
 from googleapiclient.discovery import build
 
 # Local imports
-from parsers.pdf_parser import extract_text_from_pdf
+from services.attachment_store import read_attachment
 from utils.auth import load_creds, decode_data, decode_bytes, get_or_create_label
 
 # Build Gmail service
 service = build("gmail", "v1", credentials=load_creds())
 
+# Sender address of each fetched message, for rule-based classification
+_senders = {}
+
 
 def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str] = None):
     """Fetch Gmail messages with attachments"""
-    # Get project root directory for attachments
-    project_root = Path(__file__).parent.parent.parent
-    attachments_dir = project_root / "attachments"
-
     list_params = {
         "userId": "me",
         "maxResults": max_results,
@@ -37,6 +33,7 @@ def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str]
             for h in payload.get("headers", [])
         }
         subject = headers.get("subject", "")
+        _senders[ref["id"]] = headers.get("from", "")
         body = payload.get("body", {})
         raw_data = body.get("data", "")
         label_id = get_or_create_label(service, "ai_checked")
@@ -68,15 +65,7 @@ def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str]
             inline_data = part_body.get("data")
             if filename and inline_data:
                 binary_data = decode_bytes(inline_data)
-
-                if filename.endswith('.pdf'):
-                    temp_path = attachments_dir / filename
-                    temp_path.parent.mkdir(exist_ok=True)
-                    temp_path.write_bytes(binary_data)
-                    pdf_text = extract_text_from_pdf(temp_path)
-                    attachments.append((filename, pdf_text))
-                else:
-                    attachments.append((filename, binary_data))
+                attachments.append(read_attachment(ref["id"], filename, binary_data))
                 continue
 
             attachment_id = part_body.get("attachmentId")
@@ -87,15 +76,13 @@ def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str]
                     id=attachment_id,
                 ).execute()
                 binary_data = decode_bytes(attachment.get("data", ""))
-                if filename.lower().endswith('.pdf'):
-                    temp_path = attachments_dir / filename
-                    temp_path.parent.mkdir(exist_ok=True)
-                    temp_path.write_bytes(binary_data)
-                    pdf_text = extract_text_from_pdf(temp_path)
-                    attachments.append((filename, pdf_text))
-                else:
-                    attachments.append((filename, binary_data))
+                attachments.append(read_attachment(ref["id"], filename, binary_data))
 
             parts_to_inspect.extend(part.get("parts", []))
 
         yield ref["id"], subject, message_text, attachments
+
+
+def get_sender(message_id: str) -> str:
+    """Return the sender of a message fetched in this run."""
+    return _senders.get(message_id, "")
@@ -0,0 +1,157 @@
+"""Disk-backed cache for parsed LLM responses.
+
+Re-running the pipeline after a crash, or after processed_emails.json is
+reset, should not pay for the same OpenAI calls again. Responses are
+stored in SQLite under a key built from the model, the prompt version
+and a hash of the exact request input, and hold the parsed Pydantic
+output as JSON.
+
+The prompt version is a hash of the static instructions and the output
+schema, so editing a prompt or a model class automatically stops old
+entries from matching; they are purged the next time that operation
+stores a result. The cache is bounded by LLM_CACHE_MAX_BYTES and evicts
+least recently used entries first.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+CACHE_FILE = DATA_DIR / "llm_cache.sqlite3"
+
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def prompt_version(instructions: str, text_format: Type[BaseModel]) -> str:
+    """Hash the static prompt and output schema into a short version tag."""
+    schema = json.dumps(text_format.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(f"{instructions}\n{schema}".encode()).hexdigest()[:16]
+
+
+def input_hash(payload) -> str:
+    """Hash a JSON-serialisable request payload."""
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed, size-bounded LRU cache of parsed model outputs."""
+
+    def __init__(self, path: Optional[Path] = None, max_bytes: int = LLM_CACHE_MAX_BYTES) -> None:
+        self.path = Path(path) if path else CACHE_FILE
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " operation TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " prompt_version TEXT NOT NULL,"
+            " output TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(operation: str, model: str, version: str, payload) -> str:
+        return f"{operation}:{model}:{version}:{input_hash(payload)}"
+
+    def get(self, key: str, text_format: Type[ModelT]) -> Optional[ModelT]:
+        """Return the cached parsed output for a key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT output FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+        try:
+            value = text_format.model_validate_json(row[0])
+        except ValueError:
+            # Stored output no longer fits the model - treat as a miss
+            self.delete(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, operation: str, model: str, version: str, value: BaseModel):
+        """Store a parsed output and enforce the size bound."""
+        output = value.model_dump_json()
+        now = time.time()
+        with self._lock:
+            # Entries written with an older prompt can never match again
+            self._conn.execute(
+                "DELETE FROM responses WHERE operation = ? AND prompt_version != ?",
+                (operation, version),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, operation, model, version, output, len(output), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def invalidate(self, operation: Optional[str] = None) -> int:
+        """Drop every entry, or every entry for one operation."""
+        with self._lock:
+            if operation:
+                cursor = self._conn.execute("DELETE FROM responses WHERE operation = ?", (operation,))
+            else:
+                cursor = self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            return cursor.rowcount
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        """Remove least recently used entries until under max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info("LLM cache evicted %d entries", evicted)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,249 @@
+"""Per-call token and latency accounting for LLM requests.
+
+Every responses.parse call made through ai_parser (sync or async) is
+recorded with its operation, model, input/output/cached tokens and
+wall-clock latency in data/llm_metrics.sqlite3. Recording is off until
+a store is activated, which main() does for each run:
+
+    store = MetricsStore()
+    activate(store)
+    ...
+    print(format_summary(store.summary()))
+
+The summary groups calls by label (the kind of work: classification,
+invoice, shipping, client_communications) and model, with p50/p95
+latency, token totals and an estimated cost from MODEL_PRICES.
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+METRICS_FILE = DATA_DIR / "llm_metrics.sqlite3"
+
+# USD per million tokens: (input, cached input, output)
+MODEL_PRICES: Dict[str, tuple] = {
+    "gpt-5": (1.25, 0.125, 10.00),
+    "gpt-5-mini": (0.25, 0.025, 2.00),
+    "gpt-4o-2024-08-06": (2.50, 1.25, 10.00),
+}
+
+# Which kind of work each operation belongs to
+OPERATION_LABELS = {
+    "invoice_label": "classification",
+    "invoice_label_batch": "classification",
+    "pdf_invoice": "invoice",
+    "ai_invoice": "invoice",
+    "pdf_invoice_header": "invoice",
+    "pdf_invoice_chunk": "invoice",
+    "invoice_repair": "invoice",
+    "parse_shipping": "shipping",
+    "parse_client_communication": "client_communications",
+    "classify_and_extract": "fused",
+}
+
+
+@dataclass
+class CallRecord:
+    """One LLM request."""
+    operation: str
+    model: str
+    latency_seconds: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    cache_hit: bool = False
+    error: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return OPERATION_LABELS.get(self.operation, self.operation)
+
+
+def estimate_cost(model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> Optional[float]:
+    """Estimated USD cost of a call, or None for a model without a price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    uncached = max(input_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * cached_price + output_tokens * output_price) / 1_000_000
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile (pct in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def usage_counts(usage) -> tuple:
+    """(input, output, cached) token counts from a response's usage object."""
+    def count(value) -> int:
+        return value if isinstance(value, int) else 0
+
+    input_tokens = count(getattr(usage, "input_tokens", None))
+    output_tokens = count(getattr(usage, "output_tokens", None))
+    cached_tokens = count(getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", None))
+    return input_tokens, output_tokens, cached_tokens
+
+
+class MetricsStore:
+    """SQLite-backed store of call records, one run_id per instance."""
+
+    def __init__(self, path: Optional[Path] = None, run_id: Optional[str] = None) -> None:
+        self.path = Path(path) if path else METRICS_FILE
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id or uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            " run_id TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " operation TEXT NOT NULL,"
+            " label TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " latency_seconds REAL NOT NULL,"
+            " input_tokens INTEGER NOT NULL,"
+            " output_tokens INTEGER NOT NULL,"
+            " cached_tokens INTEGER NOT NULL,"
+            " cache_hit INTEGER NOT NULL,"
+            " error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS calls_run ON calls (run_id)")
+        self._conn.commit()
+
+    def record(self, call: CallRecord):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.run_id, time.time(), call.operation, call.label, call.model, call.latency_seconds,
+                    call.input_tokens, call.output_tokens, call.cached_tokens, int(call.cache_hit), call.error,
+                ),
+            )
+            self._conn.commit()
+
+    def records(self, run_id: Optional[str] = None) -> List[CallRecord]:
+        """Every call recorded for a run (this store's run by default)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT operation, model, latency_seconds, input_tokens, output_tokens, cached_tokens, cache_hit, error"
+                " FROM calls WHERE run_id = ? ORDER BY created_at",
+                (run_id or self.run_id,),
+            ).fetchall()
+        return [
+            CallRecord(operation, model, latency, input_tokens, output_tokens, cached_tokens, bool(cache_hit), error)
+            for operation, model, latency, input_tokens, output_tokens, cached_tokens, cache_hit, error in rows
+        ]
+
+    def summary(self, run_id: Optional[str] = None) -> List[dict]:
+        """Aggregate a run's calls per (label, model)."""
+        groups: Dict[tuple, List[CallRecord]] = {}
+        for call in self.records(run_id):
+            groups.setdefault((call.label, call.model), []).append(call)
+
+        rows = []
+        for (label, model), calls in sorted(groups.items()):
+            # Cache hits never reach the API, so they would skew latency
+            api_calls = [call for call in calls if not call.cache_hit]
+            latencies = [call.latency_seconds for call in api_calls if not call.error]
+            input_tokens = sum(call.input_tokens for call in api_calls)
+            output_tokens = sum(call.output_tokens for call in api_calls)
+            cached_tokens = sum(call.cached_tokens for call in api_calls)
+            rows.append({
+                "label": label,
+                "model": model,
+                "calls": len(api_calls),
+                "cache_hits": len(calls) - len(api_calls),
+                "errors": sum(1 for call in api_calls if call.error),
+                "p50_seconds": percentile(latencies, 50),
+                "p95_seconds": percentile(latencies, 95),
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cached_tokens": cached_tokens,
+                "cost_usd": estimate_cost(model, input_tokens, cached_tokens, output_tokens),
+            })
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def format_summary(rows: List[dict]) -> str:
+    """Render summary rows as a plain-text table."""
+    if not rows:
+        return "LLM usage: no calls"
+
+    def seconds(value) -> str:
+        return f"{value:.2f}s" if value is not None else "-"
+
+    lines = [
+        f"{'label':<22} {'model':<18} {'calls':>5} {'hits':>4} {'err':>3} {'p50':>7} {'p95':>7} "
+        f"{'in tok':>9} {'cached':>9} {'out tok':>8} {'cost':>9}"
+    ]
+    total_cost = 0.0
+    for row in rows:
+        cost = row["cost_usd"]
+        total_cost += cost or 0.0
+        lines.append(
+            f"{row['label']:<22} {row['model']:<18} {row['calls']:>5} {row['cache_hits']:>4} {row['errors']:>3} "
+            f"{seconds(row['p50_seconds']):>7} {seconds(row['p95_seconds']):>7} "
+            f"{row['input_tokens']:>9} {row['cached_tokens']:>9} {row['output_tokens']:>8} "
+            f"{f'${cost:.4f}' if cost is not None else '-':>9}"
+        )
+    lines.append(f"Estimated LLM cost this run: ${total_cost:.4f}")
+    return "\n".join(lines)
+
+
+_active_store: Optional[MetricsStore] = None
+
+
+def activate(store: Optional[MetricsStore]):
+    """Send call records to this store (None turns recording off)."""
+    global _active_store
+    _active_store = store
+
+
+def record_call(call: CallRecord):
+    """Record a call in the active store, if any. Never raises."""
+    store = _active_store
+    if store is None:
+        return
+    try:
+        store.record(call)
+    except sqlite3.Error as e:
+        logger.warning("Failed to record LLM metrics: %s", e)
+
+
+def record_response(operation: str, model: str, latency_seconds: float, response=None, error: Optional[BaseException] = None):
+    """Record a finished (or failed) responses.parse call."""
+    input_tokens, output_tokens, cached_tokens = usage_counts(getattr(response, "usage", None))
+    record_call(CallRecord(
+        operation=operation,
+        model=model,
+        latency_seconds=latency_seconds,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cached_tokens=cached_tokens,
+        error=type(error).__name__ if error is not None else None,
+    ))
+
+
+def record_cache_hit(operation: str, model: str):
+    """Record a call answered from the local LLM cache."""
+    record_call(CallRecord(operation=operation, model=model, latency_seconds=0.0, cache_hit=True))
@@ -0,0 +1,323 @@
+"""Retries, deadlines and hedged requests for LLM calls.
+
+Without this a timeout, 5xx or 429 from the API aborts the message being
+processed, and one slow call holds up the serial loop for as long as the
+SDK's ten-minute default timeout. With a CallLayer activated (main()
+does this, on a client built with max_retries=0 so the SDK does not
+retry underneath it):
+
+- retryable errors (timeouts, connection errors, 408/409/429/5xx) are
+  retried with full-jitter exponential backoff, honouring Retry-After
+- every logical call has a deadline (LLM_CALL_DEADLINE seconds, or a
+  per-model override such as LLM_STRONG_MODEL_DEADLINE for the model that
+  extracts long PDFs) covering all of its attempts; each attempt's HTTP
+  timeout is what is left of it
+- with LLM_HEDGE=true, an attempt still running after the p95 latency of
+  recent calls of the same operation and model gets a duplicate request,
+  and whichever answers first is used. The duplicate costs tokens, so
+  hedging is off by default.
+
+Each attempt is still recorded by llm_metrics. Retry and hedge counts
+are kept in CallLayer.stats and printed at the end of a run:
+
+    layer = CallLayer()
+    activate(layer)
+    ...
+    print(format_stats(layer.stats))
+    layer.close()
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from services.llm_metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "180"))
+# The strong model can take minutes on a long PDF; this matches the SDK's
+# own ten-minute timeout that applied before the call layer
+LLM_STRONG_MODEL_DEADLINE = float(os.getenv("LLM_STRONG_MODEL_DEADLINE", "600"))
+
+# Hedging: duplicate an attempt once it runs past this percentile of recent
+# latencies, after enough samples, and never sooner than the minimum delay
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+# Recent latencies kept per (operation, model)
+_LATENCY_WINDOW = 200
+
+T = TypeVar("T")
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = LLM_MAX_RETRIES
+    backoff_base: float = LLM_BACKOFF_BASE
+    backoff_max: float = LLM_BACKOFF_MAX
+    deadline: float = LLM_CALL_DEADLINE
+    # Deadlines for particular models, overriding deadline
+    model_deadlines: Dict[str, float] = field(default_factory=dict)
+    hedge: bool = LLM_HEDGE
+    hedge_percentile: float = LLM_HEDGE_PERCENTILE
+    hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES
+    hedge_min_delay: float = LLM_HEDGE_MIN_DELAY
+
+    def deadline_for(self, model: str) -> float:
+        return self.model_deadlines.get(model, self.deadline)
+
+
+@dataclass
+class CallStats:
+    """Counters for one run."""
+    calls: int = 0
+    attempts: int = 0
+    retries: int = 0
+    gave_up: int = 0
+    deadline_exceeded: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    retries_by_error: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, dropped connections, rate limits and server errors"""
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait (Retry-After header), if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy, rand: Callable[[], float] = random.random) -> float:
+    """Full-jitter exponential backoff before retry number attempt (0-based)"""
+    return rand() * min(policy.backoff_max, policy.backoff_base * 2 ** attempt)
+
+
+class CallLayer:
+    """Runs LLM request attempts with retries, a deadline and optional hedging."""
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep, async_sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+                 rand: Callable[[], float] = random.random) -> None:
+        self.policy = policy or RetryPolicy()
+        self.stats = CallStats()
+        self._clock = clock
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._rand = rand
+        self._latencies: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=_LATENCY_WINDOW))
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def close(self):
+        """Shut down the hedging threads; a losing request still running is abandoned"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def record_latency(self, operation: str, model: str, seconds: float):
+        with self._lock:
+            self._latencies[(operation, model)].append(seconds)
+
+    def hedge_delay(self, operation: str, model: str) -> Optional[float]:
+        """How long to wait before hedging, or None if not hedging this call"""
+        if not self.policy.hedge:
+            return None
+        with self._lock:
+            samples = list(self._latencies[(operation, model)])
+        if len(samples) < self.policy.hedge_min_samples:
+            return None
+        return max(percentile(samples, self.policy.hedge_percentile), self.policy.hedge_min_delay)
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    def _next_delay(self, operation: str, attempt: int, error: BaseException, deadline: float) -> Optional[float]:
+        """Seconds to wait before retrying, or None to give up and raise"""
+        if not is_retryable(error):
+            return None
+        if attempt >= self.policy.max_retries:
+            self._count(gave_up=1)
+            logger.warning("%s failed after %d attempts: %s", operation, attempt + 1, error)
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            delay = backoff_delay(attempt, self.policy, self._rand)
+        if self._clock() + delay >= deadline:
+            self._count(deadline_exceeded=1)
+            logger.warning("%s out of time after %d attempts: %s", operation, attempt + 1, error)
+            return None
+        with self._lock:
+            self.stats.retries += 1
+            self.stats.retries_by_error[type(error).__name__] += 1
+        logger.info("%s retrying in %.2fs after %s", operation, delay, type(error).__name__)
+        return delay
+
+    # --- blocking ---
+
+    def _timed(self, operation: str, model: str, attempt: Callable[[Optional[float]], T], timeout: float) -> T:
+        started = self._clock()
+        result = attempt(timeout)
+        self.record_latency(operation, model, self._clock() - started)
+        return result
+
+    def _hedged(self, operation: str, model: str, attempt: Callable[[Optional[float]], T], deadline: float) -> T:
+        delay = self.hedge_delay(operation, model)
+        if delay is None:
+            return self._timed(operation, model, attempt, max(deadline - self._clock(), 0.001))
+
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+        primary = self._pool.submit(self._timed, operation, model, attempt, max(deadline - self._clock(), 0.001))
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        logger.info("%s slower than %.2fs, sending a hedged request", operation, delay)
+        self._count(hedges=1)
+        hedge = self._pool.submit(self._timed, operation, model, attempt, max(deadline - self._clock(), 0.001))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count(hedge_wins=1)
+                    # The other request finishes in the background; its answer is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, operation: str, model: str, attempt: Callable[[Optional[float]], T]) -> T:
+        """Run attempt(timeout) until it succeeds, fails for good, or the deadline passes"""
+        self._count(calls=1)
+        deadline = self._clock() + self.policy.deadline_for(model)
+        number = 0
+        while True:
+            self._count(attempts=1)
+            try:
+                return self._hedged(operation, model, attempt, deadline)
+            except Exception as e:
+                delay = self._next_delay(operation, number, e, deadline)
+                if delay is None:
+                    raise
+            self._sleep(delay)
+            number += 1
+
+    # --- async ---
+
+    async def _timed_async(self, operation: str, model: str, attempt: Callable[[Optional[float]], Awaitable[T]], timeout: float) -> T:
+        started = self._clock()
+        result = await attempt(timeout)
+        self.record_latency(operation, model, self._clock() - started)
+        return result
+
+    async def _hedged_async(self, operation: str, model: str, attempt: Callable[[Optional[float]], Awaitable[T]], deadline: float) -> T:
+        delay = self.hedge_delay(operation, model)
+        if delay is None:
+            return await self._timed_async(operation, model, attempt, max(deadline - self._clock(), 0.001))
+
+        primary = asyncio.ensure_future(self._timed_async(operation, model, attempt, max(deadline - self._clock(), 0.001)))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        logger.info("%s slower than %.2fs, sending a hedged request", operation, delay)
+        self._count(hedges=1)
+        hedge = asyncio.ensure_future(self._timed_async(operation, model, attempt, max(deadline - self._clock(), 0.001)))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count(hedge_wins=1)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call_async(self, operation: str, model: str, attempt: Callable[[Optional[float]], Awaitable[T]]) -> T:
+        """Async counterpart of call; the losing hedged request is cancelled"""
+        self._count(calls=1)
+        deadline = self._clock() + self.policy.deadline_for(model)
+        number = 0
+        while True:
+            self._count(attempts=1)
+            try:
+                return await self._hedged_async(operation, model, attempt, deadline)
+            except Exception as e:
+                delay = self._next_delay(operation, number, e, deadline)
+                if delay is None:
+                    raise
+            await self._async_sleep(delay)
+            number += 1
+
+
+def format_stats(stats: CallStats) -> str:
+    """One-paragraph summary of retries and hedges for the end of a run"""
+    line = (
+        f"LLM calls: {stats.calls} ({stats.attempts} attempts), {stats.retries} retries, "
+        f"{stats.gave_up} gave up, {stats.deadline_exceeded} past deadline, "
+        f"{stats.hedges} hedged ({stats.hedge_wins} won by the hedge)"
+    )
+    if stats.retries_by_error:
+        line += "\nRetried errors: " + ", ".join(f"{name} x{count}" for name, count in sorted(stats.retries_by_error.items()))
+    return line
+
+
+_active_layer: Optional[CallLayer] = None
+
+
+def activate(layer: Optional[CallLayer]):
+    """Route LLM calls through this layer (None: one attempt, no deadline)."""
+    global _active_layer
+    _active_layer = layer
+
+
+def active_layer() -> Optional[CallLayer]:
+    return _active_layer
@@ -0,0 +1,474 @@
+"""Local stand-in for the OpenAI Responses, Files and Batch APIs.
+
+Lets the batch backlog flow, and the live pipeline's responses.parse
+calls, run end to end without network access or an API key. Point the
+client at it with OpenAI(base_url=server.base_url) or OPENAI_BASE_URL,
+or run it directly:
+
+    cd src && python -m services.openai_standin --port 8765 --latency-median 1.5 --error-rate 0.02 --rpm 500
+
+Batches stay in_progress for completion_delay seconds, then every
+request line is answered by a responder callable. The default responder
+returns a canned object for the requested output schema.
+
+POST /v1/responses is answered by the same responder, after behaving
+like the real service under load (see Faults): each request waits for a
+latency drawn from a configurable distribution, a share of requests
+fail with a server error, and requests over the per-minute request or
+token limits get a 429 with Retry-After (a single request larger than
+the token limit gets a 413). Pipeline throughput and the
+retry/hedging layer can be benchmarked against it offline.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+from models.invoice import (
+    ClassifiedEmail,
+    ClientData,
+    EmailLabel,
+    InvoiceData,
+    InvoiceFix,
+    InvoiceHeader,
+    InvoiceLine,
+    InvoiceResult,
+    LabelBatch,
+    LabelSort,
+    LineItemChunk,
+    ShippingData,
+)
+from utils.tokens import estimate_input_tokens, estimate_tokens
+
+_CANNED_INVOICE = InvoiceData(
+    vendor_display_name="Stand-in Supply Co",
+    invoice_number="SI-1001",
+    invoice_date="01/15/2026",
+    line_items=[InvoiceLine(item="Lumber 2x4", rate=5.0, quantity=10, category="Materials")],
+    total_amount=50.0,
+)
+
+CANNED_OUTPUTS: Dict[str, BaseModel] = {
+    "InvoiceData": _CANNED_INVOICE,
+    "LabelSort": LabelSort(label="invoice"),
+    "ShippingData": ShippingData(carrier="UPS", tracking_number="1Z999AA10123456784", delivery_status="in transit"),
+    "ClientData": ClientData(summary="Client asked for a project status update.", urgency="low"),
+    "ClassifiedEmail": ClassifiedEmail(result=InvoiceResult(label="invoice", invoice=_CANNED_INVOICE)),
+    "InvoiceHeader": InvoiceHeader(**_CANNED_INVOICE.model_dump(exclude={"line_items"})),
+    "LineItemChunk": LineItemChunk(line_items=_CANNED_INVOICE.line_items),
+    "InvoiceFix": InvoiceFix(),
+}
+
+_EMAIL_HEADER = re.compile(r"^=== Email \d+ ===$", re.MULTILINE)
+
+
+def _input_text(body: dict) -> str:
+    parts = []
+    for message in body.get("input", []):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    return "\n".join(parts)
+
+
+def canned_responder(body: dict) -> BaseModel:
+    """Answer a /v1/responses request with the canned object for its schema."""
+    name = body.get("text", {}).get("format", {}).get("name")
+    if name == "LabelBatch":
+        # One label per email in the batch, or the caller falls back to single calls
+        count = len(_EMAIL_HEADER.findall(_input_text(body)))
+        label = CANNED_OUTPUTS["LabelSort"].label
+        return LabelBatch(labels=[EmailLabel(email=number, label=label) for number in range(1, count + 1)])
+    if name not in CANNED_OUTPUTS:
+        raise ValueError(f"No canned output for format {name!r}")
+    return CANNED_OUTPUTS[name]
+
+
+@dataclass
+class Latency:
+    """How long a /v1/responses request takes, in seconds.
+
+    distribution is one of:
+    - fixed: always median
+    - uniform: median +/- spread
+    - lognormal: median with log-space sigma spread (long right tail, like the real API)
+    - exponential: mean of median / ln 2
+
+    On top of that, tail_rate of requests are outliers taking tail_seconds.
+    """
+    distribution: str = "fixed"
+    median: float = 0.0
+    spread: float = 0.0
+    tail_rate: float = 0.0
+    tail_seconds: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.tail_rate and rng.random() < self.tail_rate:
+            return self.tail_seconds
+        if self.distribution == "fixed":
+            return self.median
+        if self.distribution == "uniform":
+            return max(rng.uniform(self.median - self.spread, self.median + self.spread), 0.0)
+        if self.distribution == "lognormal":
+            return rng.lognormvariate(math.log(self.median), self.spread) if self.median > 0 else 0.0
+        if self.distribution == "exponential":
+            return rng.expovariate(math.log(2) / self.median) if self.median > 0 else 0.0
+        raise ValueError(f"Unknown latency distribution {self.distribution!r}")
+
+
+@dataclass
+class Faults:
+    """Simulated service behaviour for /v1/responses.
+
+    latency applies to every model unless model_latency has an entry for
+    it. error_rate of requests fail with error_status after their
+    latency. requests_per_minute and tokens_per_minute (estimated prompt
+    tokens) are enforced over a sliding minute; 0 means unlimited.
+    """
+    latency: Latency = field(default_factory=Latency)
+    model_latency: Dict[str, Latency] = field(default_factory=dict)
+    error_rate: float = 0.0
+    error_status: int = 500
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+    seed: Optional[int] = None
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    completed: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    latency_seconds: float = 0.0
+
+
+def response_body(model: str, output, request_id: str) -> dict:
+    """Wrap parsed output in the JSON shape of a Responses API response."""
+    text = output.model_dump_json() if isinstance(output, BaseModel) else json.dumps(output)
+    return {
+        "id": f"resp_{request_id}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [{
+            "id": f"msg_{request_id}",
+            "type": "message",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _usage(body: dict, text: str) -> dict:
+    """Estimated token usage, so metrics and cost reports have numbers to show"""
+    input_tokens = estimate_input_tokens(body.get("input", []))
+    output_tokens = estimate_tokens(text)
+    return {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": 0},
+        "output_tokens": output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + output_tokens,
+    }
+
+
+class StandInOpenAI:
+    """In-process HTTP server implementing the subset of the API we use."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, responder: Callable[[dict], object] = canned_responder,
+                 completion_delay: float = 0.0, faults: Optional[Faults] = None,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.responder = responder
+        self.completion_delay = completion_delay
+        self.faults = faults or Faults()
+        self.stats = ServerStats()
+        self.files: Dict[str, dict] = {}
+        self.batches: Dict[str, dict] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.faults.seed)
+        self._sleep = sleep
+        self._window: deque = deque()  # (time, tokens) of requests admitted in the last minute
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StandInOpenAI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in the calling thread (used when run as a script)."""
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StandInOpenAI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _next_id(self, prefix: str) -> str:
+        return f"{prefix}-standin-{next(self._ids)}"
+
+    def add_file(self, filename: str, purpose: str, data: bytes) -> dict:
+        with self._lock:
+            file_id = self._next_id("file")
+            record = {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(data),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+            }
+            self.files[file_id] = {"meta": record, "data": data}
+        return record
+
+    def _admit(self, tokens: int) -> Optional[float]:
+        """Count a request against the rate limits; seconds to wait if over them"""
+        faults = self.faults
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0][0] >= 60:
+                self._window.popleft()
+            over_requests = faults.requests_per_minute and len(self._window) >= faults.requests_per_minute
+            over_tokens = faults.tokens_per_minute and sum(used for _, used in self._window) + tokens > faults.tokens_per_minute
+            if over_requests or over_tokens:
+                return max(60 - (now - self._window[0][0]), 0.001) if self._window else 1.0
+            self._window.append((now, tokens))
+        return None
+
+    def respond(self, body: dict) -> tuple:
+        """(status, payload, headers) for a /v1/responses request"""
+        faults = self.faults
+        model = body.get("model", "")
+        with self._lock:
+            self.stats.requests += 1
+            request_id = self._next_id("req")
+            latency = faults.model_latency.get(model, faults.latency).sample(self._rng)
+            failed = faults.error_rate > 0 and self._rng.random() < faults.error_rate
+
+        tokens = estimate_input_tokens(body.get("input", []))
+        if faults.tokens_per_minute and tokens > faults.tokens_per_minute:
+            # Could never fit in the window, so not worth retrying
+            error = {
+                "message": f"Request too large: {tokens} tokens, limit {faults.tokens_per_minute} per minute (stand-in)",
+                "type": "invalid_request_error",
+                "code": "request_too_large",
+            }
+            return 413, {"error": error}, {}
+
+        wait = self._admit(tokens)
+        if wait is not None:
+            with self._lock:
+                self.stats.rate_limited += 1
+            error = {"message": "Rate limit reached (stand-in)", "type": "requests", "code": "rate_limit_exceeded"}
+            return 429, {"error": error}, {"retry-after": f"{wait:.3f}", "retry-after-ms": str(int(wait * 1000))}
+
+        self._sleep(latency)
+        with self._lock:
+            self.stats.latency_seconds += latency
+        if failed:
+            with self._lock:
+                self.stats.errors += 1
+            return faults.error_status, {"error": {"message": "Injected server error (stand-in)", "type": "server_error", "code": None}}, {}
+
+        try:
+            output = self.responder(body)
+        except Exception as e:
+            return 400, {"error": {"message": str(e), "type": "invalid_request_error", "code": None}}, {}
+        payload = response_body(model, output, request_id)
+        payload["usage"] = _usage(body, payload["output"][0]["content"][0]["text"])
+        with self._lock:
+            self.stats.completed += 1
+        return 200, payload, {}
+
+    def create_batch(self, params: dict) -> dict:
+        with self._lock:
+            batch_id = self._next_id("batch")
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": params["endpoint"],
+                "completion_window": params.get("completion_window", "24h"),
+                "input_file_id": params["input_file_id"],
+                "created_at": int(time.time()),
+                "status": "in_progress",
+                "metadata": params.get("metadata"),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            self.batches[batch_id] = batch
+        return batch
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        batch = self.batches.get(batch_id)
+        if batch and batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.completion_delay:
+            self._run_batch(batch)
+        return batch
+
+    def _run_batch(self, batch: dict):
+        """Answer every request in the input file and write output/error files."""
+        lines = self.files[batch["input_file_id"]]["data"].decode().splitlines()
+        outputs, errors = [], []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            request_id = self._next_id("req")
+            try:
+                output = self.responder(request["body"])
+                outputs.append({
+                    "id": request_id,
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": request_id,
+                        "body": response_body(request["body"].get("model", ""), output, request_id),
+                    },
+                    "error": None,
+                })
+            except Exception as e:
+                errors.append({
+                    "id": request_id,
+                    "custom_id": request["custom_id"],
+                    "response": None,
+                    "error": {"code": "standin_error", "message": str(e)},
+                })
+
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        if outputs:
+            data = "\n".join(json.dumps(item) for item in outputs).encode() + b"\n"
+            batch["output_file_id"] = self.add_file(f"{batch['id']}_output.jsonl", "batch_output", data)["id"]
+        if errors:
+            data = "\n".join(json.dumps(item) for item in errors).encode() + b"\n"
+            batch["error_file_id"] = self.add_file(f"{batch['id']}_error.jsonl", "batch_output", data)["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _not_found(self):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                if path == "/v1/files":
+                    message = BytesParser(policy=HTTP).parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self._read_body()
+                    )
+                    fields = {}
+                    filename, data = "upload", b""
+                    for part in message.iter_parts():
+                        name = part.get_param("name", header="content-disposition")
+                        if part.get_filename():
+                            filename, data = part.get_filename(), part.get_payload(decode=True)
+                        else:
+                            fields[name] = part.get_content().strip()
+                    self._send_json(200, standin.add_file(filename, fields.get("purpose", "batch"), data))
+                elif path == "/v1/batches":
+                    self._send_json(200, standin.create_batch(json.loads(self._read_body())))
+                elif path == "/v1/responses":
+                    self._send_json(*standin.respond(json.loads(self._read_body())))
+                else:
+                    self._not_found()
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                parts = path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+                    batch = standin.get_batch(parts[2])
+                    return self._send_json(200, batch) if batch else self._not_found()
+                if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content":
+                    record = standin.files.get(parts[2])
+                    if not record:
+                        return self._not_found()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(record["data"])))
+                    self.end_headers()
+                    self.wfile.write(record["data"])
+                    return
+                self._not_found()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the local OpenAI stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--completion-delay", type=float, default=5.0)
+    parser.add_argument("--latency-distribution", choices=["fixed", "uniform", "lognormal", "exponential"], default="lognormal")
+    parser.add_argument("--latency-median", type=float, default=0.0, help="seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="uniform: +/- seconds, lognormal: sigma")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="share of requests that are slow outliers")
+    parser.add_argument("--tail-seconds", type=float, default=30.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute (0: unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="prompt tokens per minute (0: unlimited)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    faults = Faults(
+        latency=Latency(args.latency_distribution, args.latency_median, args.latency_spread, args.tail_rate, args.tail_seconds),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        seed=args.seed,
+    )
+    server = StandInOpenAI(host=args.host, port=args.port, completion_delay=args.completion_delay, faults=faults)
+    print(f"OpenAI stand-in listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
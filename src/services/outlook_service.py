@@ -9,7 +9,7 @@ import httpx
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
 
-from parsers.pdf_parser import extract_text_from_pdf
+from services.attachment_store import read_attachment
 
 load_dotenv()
 
@@ -19,7 +19,9 @@ SCOPES = ["User.Read", "Mail.ReadWrite"]
 # Paths
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 TOKEN_PATH = PROJECT_ROOT / "ms_refresh_token.txt"
-ATTACHMENTS_DIR = PROJECT_ROOT / "attachments"
+
+# Sender address of each fetched message, for rule-based classification
+_senders = {}
 
 
 def _get_access_token():
@@ -83,8 +85,6 @@ def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str]
     access_token = _get_access_token()
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    ATTACHMENTS_DIR.mkdir(exist_ok=True)
-
     # Fetch messages
     endpoint = f"{MS_GRAPH_BASE_URL}/me/messages"
     params = {
@@ -102,6 +102,7 @@ def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str]
     for msg in messages:
         message_id = msg["id"]
         subject = msg.get("subject", "")
+        _senders[message_id] = (msg.get("from") or {}).get("emailAddress", {}).get("address", "")
 
         # Extract body text
         body_content = msg.get("body", {}).get("content", "")
@@ -132,18 +133,16 @@ def fetch_messages_with_attachments(max_results: int = 10, query: Optional[str]
                         continue
 
                     binary_data = base64.b64decode(content_bytes_b64)
-
-                    if filename.lower().endswith(".pdf"):
-                        temp_path = ATTACHMENTS_DIR / filename
-                        temp_path.write_bytes(binary_data)
-                        pdf_text = extract_text_from_pdf(temp_path)
-                        attachments.append((filename, pdf_text))
-                    else:
-                        attachments.append((filename, binary_data))
+                    attachments.append(read_attachment(message_id, filename, binary_data))
 
         yield message_id, subject, message_text, attachments
 
 
+def get_sender(message_id: str) -> str:
+    """Return the sender address of a message fetched in this run."""
+    return _senders.get(message_id, "")
+
+
 # Mapping from internal label names to Outlook category names
 LABEL_TO_CATEGORY = {
     "invoice": "Invoice",
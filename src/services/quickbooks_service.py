@@ -22,6 +22,7 @@ from dotenv import load_dotenv
 
 # Local imports
 from models.invoice import InvoiceLine, InvoiceDraft
+from services.customer_index import CustomerIndex
 
 load_dotenv()
 
@@ -106,11 +107,11 @@ class QuickbooksInvoiceService:
             print("Run: python scripts/reauth_quickbooks.py")
             raise
 
-    def get_customers_context(self) -> str:
-        """Get all customers with addresses formatted for AI context"""
+    def get_customer_addresses(self):
+        """Get (display name, addresses) for every customer with an address"""
         customers = Customer.all(qb=self.qb_client)
 
-        customer_list = []
+        customer_addresses = []
         for customer in customers:
             addresses = []
 
@@ -141,10 +142,22 @@ class QuickbooksInvoiceService:
                         addresses.append(ship_addr)
 
             if addresses:
-                customer_list.append(f"- {customer.DisplayName}: {' | '.join(addresses)}")
+                customer_addresses.append((customer.DisplayName, addresses))
 
+        return customer_addresses
+
+    def get_customers_context(self) -> str:
+        """Get all customers with addresses formatted for AI context"""
+        customer_list = [
+            f"- {name}: {' | '.join(addresses)}"
+            for name, addresses in self.get_customer_addresses()
+        ]
         return "\n".join(customer_list) if customer_list else "No customers with addresses found."
 
+    def get_customer_index(self) -> CustomerIndex:
+        """Build a local index for picking candidate customers per document"""
+        return CustomerIndex(self.get_customer_addresses())
+
     def match_category_to_account(self, category: str):
         """Match expense category to QuickBooks account"""
         if not category:
@@ -537,14 +550,18 @@ class QuickbooksInvoiceService:
         print(f"Purchase created (already paid) - Total: ${draft.total_amount}, Vendor: {vendor.DisplayName}")
         return purchase
 
-    def add_attachment(self, file_path, transaction):
-        """Attach a file to a QuickBooks transaction (Bill or Purchase)"""
+    def add_attachment(self, file_path, transaction, filename=None):
+        """Attach a file to a QuickBooks transaction (Bill or Purchase)
+
+        filename overrides the name shown in QuickBooks, since stored
+        attachments live on disk under their content hash.
+        """
         import os
         from pathlib import Path
 
         attach = Attachable()
         attach._FilePath = file_path
-        attach.FileName = Path(file_path).name
+        attach.FileName = filename or Path(file_path).name
 
         # Set ContentType based on file extension
         file_ext = Path(file_path).suffix.lower()
@@ -0,0 +1,500 @@
+"""Record real pipeline runs and replay them offline.
+
+main() talks to four services: Microsoft Graph (messages, attachments,
+categories), OpenAI, Notion and QuickBooks. All of them go through
+httpx or requests, so both are intercepted at the transport level:
+
+- Recorder passes every request through and keeps the response (status,
+  content type, body and how long it took) as an Interaction
+- Replayer answers every request from those Interactions without
+  touching the network, waiting the recorded time divided by speed
+  (speed 0: no waiting, so only local work is measured)
+
+Token endpoints (AUTH_HOSTS) are never recorded, and neither are request
+headers or bodies - a request is identified by method, URL and a digest
+of its body. The recorded responses are real email, attachment and
+invoice content, so a corpus should be handled like the mailbox itself.
+
+Replay matches the recorded request with the same body first. Requests
+whose body differs between runs (multipart uploads, a prompt that
+changed) fall back to the next unused recording of the same schema
+(OpenAI structured outputs) or URL. Anything left unmatched gets a 404
+and is counted in Replayer.counts["missed"].
+
+Both sides time each request by stage (outlook, openai, notion,
+quickbooks) in a StageTimer.
+"""
+
+import abc
+import asyncio
+import base64
+import contextlib
+import gzip
+import hashlib
+import http.client
+import json
+import shutil
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from intuitlib.client import AuthClient
+from requests.structures import CaseInsensitiveDict
+
+from parsers import vendor_templates
+from services import attachment_store, llm_cache, llm_metrics, outlook_service, tracker, vision_files
+from services.llm_metrics import percentile
+from services.quickbooks_service import QuickbooksInvoiceService
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+CORPUS_DIR = DATA_DIR / "corpus"
+
+INTERACTIONS_FILE = "interactions.jsonl.gz"
+MANIFEST_FILE = "manifest.json"
+STATE_DIR = "state"
+
+STAGE_HOSTS = {
+    "graph.microsoft.com": "outlook",
+    "api.openai.com": "openai",
+    "api.notion.com": "notion",
+    "quickbooks.api.intuit.com": "quickbooks",
+    "sandbox-quickbooks.api.intuit.com": "quickbooks",
+    "developer.api.intuit.com": "quickbooks",
+}
+
+# Sign-in traffic: passed through but never written to a corpus
+AUTH_HOSTS = {"login.microsoftonline.com", "oauth.platform.intuit.com"}
+
+# Response headers worth keeping; the body is stored decoded
+KEPT_HEADERS = ("content-type", "retry-after", "retry-after-ms")
+
+
+def stage_for(url: str) -> str:
+    """Which service a request belongs to, from its host"""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if host in AUTH_HOSTS:
+        return "auth"
+    if host in STAGE_HOSTS:
+        return STAGE_HOSTS[host]
+    # OPENAI_BASE_URL pointing somewhere else, such as the local stand-in
+    if parts.path.startswith("/v1/"):
+        return "openai"
+    return host
+
+
+def body_digest(body: bytes) -> str:
+    return hashlib.sha256(body or b"").hexdigest()
+
+
+def schema_name(body: bytes) -> str:
+    """Structured-output schema of a Responses API request body, if any"""
+    try:
+        payload = json.loads(body)
+        return payload["text"]["format"]["name"]
+    except (ValueError, TypeError, KeyError):
+        return ""
+
+
+@dataclass
+class Interaction:
+    """One recorded request and its response."""
+    method: str
+    url: str
+    digest: str
+    status: int
+    body: bytes
+    elapsed: float
+    stage: str
+    schema: str = ""
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def to_json(self) -> dict:
+        record = asdict(self)
+        record["body"] = base64.b64encode(self.body).decode()
+        return record
+
+    @classmethod
+    def from_json(cls, record: dict) -> "Interaction":
+        record = dict(record)
+        record["body"] = base64.b64decode(record["body"])
+        return cls(**record)
+
+
+def save_corpus(path: Path, interactions: List[Interaction], manifest: dict):
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path / INTERACTIONS_FILE, "wt", encoding="utf-8") as handle:
+        for interaction in interactions:
+            handle.write(json.dumps(interaction.to_json()) + "\n")
+    (path / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def load_corpus(path: Path) -> Tuple[dict, List[Interaction]]:
+    """Manifest and interactions of a recorded corpus, in recording order"""
+    path = Path(path)
+    if not (path / INTERACTIONS_FILE).exists():
+        raise FileNotFoundError(f"No recorded corpus in {path}")
+    with gzip.open(path / INTERACTIONS_FILE, "rt", encoding="utf-8") as handle:
+        interactions = [Interaction.from_json(json.loads(line)) for line in handle if line.strip()]
+    manifest_path = path / MANIFEST_FILE
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    return manifest, interactions
+
+
+class StageTimer:
+    """Request latencies by stage, plus when the network was busy at all."""
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._intervals: List[Tuple[float, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, started: float, finished: float):
+        with self._lock:
+            self.samples[stage].append(finished - started)
+            self._intervals.append((started, finished))
+
+    def busy_seconds(self) -> float:
+        """Time at least one request was in flight (overlapping requests count once)"""
+        with self._lock:
+            intervals = sorted(self._intervals)
+        busy = 0.0
+        current_start = current_end = None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    busy += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            busy += current_end - current_start
+        return busy
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return stage_summary(self.samples)
+
+
+def stage_summary(samples: Dict[str, List[float]]) -> Dict[str, dict]:
+    """Call count, total seconds and p50/p95 latency per stage"""
+    return {
+        stage: {
+            "calls": len(values),
+            "total": sum(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+        }
+        for stage, values in sorted(samples.items())
+    }
+
+
+def _httpx_body(request: httpx.Request) -> bytes:
+    try:
+        return request.content
+    except httpx.RequestNotRead:
+        # Streamed (multipart) bodies are identified by URL alone
+        return b""
+
+
+def _requests_body(request: requests.PreparedRequest) -> bytes:
+    body = request.body
+    if isinstance(body, str):
+        return body.encode()
+    return body if isinstance(body, bytes) else b""
+
+
+@contextlib.contextmanager
+def _swapped(target, attribute: str, value) -> Iterator[None]:
+    """Set target.attribute to value for the with block, then put the original back
+
+    An attribute that was inherited rather than set on target itself is
+    removed again, so the base class's version shows through as before.
+    """
+    own = attribute in vars(target)
+    original = vars(target)[attribute] if own else None
+    setattr(target, attribute, value)
+    try:
+        yield
+    finally:
+        if own:
+            setattr(target, attribute, original)
+        else:
+            delattr(target, attribute)
+
+
+def _kept_headers(headers) -> Dict[str, str]:
+    return {name: headers[name] for name in KEPT_HEADERS if name in headers}
+
+
+class _Interceptor(abc.ABC):
+    """Swaps the httpx and requests send methods for the duration of a with block."""
+
+    def __init__(self) -> None:
+        self.timer = StageTimer()
+        self._stack: Optional[contextlib.ExitStack] = None
+
+    @abc.abstractmethod
+    def _send(self, original, client, request, **kwargs):
+        """Handle an httpx.Client request; original is the send it replaces"""
+
+    @abc.abstractmethod
+    async def _send_async(self, original, client, request, **kwargs):
+        """Handle an httpx.AsyncClient request"""
+
+    @abc.abstractmethod
+    def _send_requests(self, original, session, request, **kwargs):
+        """Handle a requests.Session request"""
+
+    def _hooks(self) -> list:
+        layer = self
+        sync_send, async_send, requests_send = httpx.Client.send, httpx.AsyncClient.send, requests.Session.send
+
+        def send(client, request, **kwargs):
+            return layer._send(sync_send, client, request, **kwargs)
+
+        async def send_async(client, request, **kwargs):
+            return await layer._send_async(async_send, client, request, **kwargs)
+
+        def send_requests(session, request, **kwargs):
+            return layer._send_requests(requests_send, session, request, **kwargs)
+
+        return [
+            _swapped(httpx.Client, "send", send),
+            _swapped(httpx.AsyncClient, "send", send_async),
+            _swapped(requests.Session, "send", send_requests),
+        ]
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        for hook in self._hooks():
+            self._stack.enter_context(hook)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+
+class Recorder(_Interceptor):
+    """Passes requests through and keeps every response as an Interaction."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.interactions: List[Interaction] = []
+        self._lock = threading.Lock()
+
+    def _keep(self, method: str, url: str, body: bytes, status: int, headers, content: bytes, started: float, finished: float):
+        stage = stage_for(url)
+        self.timer.add(stage, started, finished)
+        if stage == "auth":
+            return
+        interaction = Interaction(
+            method=method, url=url, digest=body_digest(body), status=status, body=content,
+            elapsed=finished - started, stage=stage, schema=schema_name(body), headers=_kept_headers(headers),
+        )
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def _send(self, original, client, request, **kwargs):
+        started = self.timer.clock()
+        response = original(client, request, **kwargs)
+        content = response.read()
+        self._keep(request.method, str(request.url), _httpx_body(request), response.status_code, response.headers, content, started, self.timer.clock())
+        return response
+
+    async def _send_async(self, original, client, request, **kwargs):
+        started = self.timer.clock()
+        response = await original(client, request, **kwargs)
+        content = await response.aread()
+        self._keep(request.method, str(request.url), _httpx_body(request), response.status_code, response.headers, content, started, self.timer.clock())
+        return response
+
+    def _send_requests(self, original, session, request, **kwargs):
+        started = self.timer.clock()
+        response = original(session, request, **kwargs)
+        content = response.content
+        self._keep(request.method, request.url, _requests_body(request), response.status_code, response.headers, content, started, self.timer.clock())
+        return response
+
+
+class Replayer(_Interceptor):
+    """Answers requests from recorded Interactions, never touching the network."""
+
+    def __init__(self, interactions: List[Interaction], speed: float = 1.0, sleep: Callable[[float], None] = time.sleep) -> None:
+        super().__init__()
+        self.interactions = list(interactions)
+        self.speed = speed
+        self.counts = {"exact": 0, "schema": 0, "url": 0, "missed": 0}
+        self._sleep = sleep
+        self._used = set()
+        self._lock = threading.Lock()
+        self._index: Dict[tuple, List[int]] = defaultdict(list)
+        for position, interaction in enumerate(self.interactions):
+            self._index[("exact", interaction.method, interaction.url, interaction.digest)].append(position)
+            if interaction.schema:
+                self._index[("schema", interaction.method, interaction.url, interaction.schema)].append(position)
+            self._index[("url", interaction.method, interaction.url)].append(position)
+
+    def match(self, method: str, url: str, body: bytes) -> Optional[Interaction]:
+        """The recording that answers this request, counted by how it matched
+
+        Each recording is used once while unused ones remain for the key;
+        after that the last one is reused (a query repeated more often
+        than it was recorded).
+        """
+        schema = schema_name(body)
+        keys = [("exact", method, url, body_digest(body))]
+        if schema:
+            keys.append(("schema", method, url, schema))
+        keys.append(("url", method, url))
+        with self._lock:
+            for key in keys:
+                positions = self._index.get(key)
+                if not positions:
+                    continue
+                position = next((p for p in positions if p not in self._used), positions[-1])
+                self._used.add(position)
+                self.counts[key[0]] += 1
+                return self.interactions[position]
+            self.counts["missed"] += 1
+        return None
+
+    def delay(self, interaction: Optional[Interaction]) -> float:
+        if interaction is None or self.speed <= 0:
+            return 0.0
+        return interaction.elapsed / self.speed
+
+    @staticmethod
+    def _answer(method: str, url: str, interaction: Optional[Interaction]) -> Tuple[int, Dict[str, str], bytes]:
+        if interaction is None:
+            body = json.dumps({"error": {"message": f"No recorded response for {method} {url}"}}).encode()
+            return 404, {"content-type": "application/json"}, body
+        return interaction.status, interaction.headers, interaction.body
+
+    def _send(self, original, client, request, **kwargs):
+        started = self.timer.clock()
+        url = str(request.url)
+        interaction = self.match(request.method, url, _httpx_body(request))
+        delay = self.delay(interaction)
+        if delay:
+            self._sleep(delay)
+        status, headers, content = self._answer(request.method, url, interaction)
+        self.timer.add(stage_for(url), started, self.timer.clock())
+        return httpx.Response(status, headers=headers, content=content, request=request)
+
+    async def _send_async(self, original, client, request, **kwargs):
+        started = self.timer.clock()
+        url = str(request.url)
+        interaction = self.match(request.method, url, _httpx_body(request))
+        delay = self.delay(interaction)
+        if delay:
+            await asyncio.sleep(delay)
+        status, headers, content = self._answer(request.method, url, interaction)
+        self.timer.add(stage_for(url), started, self.timer.clock())
+        return httpx.Response(status, headers=headers, content=content, request=request)
+
+    def _send_requests(self, original, session, request, **kwargs):
+        started = self.timer.clock()
+        interaction = self.match(request.method, request.url, _requests_body(request))
+        delay = self.delay(interaction)
+        if delay:
+            self._sleep(delay)
+        status, headers, content = self._answer(request.method, request.url, interaction)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http.client.responses.get(status, "")
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        finished = self.timer.clock()
+        response.elapsed = timedelta(seconds=finished - started)
+        self.timer.add(stage_for(request.url), started, finished)
+        return response
+
+
+# State files that decide what a run does, as (module, attribute, file name)
+STATE_FILES = [
+    (tracker, "TRACKER_FILE", "processed_emails.json"),
+    (attachment_store, "INDEX_FILE", "attachment_index.json"),
+    (vendor_templates, "TEMPLATES_FILE", "vendor_templates.json"),
+    (vision_files, "INDEX_FILE", "vision_files.json"),
+]
+
+
+def snapshot_state(destination: Path):
+    """Copy the state files a run starts from into destination"""
+    destination = Path(destination)
+    destination.mkdir(parents=True, exist_ok=True)
+    for module, attribute, name in STATE_FILES:
+        source = getattr(module, attribute)
+        if Path(source).exists():
+            shutil.copyfile(source, destination / name)
+
+
+@contextlib.contextmanager
+def isolated_state(workspace: Path, snapshot: Optional[Path] = None) -> Iterator[Path]:
+    """Point every data and attachment path at workspace for the with block
+
+    State files from snapshot (see snapshot_state) are copied in first,
+    so a replay starts from the state the recording started from. The
+    LLM cache and metrics start empty.
+    """
+    workspace = Path(workspace)
+    data_dir = workspace / "data"
+    attachments_dir = workspace / "attachments"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    attachments_dir.mkdir(parents=True, exist_ok=True)
+    if snapshot is not None and Path(snapshot).exists():
+        for _, _, name in STATE_FILES:
+            if (Path(snapshot) / name).exists():
+                shutil.copyfile(Path(snapshot) / name, data_dir / name)
+
+    paths = [
+        (tracker, "DATA_DIR", data_dir),
+        (tracker, "TRACKER_FILE", data_dir / "processed_emails.json"),
+        (attachment_store, "DATA_DIR", data_dir),
+        (attachment_store, "INDEX_FILE", data_dir / "attachment_index.json"),
+        (attachment_store, "ATTACHMENTS_DIR", attachments_dir),
+        (attachment_store, "OBJECTS_DIR", attachments_dir / "objects"),
+        (vendor_templates, "TEMPLATES_FILE", data_dir / "vendor_templates.json"),
+        (vision_files, "DATA_DIR", data_dir),
+        (vision_files, "INDEX_FILE", data_dir / "vision_files.json"),
+        (llm_cache, "CACHE_FILE", data_dir / "llm_cache.sqlite3"),
+        (llm_metrics, "METRICS_FILE", data_dir / "llm_metrics.sqlite3"),
+    ]
+    attachment_store.clear_registry()
+    with contextlib.ExitStack() as stack:
+        for module, attribute, path in paths:
+            stack.enter_context(_swapped(module, attribute, path))
+        try:
+            yield workspace
+        finally:
+            attachment_store.wait_for_writes()
+            attachment_store.clear_registry()
+
+
+@contextlib.contextmanager
+def offline_auth() -> Iterator[None]:
+    """Skip the Microsoft and Intuit sign-in, and never write tokens back"""
+    def refresh(auth_client, refresh_token=None):
+        auth_client.access_token = "replay"
+        auth_client.refresh_token = "replay"
+
+    with _swapped(outlook_service, "_get_access_token", lambda: "replay"), \
+            _swapped(AuthClient, "refresh", refresh), \
+            _swapped(QuickbooksInvoiceService, "_save_refresh_token", lambda service: None):
+        yield
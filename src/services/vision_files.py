@@ -0,0 +1,149 @@
+"""Cache OpenAI file IDs for uploaded vision images.
+
+Images too large to send inline are uploaded through the Files API.
+The file ID is remembered under the SHA-256 of the uploaded bytes in
+data/vision_files.json, so re-processing the same receipt reuses the
+earlier upload instead of sending it again. A cached ID is checked with
+the Files API before reuse; when OpenAI no longer has the file it is
+uploaded again and the index entry replaced. Uploads older than
+VISION_FILE_MAX_AGE_DAYS are deleted from OpenAI by
+cleanup_stale_uploads().
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from openai import AsyncOpenAI, NotFoundError, OpenAI
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+INDEX_FILE = DATA_DIR / "vision_files.json"
+
+VISION_FILE_MAX_AGE_DAYS = float(os.getenv("VISION_FILE_MAX_AGE_DAYS", "7"))
+
+
+def _ensure_data_dir():
+    DATA_DIR.mkdir(exist_ok=True)
+
+
+def load_index() -> Dict[str, dict]:
+    """Load the content hash -> upload record index from disk."""
+    _ensure_data_dir()
+    if not INDEX_FILE.exists():
+        return {}
+    try:
+        data = json.loads(INDEX_FILE.read_text())
+        return data if isinstance(data, dict) else {}
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+
+def save_index(index: Dict[str, dict]):
+    """Write the full upload index to disk."""
+    _ensure_data_dir()
+    INDEX_FILE.write_text(json.dumps(index, indent=2, sort_keys=True))
+
+
+def content_hash(data: bytes) -> str:
+    """Return the SHA-256 hex digest used as the cache key."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cached_file_id(digest: str, filename: str) -> Optional[str]:
+    cached = load_index().get(digest)
+    if cached:
+        logger.info("Reusing uploaded file %s for %s", cached["file_id"], filename)
+        return cached["file_id"]
+    return None
+
+
+def _forget_upload(digest: str, file_id: str):
+    logger.info("Cached upload %s no longer exists, uploading again", file_id)
+    index = load_index()
+    index.pop(digest, None)
+    save_index(index)
+
+
+def _record_upload(digest: str, file_id: str, filename: str):
+    index = load_index()
+    index[digest] = {
+        "file_id": file_id,
+        "filename": filename,
+        "uploaded_at": time.time(),
+    }
+    save_index(index)
+
+
+def upload_vision_file(client: OpenAI, filename: str, data: bytes, mime_type: str) -> str:
+    """Return a file ID for these bytes, uploading only on a cache miss."""
+    digest = content_hash(data)
+    cached = _cached_file_id(digest, filename)
+    if cached:
+        try:
+            client.files.retrieve(cached)
+            return cached
+        except NotFoundError:
+            _forget_upload(digest, cached)
+
+    result = client.files.create(
+        file=(filename, data, mime_type),
+        purpose="vision",
+    )
+    _record_upload(digest, result.id, filename)
+    return result.id
+
+
+async def upload_vision_file_async(client: AsyncOpenAI, filename: str, data: bytes, mime_type: str) -> str:
+    """Async version of upload_vision_file sharing the same index."""
+    digest = content_hash(data)
+    cached = _cached_file_id(digest, filename)
+    if cached:
+        try:
+            await client.files.retrieve(cached)
+            return cached
+        except NotFoundError:
+            _forget_upload(digest, cached)
+
+    result = await client.files.create(
+        file=(filename, data, mime_type),
+        purpose="vision",
+    )
+    _record_upload(digest, result.id, filename)
+    return result.id
+
+
+def cleanup_stale_uploads(client: OpenAI, max_age_days: float = VISION_FILE_MAX_AGE_DAYS) -> int:
+    """Delete uploads older than max_age_days from OpenAI and the index.
+
+    Returns the number of index entries removed.
+    """
+    index = load_index()
+    cutoff = time.time() - max_age_days * 86400
+
+    stale = [digest for digest, record in index.items() if record.get("uploaded_at", 0) < cutoff]
+    removed = 0
+    for digest in stale:
+        file_id = index[digest]["file_id"]
+        try:
+            client.files.delete(file_id)
+        except NotFoundError:
+            # Already gone on the OpenAI side - just forget it
+            pass
+        except Exception as e:
+            logger.warning("Failed to delete stale upload %s: %s", file_id, e)
+            continue
+        del index[digest]
+        removed += 1
+
+    if removed:
+        save_index(index)
+        logger.info("Removed %d stale vision uploads", removed)
+
+    return removed
@@ -0,0 +1,80 @@
+"""Shared limits for concurrent async LLM calls.
+
+A semaphore caps how many requests are in flight, and a token bucket
+keeps the estimated prompt tokens per minute under the account's rate
+limit, so firing off many classifications and extractions at once does
+not end in a wall of 429s.
+"""
+
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+
+
+class AsyncRateLimiter:
+    """Concurrency cap plus a tokens-per-minute budget."""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep) -> None:
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lock = asyncio.Lock()
+        self._clock = clock
+        self._sleep = sleep
+        self._available = float(tokens_per_minute)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self._available = min(self.tokens_per_minute, self._available + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire_tokens(self, tokens: int):
+        """Wait until the bucket holds enough tokens, then take them.
+
+        Waiters are served in arrival order. A request larger than the
+        whole budget waits for a full bucket rather than forever.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return
+                await self._sleep((tokens - self._available) * 60 / self.tokens_per_minute)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the API answered 429."""
+        self._refill()
+        self._available = 0.0
+
+    @asynccontextmanager
+    async def slot(self, tokens: int) -> AsyncIterator[None]:
+        """Hold a concurrency slot for a request of roughly this many tokens."""
+        await self.acquire_tokens(tokens)
+        async with self._semaphore:
+            yield
+
+
+# asyncio primitives belong to one event loop, so keep one limiter per loop
+_shared: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncRateLimiter]" = weakref.WeakKeyDictionary()
+
+
+def shared_limiter() -> AsyncRateLimiter:
+    """The limiter shared by every async LLM call on the running loop."""
+    loop = asyncio.get_running_loop()
+    limiter = _shared.get(loop)
+    if limiter is None:
+        limiter = AsyncRateLimiter()
+        _shared[loop] = limiter
+    return limiter
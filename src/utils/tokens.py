@@ -0,0 +1,67 @@
+"""Cheap local token estimates for sizing prompts.
+
+tiktoken is not a dependency, so we use the usual ~4 characters per
+token rule of thumb. It errs slightly high for English prose, which is
+the safe direction when staying under a budget.
+"""
+
+import math
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate how many tokens a piece of text will use."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to roughly max_tokens, keeping the start."""
+    if max_tokens <= 0:
+        return ""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + " ..."
+
+
+def truncate_middle(text: str, max_tokens: int, head_share: float = 0.7) -> str:
+    """Cut text down to max_tokens, keeping the start and the end.
+
+    The cut is marked in the text. The result never estimates above
+    max_tokens.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    marker = f"\n[... {estimate_tokens(text) - max_tokens} tokens omitted ...]\n"
+    room = max_chars - len(marker)
+    if room <= 0:
+        return text[:max_chars]
+    head = int(room * head_share)
+    tail = room - head
+    return text[:head] + marker + (text[-tail:] if tail else "")
+
+
+# Rough cost of one input image after preprocessing (a few 512px tiles)
+IMAGE_TOKENS = 765
+
+
+def estimate_input_tokens(input: list) -> int:
+    """Estimate the prompt tokens of a Responses API input list."""
+    total = 0
+    for message in input:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content:
+            if part.get("type") == "input_image":
+                total += IMAGE_TOKENS
+            else:
+                total += estimate_tokens(part.get("text", ""))
+    return total
@@ -0,0 +1,182 @@
+"""Test suite for the async parser functions and the shared rate limiter"""
+import sys
+import asyncio
+import threading
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import httpx
+import pytest
+from openai import RateLimitError
+from PIL import Image
+from parsers.async_ai_parser import (
+    ai_invoice_async,
+    invoice_label_async,
+    parse_client_communication_async,
+    parse_shipping_async,
+    pdf_invoice_async,
+)
+from models.invoice import ClientData, InvoiceData, InvoiceLine, LabelSort, ShippingData
+from services.llm_cache import LLMCache
+from utils.rate_limit import AsyncRateLimiter
+
+
+def _client(parsed, delay=0.0):
+    client = MagicMock()
+
+    async def parse(**kwargs):
+        await asyncio.sleep(delay)
+        return MagicMock(output_parsed=parsed)
+
+    client.responses.parse = AsyncMock(side_effect=parse)
+    return client
+
+
+INVOICE = InvoiceData(
+    vendor_display_name="Lumber Yard",
+    line_items=[InvoiceLine(item="2x4", rate=5.0, quantity=4)],
+    total_amount=20.0,
+)
+
+
+class TestAsyncParsers:
+
+    def test_invoice_label_async(self):
+        client = _client(LabelSort(label="shipping"))
+        label = asyncio.run(invoice_label_async("Your package shipped", [("label.png", b"\x89PNG")], client=client))
+
+        assert label == "shipping"
+        kwargs = client.responses.parse.call_args.kwargs
+        assert kwargs["text_format"] is LabelSort
+        assert "label.png" in kwargs["input"][1]["content"]
+        print("Async classification matches the sync prompt")
+
+    def test_pdf_invoice_async(self):
+        client = _client(INVOICE)
+        draft = asyncio.run(pdf_invoice_async("invoice", text="2x4 x4 $20", client=client))
+        assert draft.vendor_display_name == "Lumber Yard"
+        print("Async PDF extraction returns a draft")
+
+    def test_ai_invoice_async(self, tmp_path):
+        path = tmp_path / "receipt.png"
+        Image.new("RGB", (400, 600), "white").save(path)
+        client = _client(INVOICE)
+
+        draft = asyncio.run(ai_invoice_async("receipt", file_path=str(path), client=client))
+
+        assert draft.total_amount == 20.0
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        assert content[1]["image_url"].startswith("data:image/jpeg;base64,")
+        print("Async image extraction sends the image inline")
+
+    def test_shipping_and_client_async(self):
+        shipping = asyncio.run(parse_shipping_async("UPS 1Z999AA10123456784", [], client=_client(ShippingData(carrier="UPS"))))
+        client_data = asyncio.run(parse_client_communication_async("Call me", [], client=_client(ClientData(summary="Wants a call"))))
+        assert shipping.carrier == "UPS"
+        assert client_data.summary == "Wants a call"
+
+    def test_cache_io_off_the_event_loop(self, tmp_path):
+        cache = LLMCache(tmp_path / "cache.sqlite3")
+        threads = []
+        get, put = cache.get, cache.put
+        cache.get = lambda *args: threads.append(threading.get_ident()) or get(*args)
+        cache.put = lambda *args: threads.append(threading.get_ident()) or put(*args)
+        client = _client(LabelSort(label="invoice"))
+
+        async def label_twice():
+            loop_thread = threading.get_ident()
+            labels = [await invoice_label_async("Invoice attached", [], client=client, cache=cache) for _ in range(2)]
+            return loop_thread, labels
+
+        loop_thread, labels = asyncio.run(label_twice())
+
+        assert labels == ["invoice", "invoice"]
+        assert client.responses.parse.await_count == 1
+        assert len(threads) == 3 and loop_thread not in threads
+        print("Cache reads and writes ran in worker threads")
+
+
+class TestConcurrency:
+
+    def test_semaphore_caps_in_flight_calls(self):
+        in_flight = 0
+        peak = 0
+        client = MagicMock()
+
+        async def parse(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return MagicMock(output_parsed=LabelSort(label="none"))
+
+        client.responses.parse = AsyncMock(side_effect=parse)
+
+        async def run():
+            limiter = AsyncRateLimiter(max_concurrency=3, tokens_per_minute=10_000_000)
+            return await asyncio.gather(*(
+                invoice_label_async(f"email {i}", [], client=client, limiter=limiter) for i in range(12)
+            ))
+
+        labels = asyncio.run(run())
+        assert labels == ["none"] * 12
+        assert peak == 3
+        print(f"12 calls ran with at most {peak} in flight")
+
+    def test_rate_limit_error_drains_bucket(self):
+        client = MagicMock()
+        request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+        client.responses.parse = AsyncMock(side_effect=RateLimitError(
+            "slow down", response=httpx.Response(429, request=request), body=None
+        ))
+
+        async def run():
+            limiter = AsyncRateLimiter(tokens_per_minute=60_000)
+            with pytest.raises(RateLimitError):
+                await parse_shipping_async("x", [], client=client, limiter=limiter)
+            return limiter._available
+
+        assert asyncio.run(run()) < 1
+        print("429 empties the shared token bucket")
+
+
+class TestTokenBucket:
+
+    def test_waits_when_budget_spent(self):
+        now = [0.0]
+        sleeps = []
+
+        async def fake_sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        async def run():
+            limiter = AsyncRateLimiter(tokens_per_minute=600, clock=lambda: now[0], sleep=fake_sleep)
+            await limiter.acquire_tokens(600)
+            await limiter.acquire_tokens(300)
+
+        asyncio.run(run())
+        # 300 tokens at 10 tokens/second
+        assert sleeps == [pytest.approx(30.0)]
+        print("Second request waited for the bucket to refill")
+
+    def test_oversized_request_waits_for_full_bucket(self):
+        now = [0.0]
+
+        async def fake_sleep(seconds):
+            now[0] += seconds
+
+        async def run():
+            limiter = AsyncRateLimiter(tokens_per_minute=100, clock=lambda: now[0], sleep=fake_sleep)
+            await limiter.acquire_tokens(100)
+            await limiter.acquire_tokens(5000)
+
+        asyncio.run(run())
+        assert now[0] == pytest.approx(60.0)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,198 @@
+"""Test suite for the content-addressed attachment store."""
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from services.attachment_store import (
+    attachments_for_message,
+    clear_registry,
+    content_hash,
+    find_by_filename,
+    get_cached_text,
+    is_attachment_processed,
+    mark_attachment_processed,
+    persist_async,
+    register_attachment,
+    remember_text,
+    set_cached_text,
+    store_attachment,
+    wait_for_writes,
+)
+
+
+@pytest.fixture(autouse=True)
+def temp_store(tmp_path):
+    """Redirect the store to a temporary directory for every test."""
+    attachments_dir = tmp_path / "attachments"
+    with patch("services.attachment_store.ATTACHMENTS_DIR", attachments_dir), \
+         patch("services.attachment_store.OBJECTS_DIR", attachments_dir / "objects"), \
+         patch("services.attachment_store.DATA_DIR", tmp_path / "data"), \
+         patch("services.attachment_store.INDEX_FILE", tmp_path / "data" / "attachment_index.json"):
+        clear_registry()
+        yield attachments_dir
+        wait_for_writes()
+        clear_registry()
+
+
+class TestStoreAttachment:
+
+    def test_blob_is_sharded_by_hash(self, temp_store):
+        stored = store_attachment("invoice.pdf", b"pdf-one")
+        digest = content_hash(b"pdf-one")
+
+        assert stored.digest == digest
+        assert stored.path == temp_store / "objects" / digest[:2] / digest[2:4] / f"{digest}.pdf"
+        assert stored.path.read_bytes() == b"pdf-one"
+        assert stored.is_new
+        print("Blob written to sharded content-addressed path")
+
+    def test_same_name_different_content_kept_apart(self, temp_store):
+        first = store_attachment("invoice.pdf", b"vendor-a")
+        second = store_attachment("invoice.pdf", b"vendor-b")
+
+        assert first.path != second.path
+        assert first.path.read_bytes() == b"vendor-a"
+        assert second.path.read_bytes() == b"vendor-b"
+        assert [s.digest for s in find_by_filename("invoice.pdf")] == [first.digest, second.digest]
+        print("Name collision no longer overwrites")
+
+    def test_identical_content_stored_once(self, temp_store):
+        first = store_attachment("invoice.pdf", b"same", message_id="m1")
+        second = store_attachment("Fwd invoice.pdf", b"same", message_id="m2")
+
+        assert first.path == second.path
+        assert first.is_new and not second.is_new
+        assert len(list((temp_store / "objects").rglob("*.pdf"))) == 1
+        print("Duplicate content stored once")
+
+    def test_missing_blob_is_rewritten(self, temp_store):
+        stored = store_attachment("invoice.pdf", b"data")
+        stored.path.unlink()
+
+        again = store_attachment("invoice.pdf", b"data")
+        assert again.is_new
+        assert again.path.read_bytes() == b"data"
+        print("Blob restored when index outlives the file")
+
+
+class TestReferences:
+
+    def test_attachments_for_message_in_order(self, temp_store):
+        store_attachment("a.pdf", b"aaa", message_id="m1")
+        store_attachment("b.png", b"bbb", message_id="m1")
+
+        refs = attachments_for_message("m1")
+        assert [r.filename for r in refs] == ["a.pdf", "b.png"]
+        assert refs[1].relative_path.endswith(".png")
+        print("Message references returned in arrival order")
+
+    def test_duplicate_content_keeps_each_messages_name(self, temp_store):
+        store_attachment("invoice.pdf", b"same", message_id="m1")
+        store_attachment("INV-2041.pdf", b"same", message_id="m2")
+
+        assert attachments_for_message("m1")[0].filename == "invoice.pdf"
+        assert attachments_for_message("m2")[0].filename == "INV-2041.pdf"
+        print("Each message sees the name its copy arrived under")
+
+    def test_unknown_message_has_no_attachments(self, temp_store):
+        assert attachments_for_message("nope") == []
+        print("Unknown message returns empty list")
+
+    def test_corrupt_index_treated_as_empty(self, temp_store, tmp_path):
+        (tmp_path / "data").mkdir()
+        (tmp_path / "data" / "attachment_index.json").write_text("{bad json")
+        assert attachments_for_message("m1") == []
+        print("Corrupt index handled")
+
+
+class TestTextCacheAndProcessing:
+
+    def test_text_cache_round_trip(self, temp_store):
+        stored = store_attachment("invoice.pdf", b"pdf")
+        assert get_cached_text(stored.digest) is None
+
+        set_cached_text(stored.digest, "Invoice #1")
+        assert get_cached_text(stored.digest) == "Invoice #1"
+        print("Extracted text cached next to the blob")
+
+    def test_processed_flag(self, temp_store):
+        stored = store_attachment("invoice.pdf", b"pdf")
+        assert not is_attachment_processed(stored.digest)
+
+        mark_attachment_processed(stored.digest).result()
+        clear_registry()
+        assert is_attachment_processed(stored.digest)
+
+        again = store_attachment("copy.pdf", b"pdf")
+        assert is_attachment_processed(again.digest)
+        print("Processed flag persisted and shared by duplicate attachments")
+
+
+class TestInMemoryAttachments:
+
+    def test_register_does_not_touch_disk(self, temp_store):
+        attachment = register_attachment("invoice.pdf", b"pdf-bytes", message_id="m1")
+
+        assert not temp_store.exists()
+        assert attachment.read_bytes() == b"pdf-bytes"
+        with attachment.open() as stream:
+            assert stream.read() == b"pdf-bytes"
+        assert attachments_for_message("m1")[0].digest == attachment.digest
+        print("Registered attachment lives only in memory")
+
+    def test_duplicates_share_extracted_text(self, temp_store):
+        first = register_attachment("invoice.pdf", b"same", message_id="m1")
+        remember_text(first, "Invoice text")
+
+        second = register_attachment("fwd.pdf", b"same", message_id="m2")
+        assert second.text == "Invoice text"
+        print("Duplicate in the same run reuses extracted text")
+
+    def test_persist_async_writes_blob_and_text(self, temp_store):
+        attachment = register_attachment("invoice.pdf", b"pdf-bytes", message_id="m1")
+        remember_text(attachment, "Invoice #9")
+
+        stored = persist_async(attachment, "m1").result()
+
+        assert stored.path.read_bytes() == b"pdf-bytes"
+        assert get_cached_text(stored.digest) == "Invoice #9"
+        clear_registry()
+        assert attachments_for_message("m1")[0].path == stored.path
+        print("Background persist writes blob, text and index")
+
+    def test_persist_same_content_once(self, temp_store):
+        first = register_attachment("a.pdf", b"same", message_id="m1")
+        second = register_attachment("b.pdf", b"same", message_id="m2")
+
+        written = persist_async(first, "m1")
+        assert persist_async(first, "m1") is written
+        referenced = persist_async(second, "m2")
+
+        assert written.result().is_new and not referenced.result().is_new
+        assert written.result().path == referenced.result().path
+        clear_registry()
+        assert attachments_for_message("m2")[0].filename == "b.pdf"
+        print("Blob written once, both messages referenced under their own names")
+
+    def test_processed_flag_visible_before_write(self, temp_store):
+        attachment = register_attachment("a.pdf", b"pdf", message_id="m1")
+        mark_attachment_processed(attachment.digest)
+        assert is_attachment_processed(attachment.digest)
+        print("Processed flag visible within the run immediately")
+
+    def test_large_blob_is_memory_mapped(self, temp_store):
+        stored = store_attachment("big.pdf", b"x" * 64)
+        reference = attachments_for_message("nope") or find_by_filename("big.pdf")
+
+        with patch("parsers.pdf_parser.MMAP_THRESHOLD_BYTES", 16), reference[0].open() as stream:
+            assert type(stream).__name__ == "mmap"
+            assert stream.read(4) == b"xxxx"
+        assert stream.closed
+        print("Large on-disk blob opened with mmap")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,158 @@
+"""Test suite for the Batch API backlog flow against the local stand-in"""
+import sys
+import json
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from openai import OpenAI
+from services import batch_backlog
+from services.batch_backlog import (
+    download_results,
+    iter_results,
+    load_state,
+    pdf_invoice_request,
+    queue_requests,
+    submit_pending,
+    text_format_param,
+    wait_for_batches,
+)
+from services.openai_standin import StandInOpenAI
+from models.invoice import InvoiceData, InvoiceLine
+
+
+@pytest.fixture(autouse=True)
+def temp_batch_dir(tmp_path):
+    """Keep batch files and state out of the repo's data directory."""
+    with patch.object(batch_backlog, "BATCH_DIR", tmp_path), \
+         patch.object(batch_backlog, "STATE_FILE", tmp_path / "state.json"):
+        yield tmp_path
+
+
+@pytest.fixture
+def standin():
+    with StandInOpenAI() as server:
+        yield server
+
+
+def _client(server):
+    return OpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+
+
+def _queue(count, **kwargs):
+    requests = [
+        (pdf_invoice_request(f"msg-{i}", f"Invoice {i}\nLumber 2x4 10 @ $5.00\nTotal $50.00"), {"message_id": f"msg-{i}", "subject": f"Invoice {i}"})
+        for i in range(count)
+    ]
+    return queue_requests(requests, **kwargs)
+
+
+class TestQueueRequests:
+
+    def test_request_lines_are_structured_output_calls(self, temp_batch_dir):
+        paths = _queue(2)
+
+        lines = [json.loads(line) for line in paths[0].read_text().splitlines()]
+        assert len(lines) == 2
+        body = lines[0]["body"]
+        assert lines[0]["url"] == "/v1/responses"
+        assert body["model"] == "gpt-5"
+        assert body["text"]["format"]["type"] == "json_schema"
+        assert body["text"]["format"]["name"] == "InvoiceData"
+        assert "Total $50.00" in body["input"][1]["content"]
+        print("Queued requests match the pdf_invoice call")
+
+    def test_format_schema_is_strict(self):
+        schema = text_format_param(InvoiceData)["schema"]
+        objects = [schema, *schema.get("$defs", {}).values()]
+        for node in objects:
+            assert node["additionalProperties"] is False
+            assert node["required"] == list(node["properties"])
+        line_items = schema["properties"]["line_items"]
+        assert "default" not in line_items and line_items["items"]["$ref"].startswith("#/$defs/")
+        print("Every object closed, every property required")
+
+    def test_split_into_files(self, temp_batch_dir):
+        assert len(_queue(5, max_requests=2)) == 3
+        print("Requests split across batch files")
+
+    def test_requeue_skips_known_requests(self, temp_batch_dir):
+        _queue(2)
+        assert _queue(2) == []
+        print("Re-running prepare does not queue duplicates")
+
+
+class TestStandInFlow:
+
+    def test_end_to_end(self, standin):
+        client = _client(standin)
+        _queue(3, max_requests=2)
+
+        batch_ids = submit_pending(client)
+        assert len(batch_ids) == 2
+        assert submit_pending(client) == []
+
+        counts = wait_for_batches(client, poll_seconds=0)
+        assert counts == {"completed": 2}
+
+        assert len(download_results(client)) == 2
+        results = list(iter_results())
+        assert sorted(meta["message_id"] for meta, _, _ in results) == ["msg-0", "msg-1", "msg-2"]
+        for meta, payload, error in results:
+            assert error is None
+            assert payload.vendor_display_name == "Stand-in Supply Co"
+        print("Queue, submit, poll and collect all ran offline")
+
+    def test_polls_until_complete(self, standin):
+        standin.completion_delay = 1.0
+        client = _client(standin)
+        _queue(1)
+        submit_pending(client)
+
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            time.sleep(seconds)
+
+        counts = wait_for_batches(client, poll_seconds=0.6, sleep=sleep)
+
+        assert counts == {"completed": 1}
+        assert sleeps
+        print(f"Polled {len(sleeps)} times before completion")
+
+    def test_timeout_leaves_batches_resumable(self, standin):
+        standin.completion_delay = 60
+        client = _client(standin)
+        _queue(1)
+        submit_pending(client)
+
+        with pytest.raises(TimeoutError):
+            wait_for_batches(client, poll_seconds=0, timeout=0)
+        assert list(load_state()["files"].values())[0]["status"] == "in_progress"
+        print("Timed-out wait can be resumed later")
+
+    def test_failed_requests_reported(self, standin):
+        def responder(body):
+            if "Invoice 1" in body["input"][1]["content"]:
+                raise ValueError("model refused")
+            return InvoiceData(vendor_display_name="Acme", line_items=[InvoiceLine(item="x", rate=1.0)], total_amount=1.0)
+
+        standin.responder = responder
+        client = _client(standin)
+        _queue(2)
+        submit_pending(client)
+        wait_for_batches(client, poll_seconds=0)
+        download_results(client)
+
+        results = {meta["message_id"]: (payload, error) for meta, payload, error in iter_results()}
+        assert results["msg-0"][0].vendor_display_name == "Acme"
+        assert results["msg-1"] == (None, "model refused")
+        print("Per-request failures surfaced with their error")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,136 @@
+"""Test suite for classifying many emails per request"""
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from openai import APIConnectionError
+from parsers.ai_parser import invoice_label_batch, plan_label_batches
+from models.invoice import EmailLabel, LabelBatch, LabelSort
+
+
+def _response(parsed):
+    response = MagicMock()
+    response.output_parsed = parsed
+    return response
+
+
+def _batch(*labels, numbers=None):
+    numbers = numbers or range(1, len(labels) + 1)
+    return _response(LabelBatch(labels=[EmailLabel(email=number, label=label) for number, label in zip(numbers, labels)]))
+
+
+EMAILS = [
+    ("Invoice #12 attached, total $400", [("inv12.pdf", "text")]),
+    ("Your order shipped, tracking 1Z999AA10123456784", []),
+    ("Can we meet Tuesday about the kitchen?", []),
+]
+
+
+class TestPlanBatches:
+
+    def test_small_emails_share_one_batch(self):
+        assert plan_label_batches(["short"] * 5, token_budget=6000) == [[0, 1, 2, 3, 4]]
+        print("Short emails packed together")
+
+    def test_budget_splits_batches(self):
+        summaries = ["x" * 400] * 6  # ~100 tokens each
+        batches = plan_label_batches(summaries, token_budget=600)
+        assert [position for batch in batches for position in batch] == list(range(6))
+        assert len(batches) > 1
+        print(f"Budget split 6 emails into {len(batches)} batches")
+
+    def test_max_size_caps_batches(self):
+        batches = plan_label_batches(["a"] * 7, max_size=3)
+        assert [len(batch) for batch in batches] == [3, 3, 1]
+        print("Batch size capped")
+
+    def test_oversized_email_gets_own_batch(self):
+        batches = plan_label_batches(["x" * 100000, "short"], token_budget=1000)
+        assert batches == [[0], [1]]
+        print("Oversized email isolated")
+
+
+class TestInvoiceLabelBatch:
+
+    def test_one_call_for_many_emails(self):
+        client = MagicMock()
+        client.responses.parse.return_value = _batch("invoice", "shipping", "client_communications")
+
+        labels = invoice_label_batch(EMAILS, client=client)
+
+        assert labels == ["invoice", "shipping", "client_communications"]
+        assert client.responses.parse.call_count == 1
+        call = client.responses.parse.call_args
+        assert call.kwargs["text_format"] is LabelBatch
+        context = call.kwargs["input"][1]["content"]
+        assert "=== Email 3 ===" in context
+        assert "inv12.pdf" in context
+        print("Three emails classified in one request")
+
+    def test_wrong_label_count_falls_back(self):
+        client = MagicMock()
+        client.responses.parse.side_effect = [
+            _batch("invoice"),
+            _response(LabelSort(label="invoice")),
+            _response(LabelSort(label="shipping")),
+            _response(LabelSort(label="none")),
+        ]
+
+        labels = invoice_label_batch(EMAILS, client=client)
+
+        assert labels == ["invoice", "shipping", "none"]
+        assert client.responses.parse.call_count == 4
+        print("Short batch answer retried per email")
+
+    def test_labels_placed_by_email_number(self):
+        client = MagicMock()
+        client.responses.parse.return_value = _batch("client_communications", "invoice", "shipping", numbers=[3, 1, 2])
+
+        assert invoice_label_batch(EMAILS, client=client) == ["invoice", "shipping", "client_communications"]
+        print("Out-of-order answer mapped by email number")
+
+    def test_duplicated_email_falls_back(self):
+        client = MagicMock()
+        client.responses.parse.side_effect = [
+            _batch("invoice", "invoice", "none", numbers=[1, 1, 3]),
+            _response(LabelSort(label="invoice")),
+            _response(LabelSort(label="shipping")),
+            _response(LabelSort(label="none")),
+        ]
+
+        labels = invoice_label_batch(EMAILS, client=client)
+
+        assert labels == ["invoice", "shipping", "none"]
+        assert client.responses.parse.call_count == 4
+        print("Dropped and duplicated label detected, retried per email")
+
+    def test_failed_batch_falls_back(self):
+        client = MagicMock()
+        client.responses.parse.side_effect = [
+            APIConnectionError(request=MagicMock()),
+            _response(LabelSort(label="invoice")),
+            _response(LabelSort(label="shipping")),
+            _response(LabelSort(label="client_communications")),
+        ]
+
+        labels = invoice_label_batch(EMAILS, client=client)
+
+        assert labels == ["invoice", "shipping", "client_communications"]
+        print("Failed batch retried per email")
+
+    def test_long_body_truncated_in_summary(self):
+        client = MagicMock()
+        client.responses.parse.return_value = _batch("none", "none")
+
+        invoice_label_batch([("word " * 5000, []), ("hi", [])], client=client)
+
+        context = client.responses.parse.call_args.kwargs["input"][1]["content"]
+        assert len(context) < 5000
+        print("Email bodies truncated for batching")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
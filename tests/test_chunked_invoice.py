@@ -0,0 +1,129 @@
+"""Test suite for map-reduce extraction of long invoices"""
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from openai import APIConnectionError
+from models.invoice import InvoiceHeader, InvoiceLine, LineItemChunk
+from parsers.ai_parser import FAST_INVOICE_MODEL, PDF_INVOICE_MODEL
+from parsers.chunked_invoice import chunked_pdf_invoice, merge_line_items, plan_chunks
+
+COVER = "ABC Supply Co. INVOICE\nInvoice #: INV-2001 Date: 03/14/2026\nJob Site: 114 Maple Ave\n"
+TERMS = "Terms and Conditions\n" + "Claims must be made within ten days of receipt of goods.\n" * 20
+
+
+def _item_page(start, count=30):
+    return "\n".join(f"Shingles bundle {n} 10 45.00 450.00" for n in range(start, start + count))
+
+
+def _line(item, quantity=1, rate=10.0):
+    return InvoiceLine(item=item, quantity=quantity, rate=rate, category="Materials")
+
+
+def _header(total):
+    return InvoiceHeader(vendor_display_name="ABC Supply", total_amount=total, invoice_number="INV-2001", invoice_date="03/14/2026")
+
+
+def _client(header, chunk_items):
+    """A client answering header requests with header and chunk requests in order"""
+    client = MagicMock()
+    chunks = iter(chunk_items)
+
+    def parse(model, input, text_format, prompt_cache_key):
+        if text_format is InvoiceHeader:
+            return MagicMock(output_parsed=header(model) if callable(header) else header)
+        return MagicMock(output_parsed=LineItemChunk(line_items=next(chunks)))
+
+    client.responses.parse.side_effect = parse
+    return client
+
+
+class TestPlanChunks:
+
+    def test_chunks_within_budget_with_overlap(self):
+        pages = [COVER, _item_page(0), _item_page(30)]
+        chunks = plan_chunks(pages, chunk_tokens=200, overlap_lines=2)
+
+        assert len(chunks) > 2
+        for previous, current in zip(chunks, chunks[1:]):
+            assert current.splitlines()[:2] == previous.splitlines()[-2:]
+        print(f"{len(chunks)} chunks with 2 lines of overlap")
+
+    def test_every_line_kept_once_without_overlap(self):
+        pages = [_item_page(0), _item_page(30)]
+        chunks = plan_chunks(pages, chunk_tokens=150, overlap_lines=0)
+        lines = [line for chunk in chunks for line in chunk.splitlines()]
+        assert lines == "\n".join(pages).splitlines()
+
+    def test_terms_pages_left_out(self):
+        chunks = plan_chunks([_item_page(0), TERMS], chunk_tokens=100000)
+        assert len(chunks) == 1
+        assert "Terms and Conditions" not in chunks[0]
+        print("Zero-score pages not sent for line items")
+
+
+class TestMergeLineItems:
+
+    def test_boundary_repeats_dropped(self):
+        first = [_line("a"), _line("b"), _line("c")]
+        second = [_line("b"), _line("C "), _line("d")]
+        merged = merge_line_items([first, second], max_overlap=3)
+        assert [line.item for line in merged] == ["a", "b", "c", "d"]
+        print("Rows read twice at the boundary dropped")
+
+    def test_repeated_items_away_from_boundary_kept(self):
+        first = [_line("a"), _line("b")]
+        second = [_line("c"), _line("a")]
+        merged = merge_line_items([first, second], max_overlap=3)
+        assert [line.item for line in merged] == ["a", "b", "c", "a"]
+
+    def test_same_item_different_quantity_kept(self):
+        merged = merge_line_items([[_line("a", quantity=1)], [_line("a", quantity=2)]], max_overlap=3)
+        assert len(merged) == 2
+
+
+class TestChunkedPdfInvoice:
+
+    PAGES = [COVER, _item_page(0), _item_page(30)]
+
+    def test_header_once_and_items_merged(self):
+        chunks = plan_chunks(self.PAGES, chunk_tokens=400, overlap_lines=1)
+        assert len(chunks) == 2
+        client = _client(_header(30.0), [[_line("a"), _line("b")], [_line("b"), _line("c")]])
+
+        draft = chunked_pdf_invoice(self.PAGES, client=client, chunk_tokens=400, overlap_lines=1, workers=1)
+
+        assert draft.invoice_number == "INV-2001"
+        assert [line.item for line in draft.line_items] == ["a", "b", "c"]
+        assert draft.total_amount == 30.0
+        assert client.responses.parse.call_count == 3
+        assert all(call.kwargs["model"] == FAST_INVOICE_MODEL for call in client.responses.parse.call_args_list)
+        print(f"Merged draft: {draft}")
+
+    def test_sum_mismatch_escalates(self):
+        client = _client(_header(99.0), [[_line("a")], [_line("b")], [_line("a")], [_line("b")]])
+
+        draft = chunked_pdf_invoice(self.PAGES, client=client, chunk_tokens=400, overlap_lines=0, workers=1)
+
+        models = [call.kwargs["model"] for call in client.responses.parse.call_args_list]
+        assert models.count(PDF_INVOICE_MODEL) == 3
+        assert draft.total_amount == 99.0
+        print("Items not adding up to the total redone by the strong model")
+
+    def test_fast_model_error_escalates(self):
+        def header(model):
+            if model == FAST_INVOICE_MODEL:
+                raise APIConnectionError(request=MagicMock())
+            return _header(20.0)
+
+        client = _client(header, [[_line("a")], [_line("b")], [_line("a")], [_line("b")]])
+        draft = chunked_pdf_invoice(self.PAGES, client=client, chunk_tokens=400, overlap_lines=0, workers=1)
+        assert draft.total_amount == 20.0
+        assert [line.item for line in draft.line_items] == ["a", "b"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,90 @@
+"""Test suite for retrieval of candidate customers per document"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from services.customer_index import CustomerIndex, tokenize
+
+
+CUSTOMERS = [
+    ("Smith Residence", ["1423 Maple Street, Portland"]),
+    ("Johnson Remodel", ["88 Oak Avenue, Portland"]),
+    ("Garcia Kitchen", ["5012 Birch Rd, Beaverton", "PO Box 12, Beaverton"]),
+    ("Lee Deck", ["77 Cedar Lane, Portland"]),
+] + [(f"Customer {i}", [f"{100 + i} Elm Street, Portland"]) for i in range(50)]
+
+
+@pytest.fixture
+def index():
+    return CustomerIndex(CUSTOMERS)
+
+
+class TestTopK:
+
+    def test_address_on_invoice_finds_customer(self, index):
+        text = "INVOICE #991\nShip to: 1423 Maple St, Portland OR\n2x4 Lumber x10 $50.00"
+        top = index.top_k(text, k=3)
+        assert top[0].name == "Smith Residence"
+        print("Job site address matched to its customer")
+
+    def test_suffix_normalisation(self, index):
+        assert tokenize("88 Oak Avenue") == tokenize("88 oak ave")
+        top = index.top_k("Delivered to 88 Oak Ave", k=1)
+        assert top[0].name == "Johnson Remodel"
+        print("Street suffix variants match")
+
+    def test_customer_name_matches(self, index):
+        top = index.top_k("Materials for the Garcia kitchen job", k=1)
+        assert top[0].name == "Garcia Kitchen"
+        print("Customer name in the text matches")
+
+    def test_shared_city_alone_is_not_a_match(self, index):
+        assert index.top_k("Portland", k=5) == []
+        print("Common city name ignored")
+
+
+class TestBestMatch:
+
+    def test_job_site_address_picks_customer(self, index):
+        text = "INVOICE #991\nShip to: 1423 Maple St, Portland OR\n2x4 Lumber x10 $50.00"
+        assert index.best_match(text) == "Smith Residence"
+        print("Template draft matched to its customer")
+
+    def test_no_match_without_evidence(self, index):
+        assert index.best_match("Thanks for your business! Portland") is None
+        print("No customer guessed from a shared city")
+
+    def test_tie_is_not_a_match(self):
+        index = CustomerIndex([("Elm A", ["12 Elm Street"]), ("Elm B", ["12 Elm Street"])])
+        assert index.best_match("Deliver to 12 Elm St") is None
+        print("Ambiguous address left to address matching")
+
+
+class TestContext:
+
+    def test_only_candidates_sent(self, index):
+        context = index.context_for("Job site: 5012 Birch Road, Beaverton", k=3)
+        assert "Garcia Kitchen" in context
+        assert len(context.splitlines()) <= 3
+        assert len(context) < len(index.full_context()) / 5
+        print(f"Context shrank to {len(context)} chars from {len(index.full_context())}")
+
+    def test_fallback_to_full_list(self, index):
+        context = index.context_for("Thanks for your business!")
+        assert context == index.full_context()
+        assert len(context.splitlines()) == len(CUSTOMERS)
+        print("Full list sent when nothing matches")
+
+    def test_full_list_format_and_order(self):
+        index = CustomerIndex([("b corp", ["2 Main St"]), ("A Corp", ["1 Main St", "PO Box 9"])])
+        assert index.full_context() == "- A Corp: 1 Main St | PO Box 9\n- b corp: 2 Main St"
+        print("Full list sorted and formatted like get_customers_context")
+
+    def test_empty_index(self):
+        assert CustomerIndex([]).context_for("anything") == "No customers with addresses found."
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,92 @@
+"""Test suite for the token-budgeted shipping/client email context"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.ai_parser import CLIENT_PROMPT, client_communication_input, shipping_input
+from parsers.email_context import build_email_context, email_input, share_budget
+from utils.tokens import estimate_input_tokens, estimate_tokens, truncate_middle
+
+BODY = "Hi team, the updated floor plans are attached. Can we meet Thursday to review?"
+LONG_PDF = "PAGE ONE: Project Maple Ave revised plans.\n" + "Section detail. " * 20000 + "\nSigned: J. Architect"
+
+
+class TestTruncateMiddle:
+
+    def test_keeps_start_and_end(self):
+        cut = truncate_middle(LONG_PDF, 200)
+        assert cut.startswith("PAGE ONE")
+        assert cut.endswith("Signed: J. Architect")
+        assert "tokens omitted" in cut
+        assert estimate_tokens(cut) <= 200
+        print(f"Cut to {estimate_tokens(cut)} tokens")
+
+    def test_short_text_unchanged(self):
+        assert truncate_middle(BODY, 1000) == BODY
+
+
+class TestShareBudget:
+
+    def test_short_items_keep_everything(self):
+        assert share_budget([10, 5000, 5000], budget=1010, cap=3000) == [10, 500, 500]
+
+    def test_cap_per_item(self):
+        assert share_budget([10000], budget=100000, cap=3000) == [3000]
+
+
+class TestBuildEmailContext:
+
+    def test_small_email_unchanged(self):
+        attachments = [("notes.txt", "Bring the revised plans."), ("photo.jpg", b"\xff\xd8")]
+        context = build_email_context(BODY, attachments)
+        assert context == (
+            f"{BODY}\n\nAttachment contents:\n"
+            "\n--- notes.txt ---\nBring the revised plans.\n"
+            "\n--- photo.jpg (binary file) ---\n"
+        )
+        print("Layout unchanged when everything fits")
+
+    def test_large_attachment_bounded(self):
+        context = build_email_context(BODY, [("plans.pdf", LONG_PDF)], max_tokens=2000, attachment_tokens=1500)
+        assert estimate_tokens(context) <= 2000
+        assert context.startswith(BODY)
+        assert "Signed: J. Architect" in context
+        print(f"40-page attachment cut to a {estimate_tokens(context)}-token context")
+
+    def test_body_prioritised_over_attachments(self):
+        body = "Please confirm delivery. " * 600  # ~3,750 tokens
+        context = build_email_context(body, [("plans.pdf", LONG_PDF)], max_tokens=4000, body_tokens=4000)
+        assert context.startswith(body)
+        assert estimate_tokens(context) <= 4000
+
+    def test_long_body_cut_to_its_reserve(self):
+        body = "Thread history. " * 10000
+        context = build_email_context(body, [("label.txt", "Tracking 1Z999AA10123456784")], max_tokens=3000, body_tokens=2000)
+        assert "Tracking 1Z999AA10123456784" in context
+        assert estimate_tokens(context) <= 3000
+
+    @pytest.mark.parametrize("max_tokens", [50, 500, 5000])
+    def test_never_over_budget(self, max_tokens):
+        attachments = [(f"doc{n}.pdf", LONG_PDF) for n in range(30)] + [("scan.png", b"...")]
+        context = build_email_context("Body. " * 5000, attachments, max_tokens=max_tokens)
+        assert estimate_tokens(context) <= max_tokens
+
+
+class TestEmailInput:
+
+    def test_whole_prompt_under_limit(self):
+        input = email_input(CLIENT_PROMPT, BODY, [("plans.pdf", LONG_PDF)], max_prompt_tokens=3000)
+        assert input[0]["content"] == CLIENT_PROMPT
+        assert estimate_input_tokens(input) <= 3000
+        print(f"Prompt is {estimate_input_tokens(input)} tokens")
+
+    def test_shipping_and_client_inputs_bounded(self):
+        for build in (shipping_input, client_communication_input):
+            input = build(BODY, [("plans.pdf", LONG_PDF)])
+            assert estimate_input_tokens(input) < estimate_tokens(LONG_PDF)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,137 @@
+"""Test suite for fused classify-and-extract calls"""
+import io
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import httpx
+import pytest
+from PIL import Image
+from openai import APITimeoutError
+from services.batch_backlog import text_format_param
+from parsers.ai_parser import FUSED_MODEL, FUSED_PROMPT, LABEL_PROMPT, PDF_INVOICE_MODEL, classify_and_extract
+from models.invoice import (
+    ClassifiedEmail,
+    ClientData,
+    ClientResult,
+    InvoiceData,
+    InvoiceLine,
+    InvoiceResult,
+    OtherResult,
+    ShippingData,
+    ShippingResult,
+)
+
+
+def _invoice(**overrides):
+    fields = dict(
+        vendor_display_name="ABC Supply",
+        line_items=[InvoiceLine(item="Shingles", rate=45.0, quantity=10)],
+        total_amount=450.0,
+        invoice_date="03/14/2026",
+    )
+    fields.update(overrides)
+    return InvoiceData(**fields)
+
+
+def _client(*results):
+    client = MagicMock()
+    client.responses.parse.side_effect = [MagicMock(output_parsed=ClassifiedEmail(result=result)) for result in results]
+    return client
+
+
+class TestClassifiedEmailSchema:
+
+    def test_each_label_parses_to_its_member(self):
+        invoice = ClassifiedEmail.model_validate({"result": {"label": "invoice", "invoice": _invoice().model_dump()}})
+        shipping = ClassifiedEmail.model_validate({"result": {"label": "shipping", "shipping": {"carrier": "UPS"}}})
+        client = ClassifiedEmail.model_validate({"result": {"label": "client_communications", "client": {"summary": "Asks for a quote"}}})
+        other = ClassifiedEmail.model_validate({"result": {"label": "insurance"}})
+
+        assert isinstance(invoice.result, InvoiceResult)
+        assert isinstance(shipping.result, ShippingResult)
+        assert isinstance(client.result, ClientResult)
+        assert isinstance(other.result, OtherResult)
+        print("Labels select the matching union member")
+
+    def test_schema_is_accepted_by_structured_outputs(self):
+        schema = text_format_param(ClassifiedEmail)["schema"]
+        result = schema["properties"]["result"]
+        assert "anyOf" in result and "oneOf" not in result
+        print("Union emitted as anyOf")
+
+    def test_label_prompt_unchanged(self):
+        assert LABEL_PROMPT.endswith("Return only the label.")
+        assert FUSED_PROMPT.startswith(LABEL_PROMPT[:-len("Return only the label.")])
+        print("Fused prompt shares the classification instructions")
+
+
+class TestClassifyAndExtract:
+
+    def test_invoice_in_one_call(self):
+        client = _client(InvoiceResult(label="invoice", invoice=_invoice()))
+
+        result = classify_and_extract("Invoice attached", [("inv.pdf", b"")], client=client, document_text="ABC Supply Shingles 10 x 45.00 Total 450.00")
+
+        assert result.label == "invoice"
+        assert result.invoice.total_amount == 450.0
+        assert client.responses.parse.call_count == 1
+        kwargs = client.responses.parse.call_args.kwargs
+        assert kwargs["model"] == FUSED_MODEL
+        assert kwargs["text_format"] is ClassifiedEmail
+        assert "Shingles 10 x 45.00" in kwargs["input"][-1]["content"][0]["text"]
+        print("Label and invoice returned by a single call")
+
+    def test_shipping_payload(self):
+        client = _client(ShippingResult(label="shipping", shipping=ShippingData(carrier="UPS", tracking_number="1Z999AA10123456784")))
+
+        result = classify_and_extract("Your order has shipped", [("packing.pdf", b"")], client=client, document_text="Packing slip")
+
+        assert result.label == "shipping"
+        assert result.shipping.tracking_number == "1Z999AA10123456784"
+        print("Shipping data returned with its label")
+
+    def test_client_and_other_labels(self):
+        client = _client(ClientResult(label="client_communications", client=ClientData(summary="Asks for a revised quote")), OtherResult(label="none"))
+
+        assert classify_and_extract("Revised plans attached", [], client=client, document_text="Plan set").client.summary
+        assert classify_and_extract("Newsletter", [], client=client, document_text="Deals").label == "none"
+        print("Client communications and label-only results")
+
+    def test_bad_invoice_escalates_to_strong_model(self):
+        client = _client(
+            InvoiceResult(label="invoice", invoice=_invoice(total_amount=999.0)),
+            InvoiceResult(label="invoice", invoice=_invoice()),
+        )
+
+        result = classify_and_extract("Invoice attached", [], client=client, document_text="...")
+
+        assert result.invoice.total_amount == 450.0
+        models = [call.kwargs["model"] for call in client.responses.parse.call_args_list]
+        assert models == [FUSED_MODEL, PDF_INVOICE_MODEL]
+        print("Invoice failing the checks redone by the strong model")
+
+    def test_image_attachment_sent_inline(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), "white").save(buffer, format="PNG")
+        client = _client(OtherResult(label="none"))
+
+        classify_and_extract("Photo", [("photo.png", b"")], client=client, image_data=buffer.getvalue(), image_name="photo.png")
+
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        assert content[1]["type"] == "input_image"
+        assert content[1]["image_url"].startswith("data:image/")
+        print("Image attachment included in the fused call")
+
+    def test_api_failure_returns_none(self):
+        client = MagicMock()
+        client.responses.parse.side_effect = APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/responses"))
+
+        assert classify_and_extract("Invoice attached", [], client=client, document_text="...") is None
+        print("Failure returns None so the caller can fall back")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,124 @@
+"""Test suite for image downscaling before vision upload"""
+import sys
+import io
+import base64
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from PIL import Image, ImageDraw
+from parsers.image_preprocess import estimate_vision_tokens, preprocess_image
+from parsers.ai_parser import ai_invoice
+from models.invoice import InvoiceData, InvoiceLine
+
+
+def _phone_photo(path, size=(2400, 1600)):
+    """Create a large, noisy colour PNG like a phone photo of a receipt"""
+    img = Image.effect_noise(size, 60).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([200, 200, 1200, 400], fill="white")
+    img.save(path, format="PNG", compress_level=1)
+    return str(path)
+
+
+class TestEstimateVisionTokens:
+    """Test the tile-based vision token estimate"""
+
+    def test_small_image_single_tile(self):
+        assert estimate_vision_tokens(500, 400) == 85 + 170
+        print("Small image is one tile")
+
+    def test_large_image_is_capped_by_provider_scaling(self):
+        # 4000x3000 -> 2048x1536 -> 1024x768 -> 2x2 tiles
+        assert estimate_vision_tokens(4000, 3000) == 85 + 170 * 4
+        print("Large image token estimate matches provider scaling")
+
+    def test_zero_size(self):
+        assert estimate_vision_tokens(0, 100) == 0
+        print("Empty image costs nothing")
+
+
+class TestPreprocessImage:
+    """Test downscaling, grayscale and JPEG re-encoding"""
+
+    def test_large_png_is_downscaled(self, tmp_path):
+        prepared = preprocess_image(_phone_photo(tmp_path / "receipt.png"))
+
+        assert prepared.mime_type == "image/jpeg"
+        assert prepared.filename == "receipt.jpg"
+        assert prepared.bytes_saved > 0
+
+        with Image.open(io.BytesIO(prepared.data)) as img:
+            assert max(img.size) <= 2048
+            assert min(img.size) <= 768
+            assert img.mode == "L"
+        print(f"Phone photo shrunk by {prepared.bytes_saved} bytes")
+
+    def test_smaller_target_saves_tokens(self, tmp_path):
+        prepared = preprocess_image(_phone_photo(tmp_path / "receipt.png"), max_short_side=512)
+        assert prepared.tokens_saved > 0
+        print(f"Lower resolution target saves {prepared.tokens_saved} vision tokens")
+
+    def test_color_kept_when_grayscale_disabled(self, tmp_path):
+        prepared = preprocess_image(_phone_photo(tmp_path / "receipt.png"), grayscale=False)
+        with Image.open(io.BytesIO(prepared.data)) as img:
+            assert img.mode == "RGB"
+        print("Colour preserved when requested")
+
+    def test_small_jpeg_kept_as_is(self, tmp_path):
+        path = tmp_path / "tiny.jpg"
+        Image.effect_noise((300, 200), 60).convert("RGB").save(path, format="JPEG", quality=30)
+
+        prepared = preprocess_image(str(path), quality=95, grayscale=False)
+
+        assert prepared.data == path.read_bytes()
+        assert prepared.bytes_saved == 0
+        print("Already-small image not re-encoded")
+
+
+class TestAiInvoiceSendsPreparedImage:
+    """Test that ai_invoice sends the preprocessed bytes"""
+
+    def _make_mock_client(self):
+        mock_client = MagicMock()
+        mock_client.files.create.return_value = MagicMock(id="file-1")
+        mock_response = MagicMock()
+        mock_response.output_parsed = InvoiceData(
+            vendor_display_name="Corner Hardware",
+            line_items=[InvoiceLine(item="Screws", rate=4.0)],
+            total_amount=4.0,
+        )
+        mock_client.responses.parse.return_value = mock_response
+        return mock_client
+
+    def _sent_image(self, client):
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        header, encoded = content[1]["image_url"].split(",", 1)
+        return header, base64.b64decode(encoded)
+
+    def test_upload_is_compressed(self, tmp_path):
+        path = _phone_photo(tmp_path / "receipt.png")
+        client = self._make_mock_client()
+
+        ai_invoice("receipt photo", file_path=path, client=client)
+
+        header, data = self._sent_image(client)
+        assert header == "data:image/jpeg;base64"
+        assert len(data) < Path(path).stat().st_size
+        print("ai_invoice sends the downscaled JPEG")
+
+    def test_preprocess_can_be_disabled(self, tmp_path):
+        path = _phone_photo(tmp_path / "receipt.png", size=(400, 300))
+        client = self._make_mock_client()
+
+        ai_invoice("receipt photo", file_path=path, client=client, preprocess=False)
+
+        header, data = self._sent_image(client)
+        assert header == "data:image/png;base64"
+        assert data == Path(path).read_bytes()
+        print("Raw file sent when preprocessing is off")
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,128 @@
+"""Test suite for layout-aware invoice region extraction"""
+import io
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pdfplumber
+import pypdfium2
+import pytest
+from parsers.invoice_layout import _continuation, _totals_lines, compact_invoice_text
+from parsers.pdf_parser import extract_pages_from_pdf, extract_text_from_pdf, open_pdf
+
+ATTACHMENTS = Path(__file__).parent.parent / "attachments"
+DISPOSAL_PDF = ATTACHMENTS / "INV0000768277 courier $2,315.51.pdf"
+RECEIPT_PDF = ATTACHMENTS / "2307-271409.pdf"
+NO_TABLE_PDF = ATTACHMENTS / "figma_invoice_2025-11-20.pdf"
+
+
+def _with_cover_page(cover: Path, invoice: Path) -> bytes:
+    """invoice with the first page of cover placed in front of it"""
+    merged = pypdfium2.PdfDocument.new()
+    merged.import_pages(pypdfium2.PdfDocument(cover), [0])
+    merged.import_pages(pypdfium2.PdfDocument(invoice))
+    buffer = io.BytesIO()
+    merged.save(buffer)
+    return buffer.getvalue()
+
+
+def _table(left, right, columns):
+    return SimpleNamespace(bbox=(left, 100, right, 200), extract=lambda: [["x"] * columns, ["y"] * columns])
+
+
+class TestCompactInvoiceText:
+
+    def test_keeps_header_items_and_totals(self):
+        compact = compact_invoice_text(DISPOSAL_PDF)
+
+        assert compact is not None
+        assert "INVOICE NO. 768277" in compact.text
+        assert "DUE DATE 03/27/2023" in compact.text
+        assert "Container Rent RC271195 $5.00 3.00 $15.00" in compact.text
+        assert "PLEASE PAY $2,315.51" in compact.text
+        assert compact.item_tables == 1
+        print(f"Kept {compact.compact_tokens} of {compact.full_tokens} tokens")
+
+    def test_reports_token_savings(self):
+        compact = compact_invoice_text(DISPOSAL_PDF.read_bytes())
+
+        assert compact.compact_tokens < compact.full_tokens
+        assert compact.saved_tokens == compact.full_tokens - compact.compact_tokens
+        assert 0 < compact.saved_share < 1
+        print(f"Saved {compact.saved_share:.0%}")
+
+    def test_cover_page_kept_in_header(self):
+        cover_text = extract_text_from_pdf(NO_TABLE_PDF)
+        compact = compact_invoice_text(_with_cover_page(NO_TABLE_PDF, DISPOSAL_PDF))
+
+        assert compact is not None and compact.pages == 2
+        header = compact.text.split("Line items")[0]
+        first_line = cover_text.strip().splitlines()[0]
+        assert " ".join(first_line.split()) in header
+        assert "INVOICE NO. 768277" in header
+        assert "Line items (page 2)" in compact.text
+        print("Cover page sent as part of the header")
+
+    def test_reuses_an_open_document_and_its_pages(self):
+        with patch("parsers.pdf_parser.pdfplumber.open", wraps=pdfplumber.open) as opened:
+            with open_pdf(DISPOSAL_PDF) as pdf:
+                pages = extract_pages_from_pdf(pdf)
+                compact = compact_invoice_text(pdf, pages)
+
+        assert opened.call_count == 1
+        assert compact.text == compact_invoice_text(DISPOSAL_PDF).text
+        print("Pages and layout read from one parse")
+
+    def test_nothing_saved_returns_none(self):
+        # The line-item table already spans almost the whole page
+        assert compact_invoice_text(RECEIPT_PDF) is None
+        print("Full text kept when cropping saves nothing")
+
+    def test_no_line_item_table_returns_none(self):
+        assert extract_text_from_pdf(NO_TABLE_PDF)
+        assert compact_invoice_text(NO_TABLE_PDF) is None
+        print("Full text kept when no line-item table is found")
+
+
+class TestContinuation:
+
+    def test_first_table_with_same_columns_continues(self):
+        first = _table(30, 582, 6)
+        carried = _table(31, 580, 6)
+        assert _continuation([carried, _table(30, 582, 6)], first) is carried
+
+    def test_lower_tables_never_continue(self):
+        first = _table(30, 582, 6)
+        # A notes box on top, then a full-width terms grid that lines up
+        assert _continuation([_table(300, 400, 1), _table(30, 582, 6)], first) is None
+
+    def test_column_count_must_match(self):
+        first = _table(30, 582, 6)
+        assert _continuation([_table(30, 582, 2)], first) is None
+        assert _continuation([], first) is None
+        print("Remittance stubs and terms grids are not line items")
+
+
+class TestTotalsLines:
+
+    def test_keeps_totals_and_amounts_only(self):
+        text = (
+            "Subtotal 450.00\n"
+            "Sales Tax 38.00\n"
+            "Total Due $488.00\n"
+            "All claims must be made within 10 days of receipt.\n"
+            "Returns accepted with original packaging only.\n"
+        )
+        assert _totals_lines(text) == ["Subtotal 450.00", "Sales Tax 38.00", "Total Due $488.00"]
+        print("Terms and conditions without figures dropped")
+
+    def test_line_cap(self):
+        text = "\n".join(f"Line {n} 1.00" for n in range(40))
+        assert len(_totals_lines(text, max_lines=5)) == 5
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,169 @@
+"""Test suite for targeted repair of invoice fields failing the checks"""
+import asyncio
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from models.invoice import InvoiceData, InvoiceFix, InvoiceLine
+from parsers.ai_parser import FAST_INVOICE_MODEL, PDF_INVOICE_MODEL, REPAIR_MODEL, pdf_invoice, repair_invoice
+from parsers.async_ai_parser import pdf_invoice_async
+from parsers.invoice_checks import InvoiceIssue, check_invoice
+from parsers.invoice_repair import apply_fix, fields_to_fix, repair_snippet
+from utils.rate_limit import AsyncRateLimiter
+
+DOCUMENT = (
+    "ABC Supply Co.\n"
+    "1200 Industrial Pkwy, Springfield IL 62701\n"
+    "INVOICE\n"
+    "Invoice #: INV-1001    Date: March 14, 2026\n"
+    "Terms: Net 30\n"
+    "Bill To: Cape Property Pros\n"
+    "Description   Qty   Price   Amount\n"
+    "Shingles bundle   10   45.00   450.00\n"
+    "Roofing nails 5lb   2   12.50   25.00\n"
+    "Ridge vent   1   25.00   25.00\n"
+    "Subtotal 500.00\n"
+    "Total Due 500.00\n"
+    "Thank you for your business.\n"
+)
+
+ITEMS = [InvoiceLine(item="Shingles bundle", rate=45.0, quantity=10), InvoiceLine(item="Roofing nails 5lb", rate=12.5, quantity=2)]
+
+
+def _invoice(**overrides):
+    fields = dict(vendor_display_name="ABC Supply", line_items=ITEMS, total_amount=475.0, invoice_date="03/14/2026")
+    fields.update(overrides)
+    return InvoiceData(**fields)
+
+
+def _client(*payloads):
+    client = MagicMock()
+    client.responses.parse.side_effect = [MagicMock(output_parsed=payload) for payload in payloads]
+    return client
+
+
+class TestFieldsToFix:
+
+    def test_total_mismatch_reopens_items_not_total(self):
+        assert fields_to_fix([InvoiceIssue("total_amount", "mismatch")]) == ["line_items", "tax"]
+
+    def test_missing_total_read_alone(self):
+        assert fields_to_fix([InvoiceIssue("total_amount", "missing")]) == ["tax", "total_amount"]
+
+    def test_items_and_total_never_fixed_together(self):
+        issues = [InvoiceIssue("line_items", "no line items"), InvoiceIssue("total_amount", "missing")]
+        assert fields_to_fix(issues) == []
+        print("Items and total both wrong: full re-extraction")
+
+    def test_date_issue_only_touches_the_date(self):
+        assert fields_to_fix([InvoiceIssue("invoice_date", "bad format")]) == ["invoice_date"]
+
+    def test_no_output_or_failed_call_not_repairable(self):
+        assert fields_to_fix([InvoiceIssue("*", "no output")]) == []
+        assert fields_to_fix(["fast model call failed: timeout"]) == []
+        print("Whole-extraction failures go to a full re-extraction")
+
+
+class TestRepairSnippet:
+
+    def test_amount_lines_only(self):
+        snippet = repair_snippet(DOCUMENT, ["line_items", "tax", "total_amount"])
+        assert "Ridge vent   1   25.00   25.00" not in snippet  # whitespace collapsed
+        assert "Ridge vent 1 25.00 25.00" in snippet
+        assert "Total Due 500.00" in snippet
+        assert "Bill To" not in snippet and "Thank you" not in snippet
+        print(f"Snippet for totals:\n{snippet}")
+
+    def test_date_lines(self):
+        snippet = repair_snippet(DOCUMENT, ["invoice_date"])
+        assert snippet.splitlines() == ["Invoice #: INV-1001 Date: March 14, 2026", "Terms: Net 30"]
+
+    def test_budget_keeps_both_ends(self):
+        text = "\n".join(f"Item {n} 1 10.00 10.00" for n in range(500)) + "\nTotal Due 5,000.00"
+        snippet = repair_snippet(text, ["total_amount"], max_tokens=200)
+        assert snippet.startswith("Item 0 ")
+        assert snippet.endswith("Total Due 5,000.00")
+        assert "..." in snippet.splitlines()
+
+    def test_cut_items_not_repaired(self):
+        text = "\n".join(f"Item {n} 1 10.00 10.00" for n in range(500)) + "\nTotal Due 5,000.00"
+        assert repair_snippet(text, ["line_items", "tax"], max_tokens=200) == ""
+        print("Line items that do not fit the snippet are left to the strong model")
+
+    def test_nothing_relevant(self):
+        assert repair_snippet("...", ["total_amount"]) == ""
+
+
+class TestApplyFix:
+
+    def test_only_listed_fields_patched(self):
+        fix = InvoiceFix(invoice_date="03/14/2026", vendor_display_name="Someone Else")
+        patched = apply_fix(_invoice(invoice_date="March 14"), fix, ["invoice_date"])
+        assert patched.invoice_date == "03/14/2026"
+        assert patched.vendor_display_name == "ABC Supply"
+
+
+class TestRepairInvoice:
+
+    def test_missed_item_added_without_strong_model(self):
+        fixed_items = ITEMS + [InvoiceLine(item="Ridge vent", rate=25.0, quantity=1)]
+        client = _client(_invoice(total_amount=500.0), InvoiceFix(line_items=fixed_items))
+
+        draft = pdf_invoice("invoice", text=DOCUMENT, client=client)
+
+        models = [call.kwargs["model"] for call in client.responses.parse.call_args_list]
+        assert models == [FAST_INVOICE_MODEL, REPAIR_MODEL]
+        assert PDF_INVOICE_MODEL not in models
+        assert len(draft.line_items) == 3
+        assert draft.total_amount == 500.0
+
+        repair_prompt = client.responses.parse.call_args_list[1].kwargs["input"][1]["content"]
+        assert "Fields to correct: line_items, tax\n" in repair_prompt
+        assert "Bill To" not in repair_prompt
+        print("Total mismatch fixed by re-asking the line items")
+
+    def test_long_item_list_escalates(self):
+        document = "ABC Supply Co.\n" + "\n".join(f"Item {n} 1 10.00 10.00" for n in range(1000)) + "\nTotal Due 10,000.00"
+        client = _client(_invoice(total_amount=10000.0), _invoice(vendor_display_name="Strong Result", total_amount=475.0))
+
+        draft = pdf_invoice("invoice", text=document, client=client)
+
+        models = [call.kwargs["model"] for call in client.responses.parse.call_args_list]
+        assert models == [FAST_INVOICE_MODEL, PDF_INVOICE_MODEL]
+        assert draft.vendor_display_name == "Strong Result"
+
+    def test_bad_date_fixed(self):
+        client = _client(InvoiceFix(invoice_date="03/14/2026"))
+        repaired = repair_invoice(client, _invoice(invoice_date="March 14, 2026"), DOCUMENT)
+        assert repaired.invoice_date == "03/14/2026"
+        assert check_invoice(repaired) == []
+
+    def test_unhelpful_fix_escalates(self):
+        client = _client(_invoice(total_amount=500.0), InvoiceFix(total_amount=999.0), _invoice(vendor_display_name="Strong Result", total_amount=475.0))
+
+        draft = pdf_invoice("invoice", text=DOCUMENT, client=client)
+
+        models = [call.kwargs["model"] for call in client.responses.parse.call_args_list]
+        assert models == [FAST_INVOICE_MODEL, REPAIR_MODEL, PDF_INVOICE_MODEL]
+        assert draft.vendor_display_name == "Strong Result"
+        print("Fix that still fails the checks falls back to the strong model")
+
+    def test_async_repair(self):
+        fixed_items = ITEMS + [InvoiceLine(item="Ridge vent", rate=25.0, quantity=1)]
+        client = MagicMock()
+        client.responses.parse = AsyncMock(side_effect=[
+            MagicMock(output_parsed=_invoice(total_amount=500.0)),
+            MagicMock(output_parsed=InvoiceFix(line_items=fixed_items)),
+        ])
+
+        draft = asyncio.run(pdf_invoice_async("invoice", text=DOCUMENT, client=client, limiter=AsyncRateLimiter(max_concurrency=2)))
+
+        assert len(draft.line_items) == 3
+        assert client.responses.parse.await_count == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
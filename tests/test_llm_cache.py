@@ -0,0 +1,131 @@
+"""Test suite for the persistent LLM response cache"""
+import sys
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from services.llm_cache import LLMCache, prompt_version
+from parsers.ai_parser import invoice_label, parse_shipping, pdf_invoice
+from models.invoice import InvoiceData, InvoiceLine, LabelSort, ShippingData
+
+
+@pytest.fixture
+def cache(tmp_path):
+    llm_cache = LLMCache(path=tmp_path / "llm_cache.sqlite3")
+    yield llm_cache
+    llm_cache.close()
+
+
+def _mock_client(parsed):
+    mock_client = MagicMock()
+    mock_response = MagicMock()
+    mock_response.output_parsed = parsed
+    mock_client.responses.parse.return_value = mock_response
+    return mock_client
+
+
+class TestCachedParsers:
+
+    def test_repeat_label_served_from_cache(self, cache):
+        client = _mock_client(LabelSort(label="shipping"))
+
+        first = invoice_label("Your order has shipped", [], client=client, cache=cache)
+        second = invoice_label("Your order has shipped", [], client=client, cache=cache)
+
+        assert first == second == "shipping"
+        assert client.responses.parse.call_count == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+        print("Second identical email did not call the model")
+
+    def test_different_content_is_a_miss(self, cache):
+        client = _mock_client(LabelSort(label="none"))
+
+        invoice_label("Newsletter", [], client=client, cache=cache)
+        invoice_label("Another newsletter", [], client=client, cache=cache)
+
+        assert client.responses.parse.call_count == 2
+        print("Different email content not served from cache")
+
+    def test_cached_invoice_round_trips(self, cache):
+        payload = InvoiceData(
+            vendor_display_name="Lumber Yard",
+            line_items=[InvoiceLine(item="2x4", rate=5.0, quantity=4, category="Materials")],
+            total_amount=20.0,
+            is_receipt=True,
+        )
+        client = _mock_client(payload)
+
+        pdf_invoice("invoice attached", text="2x4 x4 $20", client=client, cache=cache)
+        draft = pdf_invoice("invoice attached", text="2x4 x4 $20", client=client, cache=cache)
+
+        assert client.responses.parse.call_count == 1
+        assert draft.vendor_display_name == "Lumber Yard"
+        assert draft.line_items[0].category == "Materials"
+        assert draft.is_receipt is True
+        print("Cached InvoiceData rebuilt into a draft")
+
+    def test_no_cache_always_calls_model(self):
+        client = _mock_client(ShippingData(carrier="UPS"))
+        parse_shipping("Shipped via UPS", [], client=client)
+        parse_shipping("Shipped via UPS", [], client=client)
+        assert client.responses.parse.call_count == 2
+        print("Caching is opt-in")
+
+
+class TestInvalidation:
+
+    def test_prompt_change_invalidates(self, cache):
+        client = _mock_client(LabelSort(label="invoice"))
+        invoice_label("Invoice #1", [], client=client, cache=cache)
+
+        with patch("parsers.ai_parser.LABEL_PROMPT", "A different prompt"):
+            invoice_label("Invoice #1", [], client=client, cache=cache)
+
+        assert client.responses.parse.call_count == 2
+        print("Editing the prompt stops old entries from matching")
+
+    def test_old_prompt_entries_purged_on_write(self, cache):
+        old = prompt_version("old prompt", LabelSort)
+        new = prompt_version("new prompt", LabelSort)
+        assert old != new
+
+        cache.put("k-old", "invoice_label", "m", old, LabelSort(label="none"))
+        cache.put("k-new", "invoice_label", "m", new, LabelSort(label="none"))
+
+        assert cache.get("k-old", LabelSort) is None
+        assert cache.get("k-new", LabelSort).label == "none"
+        print("Stale prompt versions removed")
+
+    def test_unparseable_entry_is_a_miss(self, cache):
+        cache.put("k", "parse_shipping", "m", "v", LabelSort(label="none"))
+
+        # ClientData requires a summary, so the stored LabelSort no longer fits
+        from models.invoice import ClientData
+        assert cache.get("k", ClientData) is None
+        assert cache.get("k", LabelSort) is None
+        print("Entry that fails validation dropped")
+
+
+class TestEviction:
+
+    def test_least_recently_used_evicted(self, tmp_path):
+        entry_size = len(LabelSort(label="none").model_dump_json())
+        cache = LLMCache(path=tmp_path / "small.sqlite3", max_bytes=entry_size * 2)
+
+        cache.put("a", "invoice_label", "m", "v", LabelSort(label="none"))
+        cache.put("b", "invoice_label", "m", "v", LabelSort(label="none"))
+        cache.get("a", LabelSort)  # a is now more recent than b
+        cache.put("c", "invoice_label", "m", "v", LabelSort(label="none"))
+
+        assert cache.get("b", LabelSort) is None
+        assert cache.get("a", LabelSort) is not None
+        assert cache.get("c", LabelSort) is not None
+        assert cache.total_bytes() <= entry_size * 2
+        cache.close()
+        print("Cache stays within its size bound")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
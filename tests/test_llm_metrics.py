@@ -0,0 +1,162 @@
+"""Test suite for LLM token and latency accounting"""
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from openai import APIConnectionError
+from services import llm_metrics
+from services.llm_metrics import CallRecord, MetricsStore, estimate_cost, format_summary, percentile
+from services.llm_cache import LLMCache
+from parsers.ai_parser import invoice_label, parse_shipping
+from parsers.async_ai_parser import invoice_label_async
+from utils.rate_limit import AsyncRateLimiter
+from models.invoice import LabelSort, ShippingData
+
+
+@pytest.fixture
+def store(tmp_path):
+    metrics = MetricsStore(path=tmp_path / "llm_metrics.sqlite3")
+    llm_metrics.activate(metrics)
+    yield metrics
+    llm_metrics.activate(None)
+    metrics.close()
+
+
+def _usage(input_tokens, output_tokens, cached_tokens):
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        input_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+def _mock_client(parsed, usage=None):
+    mock_client = MagicMock()
+    mock_response = MagicMock()
+    mock_response.output_parsed = parsed
+    mock_response.usage = usage
+    mock_client.responses.parse.return_value = mock_response
+    return mock_client
+
+
+class TestSummary:
+
+    def test_percentiles(self):
+        values = [float(n) for n in range(1, 21)]
+        assert percentile(values, 50) == 10.0
+        assert percentile(values, 95) == 19.0
+        assert percentile([], 50) is None
+        print("Nearest-rank p50/p95 computed")
+
+    def test_cost_charges_cached_tokens_at_cached_rate(self):
+        cost = estimate_cost("gpt-5", input_tokens=1_000_000, cached_tokens=400_000, output_tokens=100_000)
+        assert cost == pytest.approx(0.6 * 1.25 + 0.4 * 0.125 + 0.1 * 10.0)
+        assert estimate_cost("unknown-model", 10, 0, 10) is None
+        print(f"Cost estimate: ${cost:.3f}")
+
+    def test_summary_groups_by_label_and_model(self, store):
+        store.record(CallRecord("pdf_invoice", "gpt-5-mini", 1.0, 1000, 200, 800))
+        store.record(CallRecord("ai_invoice", "gpt-5-mini", 3.0, 2000, 300, 0))
+        store.record(CallRecord("pdf_invoice", "gpt-5", 5.0, 1000, 200, 0))
+        store.record(CallRecord("invoice_label", "gpt-4o-2024-08-06", 0.0, cache_hit=True))
+
+        rows = {(row["label"], row["model"]): row for row in store.summary()}
+
+        mini = rows[("invoice", "gpt-5-mini")]
+        assert mini["calls"] == 2
+        assert (mini["p50_seconds"], mini["p95_seconds"]) == (1.0, 3.0)
+        assert (mini["input_tokens"], mini["output_tokens"], mini["cached_tokens"]) == (3000, 500, 800)
+        assert rows[("invoice", "gpt-5")]["calls"] == 1
+
+        labels = rows[("classification", "gpt-4o-2024-08-06")]
+        assert (labels["calls"], labels["cache_hits"], labels["p50_seconds"]) == (0, 1, None)
+
+        text = format_summary(store.summary())
+        assert "gpt-5-mini" in text and "Estimated LLM cost" in text
+        print(text)
+
+    def test_summary_is_per_run(self, tmp_path):
+        path = tmp_path / "llm_metrics.sqlite3"
+        first = MetricsStore(path=path)
+        first.record(CallRecord("parse_shipping", "gpt-4o-2024-08-06", 1.0))
+        first.close()
+
+        second = MetricsStore(path=path)
+        assert second.summary() == []
+        assert len(second.records(first.run_id)) == 1
+        second.close()
+        print("Earlier runs kept but not summarised")
+
+
+class TestRecording:
+
+    def test_call_recorded_with_usage(self, store):
+        client = _mock_client(ShippingData(tracking_number="1Z999"), usage=_usage(1200, 80, 1024))
+
+        parse_shipping("Your order has shipped", [], client=client)
+
+        [call] = store.records()
+        assert (call.operation, call.model) == ("parse_shipping", "gpt-4o-2024-08-06")
+        assert (call.input_tokens, call.output_tokens, call.cached_tokens) == (1200, 80, 1024)
+        assert call.latency_seconds >= 0
+        print(f"Recorded: {call}")
+
+    def test_cache_hit_recorded(self, store, tmp_path):
+        cache = LLMCache(path=tmp_path / "llm_cache.sqlite3")
+        client = _mock_client(LabelSort(label="shipping"), usage=_usage(500, 5, 0))
+
+        invoice_label("Your order has shipped", [], client=client, cache=cache)
+        invoice_label("Your order has shipped", [], client=client, cache=cache)
+        cache.close()
+
+        assert [call.cache_hit for call in store.records()] == [False, True]
+        print("Cache hit recorded without tokens")
+
+    def test_failed_call_recorded(self, store):
+        client = MagicMock()
+        client.responses.parse.side_effect = APIConnectionError(request=MagicMock())
+
+        with pytest.raises(APIConnectionError):
+            invoice_label("hello", [], client=client)
+
+        [call] = store.records()
+        assert call.error == "APIConnectionError"
+        print("Failed call recorded with its error type")
+
+    def test_missing_usage_records_zero_tokens(self, store):
+        invoice_label("hello", [], client=_mock_client(LabelSort(label="none")))
+
+        [call] = store.records()
+        assert (call.input_tokens, call.output_tokens, call.cached_tokens) == (0, 0, 0)
+        print("Response without usage recorded with zero tokens")
+
+    def test_async_call_recorded(self, store):
+        client = MagicMock()
+        response = MagicMock()
+        response.output_parsed = LabelSort(label="invoice")
+        response.usage = _usage(700, 4, 0)
+        client.responses.parse = AsyncMock(return_value=response)
+
+        async def run():
+            return await invoice_label_async("Invoice attached", [], client=client, limiter=AsyncRateLimiter())
+
+        assert asyncio.run(run()) == "invoice"
+        [call] = store.records()
+        assert (call.operation, call.input_tokens) == ("invoice_label", 700)
+        print("Async call recorded")
+
+    def test_nothing_recorded_when_inactive(self, tmp_path):
+        metrics = MetricsStore(path=tmp_path / "llm_metrics.sqlite3")
+        invoice_label("hello", [], client=_mock_client(LabelSort(label="none")))
+        assert metrics.records() == []
+        metrics.close()
+        print("Recording is off until a store is activated")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,241 @@
+"""Test suite for LLM call retries, deadlines and hedged requests"""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import httpx
+import pytest
+from openai import APITimeoutError, BadRequestError, InternalServerError, RateLimitError
+from models.invoice import LabelSort
+from parsers.ai_parser import invoice_label
+from services import llm_resilience
+from services.llm_resilience import CallLayer, RetryPolicy, backoff_delay, format_stats, is_retryable, retry_after
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/responses")
+
+
+def _status_error(cls, status, headers=None):
+    return cls("error", response=httpx.Response(status, request=REQUEST, headers=headers), body=None)
+
+
+def _timeout():
+    return APITimeoutError(request=REQUEST)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _layer(clock=None, **policy):
+    clock = clock or FakeClock()
+    return CallLayer(RetryPolicy(**policy), clock=clock, sleep=clock.sleep, rand=lambda: 1.0)
+
+
+def _flaky(*outcomes):
+    """An attempt function raising or returning the given outcomes in order"""
+    outcomes = list(outcomes)
+    timeouts = []
+
+    def attempt(timeout=None):
+        timeouts.append(timeout)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    attempt.timeouts = timeouts
+    return attempt
+
+
+class TestRetryDecisions:
+
+    def test_retryable_errors(self):
+        assert is_retryable(_timeout())
+        assert is_retryable(_status_error(RateLimitError, 429))
+        assert is_retryable(_status_error(InternalServerError, 503))
+        assert not is_retryable(_status_error(BadRequestError, 400))
+        assert not is_retryable(ValueError("bad schema"))
+
+    def test_backoff_grows_and_caps(self):
+        policy = RetryPolicy(backoff_base=0.5, backoff_max=4.0)
+        assert [backoff_delay(n, policy, rand=lambda: 1.0) for n in range(5)] == [0.5, 1.0, 2.0, 4.0, 4.0]
+        assert backoff_delay(3, policy, rand=lambda: 0.25) == 1.0
+        print("Full-jitter backoff doubles up to the cap")
+
+    def test_retry_after_header(self):
+        assert retry_after(_status_error(RateLimitError, 429, {"retry-after": "7"})) == 7.0
+        assert retry_after(_status_error(RateLimitError, 429, {"retry-after-ms": "250"})) == 0.25
+        assert retry_after(_timeout()) is None
+
+
+class TestCall:
+
+    def test_retries_until_success(self):
+        clock = FakeClock()
+        layer = _layer(clock, max_retries=3, backoff_base=1.0)
+        attempt = _flaky(_timeout(), _status_error(InternalServerError, 502), "ok")
+
+        assert layer.call("invoice_label", "gpt-4o", attempt) == "ok"
+        assert clock.sleeps == [1.0, 2.0]
+        assert layer.stats.retries == 2 and layer.stats.attempts == 3
+        assert dict(layer.stats.retries_by_error) == {"APITimeoutError": 1, "InternalServerError": 1}
+        print(format_stats(layer.stats))
+
+    def test_gives_up_after_max_retries(self):
+        layer = _layer(max_retries=1)
+        with pytest.raises(APITimeoutError):
+            layer.call("invoice_label", "gpt-4o", _flaky(_timeout(), _timeout(), "never"))
+        assert layer.stats.gave_up == 1
+
+    def test_client_errors_not_retried(self):
+        layer = _layer()
+        attempt = _flaky(_status_error(BadRequestError, 400), "never")
+        with pytest.raises(BadRequestError):
+            layer.call("invoice_label", "gpt-4o", attempt)
+        assert len(attempt.timeouts) == 1
+        print("400 raised without retrying")
+
+    def test_deadline_bounds_attempts_and_timeouts(self):
+        clock = FakeClock()
+        layer = _layer(clock, max_retries=10, backoff_base=4.0, deadline=10.0)
+        attempt = _flaky(*[_timeout()] * 10)
+
+        with pytest.raises(APITimeoutError):
+            layer.call("pdf_invoice", "gpt-5", attempt)
+
+        assert attempt.timeouts[0] == 10.0
+        assert attempt.timeouts[1] == 6.0  # what was left after the first backoff
+        assert layer.stats.deadline_exceeded == 1
+        print(f"Gave up after {len(attempt.timeouts)} attempts within the deadline")
+
+    def test_model_deadline_overrides_default(self):
+        clock = FakeClock()
+        layer = _layer(clock, deadline=90.0, model_deadlines={"gpt-5": 600.0})
+        strong, fast = _flaky("ok"), _flaky("ok")
+        layer.call("pdf_invoice", "gpt-5", strong)
+        layer.call("pdf_invoice", "gpt-5-mini", fast)
+        assert strong.timeouts == [600.0] and fast.timeouts == [90.0]
+        print("Strong model gets its own deadline")
+
+    def test_rate_limit_waits_as_asked(self):
+        clock = FakeClock()
+        layer = _layer(clock)
+        layer.call("invoice_label", "gpt-4o", _flaky(_status_error(RateLimitError, 429, {"retry-after": "3"}), "ok"))
+        assert clock.sleeps == [3.0]
+
+
+class TestHedging:
+
+    def _warmed(self, **policy):
+        layer = CallLayer(RetryPolicy(hedge=True, hedge_min_samples=5, hedge_min_delay=0.05, **policy))
+        for _ in range(5):
+            layer.record_latency("pdf_invoice", "gpt-5", 0.01)
+        return layer
+
+    def test_no_hedge_without_history(self):
+        layer = CallLayer(RetryPolicy(hedge=True, hedge_min_samples=5))
+        assert layer.hedge_delay("pdf_invoice", "gpt-5") is None
+
+    def test_slow_attempt_hedged(self):
+        layer = self._warmed()
+        release = threading.Event()
+        calls = []
+
+        def attempt(timeout=None):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        try:
+            assert layer.call("pdf_invoice", "gpt-5", attempt) == "fast"
+        finally:
+            release.set()
+        assert layer.stats.hedges == 1 and layer.stats.hedge_wins == 1
+        print("Duplicate request answered first")
+
+    def test_close_shuts_down_hedge_threads(self):
+        layer = self._warmed()
+        layer.call("pdf_invoice", "gpt-5", _flaky("ok"))
+        pool = layer._pool
+        assert pool is not None
+
+        layer.close()
+        assert layer._pool is None and pool._shutdown
+        layer.close()
+        print("Hedge pool shut down; closing twice is harmless")
+
+    def test_fast_attempt_not_hedged(self):
+        layer = self._warmed()
+        assert layer.call("pdf_invoice", "gpt-5", _flaky("ok")) == "ok"
+        assert layer.stats.hedges == 0
+
+    def test_async_loser_cancelled(self):
+        layer = self._warmed()
+        cancelled = []
+
+        async def attempt(timeout=None):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+                return "slow"
+            return "fast"
+
+        async def run():
+            result = await layer.call_async("pdf_invoice", "gpt-5", attempt)
+            await asyncio.sleep(0)
+            return result
+
+        assert asyncio.run(run()) == "fast"
+        assert cancelled == [True]
+        assert layer.stats.hedge_wins == 1
+
+
+class TestParseResponseIntegration:
+
+    @pytest.fixture
+    def layer(self):
+        clock = FakeClock()
+        layer = _layer(clock, deadline=30.0)
+        llm_resilience.activate(layer)
+        yield layer
+        llm_resilience.activate(None)
+
+    def test_timeout_retried_with_deadline(self, layer):
+        client = MagicMock()
+        client.responses.parse.side_effect = [_timeout(), MagicMock(output_parsed=LabelSort(label="invoice"))]
+
+        assert invoice_label("invoice attached", [], client=client) == "invoice"
+        assert client.responses.parse.call_count == 2
+        assert client.responses.parse.call_args_list[0].kwargs["timeout"] == 30.0
+        assert layer.stats.retries == 1
+        print("Timed-out classification retried instead of aborting the message")
+
+    def test_no_layer_single_attempt(self):
+        client = MagicMock()
+        client.responses.parse.side_effect = _timeout()
+        with pytest.raises(APITimeoutError):
+            invoice_label("invoice attached", [], client=client)
+        assert "timeout" not in client.responses.parse.call_args.kwargs
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
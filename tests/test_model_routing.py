@@ -0,0 +1,104 @@
+"""Test suite for invoice checks and fast/strong model routing"""
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import httpx
+import pytest
+from openai import APITimeoutError
+from parsers.ai_parser import FAST_INVOICE_MODEL, PDF_INVOICE_MODEL, pdf_invoice
+from parsers.invoice_checks import check_invoice
+from models.invoice import InvoiceData, InvoiceLine
+
+
+def _invoice(**overrides):
+    fields = dict(
+        vendor_display_name="ABC Supply",
+        line_items=[InvoiceLine(item="Shingles", rate=45.0, quantity=10), InvoiceLine(item="Nails", rate=12.5, quantity=2)],
+        total_amount=475.0,
+        invoice_date="03/14/2026",
+    )
+    fields.update(overrides)
+    return InvoiceData(**fields)
+
+
+def _client(*payloads):
+    client = MagicMock()
+    client.responses.parse.side_effect = [MagicMock(output_parsed=payload) for payload in payloads]
+    return client
+
+
+class TestCheckInvoice:
+
+    def test_consistent_invoice_passes(self):
+        assert check_invoice(_invoice()) == []
+
+    def test_total_including_tax_passes(self):
+        assert check_invoice(_invoice(tax=38.0, total_amount=513.0)) == []
+
+    def test_small_rounding_tolerated(self):
+        assert check_invoice(_invoice(total_amount=475.01)) == []
+
+    def test_total_mismatch_flagged(self):
+        issues = check_invoice(_invoice(total_amount=500.0))
+        assert [issue.field for issue in issues] == ["total_amount"]
+        assert "475.00" in issues[0].message
+
+    def test_missing_required_fields(self):
+        issues = check_invoice(_invoice(vendor_display_name=" ", line_items=[], total_amount=None))
+        assert {issue.field for issue in issues} == {"vendor_display_name", "line_items", "total_amount"}
+
+    def test_bad_dates_flagged(self):
+        issues = check_invoice(_invoice(invoice_date="2026-03-14", due_date="next Friday"))
+        assert {issue.field for issue in issues} == {"invoice_date", "due_date"}
+
+    def test_no_output(self):
+        assert check_invoice(None)[0].message == "no output"
+
+
+class TestRouting:
+
+    def test_fast_model_result_kept(self):
+        client = _client(_invoice())
+
+        draft = pdf_invoice("invoice", text="...", client=client)
+
+        assert draft.total_amount == 475.0
+        assert client.responses.parse.call_count == 1
+        assert client.responses.parse.call_args.kwargs["model"] == FAST_INVOICE_MODEL
+        print("Consistent fast extraction not escalated")
+
+    def test_failed_check_escalates(self):
+        client = _client(_invoice(total_amount=999.0), _invoice(vendor_display_name="Strong Result"))
+
+        draft = pdf_invoice("invoice", text="...", client=client)
+
+        models = [call.kwargs["model"] for call in client.responses.parse.call_args_list]
+        assert models == [FAST_INVOICE_MODEL, PDF_INVOICE_MODEL]
+        assert draft.vendor_display_name == "Strong Result"
+        print("Inconsistent total escalated to the strong model")
+
+    def test_fast_model_error_escalates(self):
+        client = MagicMock()
+        client.responses.parse.side_effect = [
+            APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/responses")),
+            MagicMock(output_parsed=_invoice()),
+        ]
+
+        draft = pdf_invoice("invoice", text="...", client=client)
+
+        assert draft.vendor_display_name == "ABC Supply"
+        assert client.responses.parse.call_args.kwargs["model"] == PDF_INVOICE_MODEL
+        print("Fast model timeout escalated")
+
+    def test_routing_disabled_uses_strong_model(self):
+        client = _client(_invoice())
+        pdf_invoice("invoice", text="...", client=client, routing=False)
+        assert client.responses.parse.call_args.kwargs["model"] == PDF_INVOICE_MODEL
+        print("Routing can be turned off")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,158 @@
+"""Test suite for the local OpenAI stand-in's Responses API and fault injection"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from openai import APIStatusError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError
+from parsers.ai_parser import invoice_label, invoice_label_batch, parse_client_communication, parse_shipping, pdf_invoice
+from parsers.async_ai_parser import invoice_label_async
+from services import llm_resilience
+from services.llm_resilience import CallLayer, RetryPolicy
+from services.openai_standin import Faults, Latency, StandInOpenAI
+from utils.rate_limit import AsyncRateLimiter
+
+
+def _client(server):
+    return OpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+
+
+@pytest.fixture
+def standin():
+    with StandInOpenAI() as server:
+        yield server
+
+
+class TestResponses:
+
+    def test_canned_outputs_through_the_parsers(self, standin):
+        client = _client(standin)
+
+        assert invoice_label("Invoice attached", [], client=client) == "invoice"
+        assert pdf_invoice("invoice", text="Lumber 2x4 10 @ $5.00\nTotal $50.00", client=client).total_amount == 50.0
+        assert parse_shipping("Your order shipped", [], client=client).carrier == "UPS"
+        assert parse_client_communication("Any update?", [], client=client).urgency == "low"
+        assert standin.stats.completed == 4
+        print("LabelSort, InvoiceData, ShippingData and ClientData served over HTTP")
+
+    def test_batch_labels_match_email_count(self, standin):
+        emails = [("one", []), ("two", []), ("three", [])]
+        assert invoice_label_batch(emails, client=_client(standin)) == ["invoice"] * 3
+        assert standin.stats.requests == 1
+
+    def test_usage_estimated(self, standin):
+        response = _client(standin).responses.create(
+            model="gpt-5-mini",
+            input=[{"role": "user", "content": "word " * 400}],
+            text={"format": {"type": "json_schema", "name": "LabelSort", "schema": {}, "strict": True}},
+        )
+        assert response.usage.input_tokens >= 400
+        assert response.usage.output_tokens > 0
+
+
+class TestFaults:
+
+    def test_injected_errors(self):
+        with StandInOpenAI(faults=Faults(error_rate=1.0, error_status=503)) as server:
+            with pytest.raises(InternalServerError):
+                invoice_label("hello", [], client=_client(server))
+            assert server.stats.errors == 1
+
+    def test_retry_layer_rides_out_errors(self):
+        with StandInOpenAI(faults=Faults(error_rate=0.5, seed=7)) as server:
+            layer = CallLayer(RetryPolicy(max_retries=10, backoff_base=0.001, backoff_max=0.01))
+            llm_resilience.activate(layer)
+            try:
+                labels = [invoice_label(f"email {n}", [], client=_client(server)) for n in range(10)]
+            finally:
+                llm_resilience.activate(None)
+
+        assert labels == ["invoice"] * 10
+        assert layer.stats.retries == server.stats.errors > 0
+        print(f"{server.stats.errors} injected errors retried")
+
+    def test_requests_per_minute(self):
+        with StandInOpenAI(faults=Faults(requests_per_minute=2)) as server:
+            client = _client(server)
+            invoice_label("one", [], client=client)
+            invoice_label("two", [], client=client)
+            with pytest.raises(RateLimitError) as error:
+                invoice_label("three", [], client=client)
+
+        assert 0 < float(error.value.response.headers["retry-after"]) <= 60
+        assert server.stats.rate_limited == 1
+        print("Third request in a minute answered 429 with Retry-After")
+
+    def test_tokens_per_minute(self):
+        with StandInOpenAI(faults=Faults(tokens_per_minute=1000)) as server:
+            client = _client(server)
+            invoice_label("word " * 300, [], client=client)
+            with pytest.raises(RateLimitError):
+                invoice_label("word " * 300, [], client=client)
+        assert server.stats.rate_limited == 1
+
+    def test_request_over_token_limit_not_retryable(self):
+        with StandInOpenAI(faults=Faults(tokens_per_minute=1000)) as server:
+            with pytest.raises(APIStatusError) as error:
+                invoice_label("word " * 2000, [], client=_client(server))
+
+        assert error.value.status_code == 413
+        assert not llm_resilience.is_retryable(error.value)
+        assert server.stats.rate_limited == 0
+        print("Oversized request rejected outright, even with an empty window")
+
+    def test_latency_injected_per_model(self):
+        slept = []
+        faults = Faults(latency=Latency("fixed", 0.5), model_latency={"gpt-5": Latency("fixed", 3.0)})
+        with StandInOpenAI(faults=faults, sleep=slept.append) as server:
+            client = _client(server)
+            invoice_label("hello", [], client=client)
+            pdf_invoice("invoice", text="Total $50.00", client=client, routing=False)
+
+        assert slept == [0.5, 3.0]
+
+    def test_concurrent_requests_overlap(self):
+        faults = Faults(latency=Latency("fixed", 0.2))
+        with StandInOpenAI(faults=faults) as server:
+            client = AsyncOpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+
+            async def run():
+                limiter = AsyncRateLimiter(max_concurrency=10)
+                return await asyncio.gather(*(invoice_label_async(f"email {n}", [], client=client, limiter=limiter) for n in range(10)))
+
+            started = time.perf_counter()
+            labels = asyncio.run(run())
+            elapsed = time.perf_counter() - started
+
+        assert labels == ["invoice"] * 10
+        assert elapsed < 1.5
+        print(f"10 calls with 0.2s latency took {elapsed:.2f}s")
+
+
+class TestLatency:
+
+    def test_distributions(self):
+        rng = random.Random(1)
+        lognormal = [Latency("lognormal", 2.0, 0.5).sample(rng) for _ in range(2000)]
+        assert statistics.median(lognormal) == pytest.approx(2.0, rel=0.1)
+        assert max(lognormal) > 4.0
+
+        uniform = [Latency("uniform", 1.0, 0.5).sample(rng) for _ in range(500)]
+        assert 0.5 <= min(uniform) and max(uniform) <= 1.5
+
+        exponential = [Latency("exponential", 1.0).sample(rng) for _ in range(2000)]
+        assert statistics.median(exponential) == pytest.approx(1.0, rel=0.15)
+
+    def test_tail_outliers(self):
+        rng = random.Random(2)
+        samples = [Latency("fixed", 1.0, tail_rate=0.1, tail_seconds=30.0).sample(rng) for _ in range(1000)]
+        assert 50 < samples.count(30.0) < 150
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
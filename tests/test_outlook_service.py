@@ -10,8 +10,23 @@ import pytest
 from services.outlook_service import (
     _get_access_token,
     fetch_messages_with_attachments,
+    get_sender,
     MS_GRAPH_BASE_URL,
 )
+from services.attachment_store import attachments_for_message, clear_registry
+
+
+@pytest.fixture(autouse=True)
+def temp_attachment_store(tmp_path):
+    """Redirect the attachment store to a temporary directory for every test."""
+    attachments_dir = tmp_path / "attachments"
+    with patch("services.attachment_store.ATTACHMENTS_DIR", attachments_dir), \
+         patch("services.attachment_store.OBJECTS_DIR", attachments_dir / "objects"), \
+         patch("services.attachment_store.DATA_DIR", tmp_path / "data"), \
+         patch("services.attachment_store.INDEX_FILE", tmp_path / "data" / "attachment_index.json"):
+        clear_registry()
+        yield attachments_dir
+        clear_registry()
 
 
 class TestOutlookAuth:
@@ -176,7 +191,7 @@ class TestFetchMessages:
         assert body_text == "Here is your invoice for March."
         print("Plain text body returned correctly")
 
-    @patch("services.outlook_service.extract_text_from_pdf")
+    @patch("services.attachment_store.extract_text_from_pdf")
     @patch("services.outlook_service._get_access_token", return_value="fake-token")
     @patch("services.outlook_service.httpx.get")
     def test_fetch_message_with_pdf_attachment(self, mock_get, mock_auth, mock_pdf_extract):
@@ -260,6 +275,36 @@ class TestFetchMessages:
         assert content == image_bytes
         print("Image attachment downloaded as binary")
 
+    @patch("services.attachment_store.extract_text_from_pdf")
+    @patch("services.outlook_service._get_access_token", return_value="fake-token")
+    @patch("services.outlook_service.httpx.get")
+    def test_duplicate_pdf_parsed_once_without_disk_writes(self, mock_get, mock_auth, mock_pdf_extract, temp_attachment_store):
+        """Test that the same PDF forwarded twice is parsed once, from memory"""
+        pdf_b64 = base64.b64encode(b"%PDF-1.4 same invoice").decode()
+
+        messages = [
+            {"id": "msg-a", "subject": "Invoice", "body": {"contentType": "text", "content": ""}, "hasAttachments": True},
+            {"id": "msg-b", "subject": "Fwd: Invoice", "body": {"contentType": "text", "content": ""}, "hasAttachments": True},
+        ]
+        attachments_data = [{"name": "invoice.pdf", "contentBytes": pdf_b64, "isInline": False}]
+        mock_pdf_extract.return_value = "Invoice text"
+
+        def side_effect(url, **kwargs):
+            if "/attachments" in url:
+                return self._mock_attachments_response(attachments_data)
+            return self._mock_messages_response(messages)
+
+        mock_get.side_effect = side_effect
+
+        results = list(fetch_messages_with_attachments())
+
+        assert [r[3] for r in results] == [[("invoice.pdf", "Invoice text")]] * 2
+        assert mock_pdf_extract.call_count == 1
+        assert mock_pdf_extract.call_args.args[0] == b"%PDF-1.4 same invoice"
+        assert not temp_attachment_store.exists()
+        assert attachments_for_message("msg-b")[0].data == b"%PDF-1.4 same invoice"
+        print("Forwarded duplicate parsed once with nothing written to disk")
+
     @patch("services.outlook_service._get_access_token", return_value="fake-token")
     @patch("services.outlook_service.httpx.get")
     def test_inline_attachments_are_skipped(self, mock_get, mock_auth):
@@ -296,6 +341,27 @@ class TestFetchMessages:
         assert len(attachments) == 0
         print("Inline attachments correctly skipped")
 
+    @patch("services.outlook_service._get_access_token", return_value="fake-token")
+    @patch("services.outlook_service.httpx.get")
+    def test_sender_recorded_for_classification(self, mock_get, mock_auth):
+        """Test that the sender address is available after fetching"""
+        messages = [
+            {
+                "id": "msg-sender",
+                "subject": "Your package shipped",
+                "body": {"contentType": "text", "content": "On its way"},
+                "hasAttachments": False,
+                "from": {"emailAddress": {"name": "UPS", "address": "mcinfo@ups.com"}},
+            }
+        ]
+        mock_get.return_value = self._mock_messages_response(messages)
+
+        list(fetch_messages_with_attachments())
+
+        assert get_sender("msg-sender") == "mcinfo@ups.com"
+        assert get_sender("unknown") == ""
+        print("Sender address recorded")
+
     @patch("services.outlook_service._get_access_token", return_value="fake-token")
     @patch("services.outlook_service.httpx.get")
     def test_api_error_raises_exception(self, mock_get, mock_auth):
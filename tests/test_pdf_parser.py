@@ -0,0 +1,38 @@
+"""Test suite for PDF text extraction from paths, bytes and streams"""
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.pdf_parser import extract_text_from_pdf, open_file_stream
+
+SAMPLE_PDF = Path(__file__).parent.parent / "attachments" / "2307-271409.pdf"
+
+
+class TestExtractTextFromPdf:
+
+    def test_path_and_bytes_match(self):
+        from_path = extract_text_from_pdf(SAMPLE_PDF)
+        from_bytes = extract_text_from_pdf(SAMPLE_PDF.read_bytes())
+
+        assert from_path
+        assert from_bytes == from_path
+        print("Bytes extraction matches path extraction")
+
+    def test_memory_mapped_stream(self):
+        with patch("parsers.pdf_parser.MMAP_THRESHOLD_BYTES", 1), open_file_stream(SAMPLE_PDF) as stream:
+            assert type(stream).__name__ == "mmap"
+            assert extract_text_from_pdf(stream) == extract_text_from_pdf(SAMPLE_PDF)
+        assert stream.closed
+        print("Memory-mapped PDF extracted correctly and closed")
+
+    def test_small_file_read_into_memory(self):
+        with open_file_stream(SAMPLE_PDF) as stream:
+            assert stream.read(4) == b"%PDF"
+        print("Small file opened as an in-memory buffer")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
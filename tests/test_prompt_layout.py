@@ -0,0 +1,67 @@
+"""Test suite for cache-friendly prompt layout"""
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.ai_parser import invoice_label, log_prompt_cache_usage, pdf_invoice, pdf_invoice_input
+from models.invoice import InvoiceData, InvoiceLine, LabelSort
+
+
+def _client(parsed):
+    client = MagicMock()
+    client.responses.parse.return_value = MagicMock(output_parsed=parsed)
+    return client
+
+
+class TestStablePrefix:
+
+    def test_system_prompt_identical_across_documents(self):
+        first = pdf_invoice_input("Invoice A total $10", "- Smith: 1 Main St")
+        second = pdf_invoice_input("Invoice B total $99", "- Lee: 9 Oak Ave")
+        plain = pdf_invoice_input("Invoice C total $5")
+
+        assert first[0] == second[0] == plain[0]
+        print("System prompt does not depend on the document or customers")
+
+    def test_document_text_comes_last(self):
+        user = pdf_invoice_input("Invoice A total $10", "- Smith: 1 Main St")[1]["content"]
+        assert user.index("- Smith: 1 Main St") < user.index("Invoice A total $10")
+        assert user.endswith("Invoice A total $10")
+        print("Customers precede the per-document text")
+
+    def test_identical_customer_list_gives_identical_prefix(self):
+        customers = "\n".join(f"- Customer {i}: {i} Main St" for i in range(200))
+        first = pdf_invoice_input("Invoice A", customers)[1]["content"]
+        second = pdf_invoice_input("Invoice B", customers)[1]["content"]
+        prefix = first[:first.index("Invoice A")]
+        assert second.startswith(prefix)
+        print(f"{len(prefix)} character prefix shared between documents")
+
+    def test_prompt_cache_key_sent(self):
+        client = _client(LabelSort(label="none"))
+        invoice_label("hello", [], client=client)
+        assert client.responses.parse.call_args.kwargs["prompt_cache_key"] == "invoice_label"
+
+        client = _client(InvoiceData(vendor_display_name="V", line_items=[InvoiceLine(item="x", rate=1.0)]))
+        pdf_invoice("msg", text="text", client=client)
+        assert client.responses.parse.call_args.kwargs["prompt_cache_key"] == "pdf_invoice"
+        print("Calls carry a per-operation prompt_cache_key")
+
+
+class TestCachedTokenLogging:
+
+    def test_share_of_cached_tokens(self):
+        usage = SimpleNamespace(input_tokens=2000, input_tokens_details=SimpleNamespace(cached_tokens=1536))
+        assert log_prompt_cache_usage("pdf_invoice", usage) == pytest.approx(0.768)
+
+    def test_missing_usage(self):
+        assert log_prompt_cache_usage("pdf_invoice", None) is None
+        assert log_prompt_cache_usage("pdf_invoice", MagicMock()) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,227 @@
+"""Test suite for recording and replaying pipeline runs"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import httpx
+import pytest
+import requests
+from openai import AsyncOpenAI, OpenAI
+import benchmark
+from parsers.ai_parser import invoice_label, invoice_label_batch
+from parsers.async_ai_parser import invoice_label_async
+from services import notion_service, tracker
+from services.outlook_service import MS_GRAPH_BASE_URL
+from services.openai_standin import StandInOpenAI
+from services.recorder import (
+    STATE_DIR,
+    Interaction,
+    Recorder,
+    Replayer,
+    StageTimer,
+    isolated_state,
+    load_corpus,
+    save_corpus,
+    stage_for,
+)
+
+NOTION_QUERY = "https://api.notion.com/v1/databases/db-1/query"
+
+
+def _interaction(method, url, body, status=200, elapsed=0.0, **fields):
+    return Interaction(method=method, url=url, digest="", status=status, body=json.dumps(body).encode(),
+                       elapsed=elapsed, stage=stage_for(url), headers={"content-type": "application/json"}, **fields)
+
+
+def _recorded_label(prompt="Invoice attached"):
+    """A real LabelSort exchange with the stand-in, and its base URL"""
+    with StandInOpenAI() as server, Recorder() as recorder:
+        invoice_label(prompt, [], client=OpenAI(base_url=server.base_url, api_key="test", max_retries=0))
+    return recorder.interactions, server.base_url
+
+
+class TestRecorder:
+
+    def test_records_and_replays_without_the_server(self):
+        interactions, base_url = _recorded_label()
+        assert len(interactions) == 1
+        assert interactions[0].stage == "openai" and interactions[0].schema == "LabelSort"
+
+        # The stand-in is gone; the same request is answered from the recording
+        with Replayer(interactions, speed=0) as replayer:
+            label = invoice_label("Invoice attached", [], client=OpenAI(base_url=base_url, api_key="test", max_retries=0))
+        assert label == "invoice"
+        assert replayer.counts["exact"] == 1
+        print("LabelSort call replayed offline")
+
+    def test_auth_hosts_not_recorded(self):
+        recorder = Recorder()
+        recorder._keep("POST", "https://login.microsoftonline.com/common/oauth2/v2.0/token", b"secret", 200, {}, b"{}", 0.0, 1.0)
+        assert recorder.interactions == []
+        assert recorder.timer.samples["auth"] == [1.0]
+
+    def test_corpus_round_trip(self, tmp_path):
+        binary = Interaction("GET", f"{MS_GRAPH_BASE_URL}/me/messages/1/attachments", "d", 200, b"%PDF\x00\xff", 0.25, "outlook")
+        save_corpus(tmp_path, [binary], {"messages": 1})
+        manifest, interactions = load_corpus(tmp_path)
+        assert manifest == {"messages": 1}
+        assert interactions == [binary]
+
+    def test_hooks_removed_on_exit(self):
+        originals = (httpx.Client.send, httpx.AsyncClient.send, requests.Session.send)
+        with Replayer([], speed=0):
+            assert httpx.Client.send is not originals[0]
+        assert (httpx.Client.send, httpx.AsyncClient.send, requests.Session.send) == originals
+        print("Original send methods restored")
+
+    def test_missing_corpus(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            load_corpus(tmp_path)
+
+
+class TestReplayer:
+
+    def test_httpx_and_requests_answered(self):
+        corpus = [
+            _interaction("GET", f"{MS_GRAPH_BASE_URL}/me/messages", {"value": [{"id": "m1"}]}),
+            _interaction("POST", NOTION_QUERY, {"results": []}),
+        ]
+        with Replayer(corpus, speed=0) as replayer:
+            messages = httpx.get(f"{MS_GRAPH_BASE_URL}/me/messages").json()
+            notion = requests.post(NOTION_QUERY, json={"filter": {}})
+        assert messages == {"value": [{"id": "m1"}]}
+        assert notion.status_code == 200 and notion.json() == {"results": []}
+        assert replayer.counts["url"] == 2
+        assert set(replayer.timer.samples) == {"outlook", "notion"}
+
+    def test_unrecorded_request_is_a_404(self):
+        with Replayer([], speed=0) as replayer:
+            response = httpx.get("https://graph.microsoft.com/v1.0/me/messages/unknown")
+        assert response.status_code == 404
+        assert replayer.counts["missed"] == 1
+
+    def test_changed_prompt_matched_by_schema(self):
+        interactions, base_url = _recorded_label("Invoice attached")
+        with Replayer(interactions, speed=0) as replayer:
+            label = invoice_label("A different email", [], client=OpenAI(base_url=base_url, api_key="test", max_retries=0))
+        assert label == "invoice"
+        assert replayer.counts["schema"] == 1
+
+    def test_recordings_used_in_order_then_last_reused(self):
+        corpus = [
+            _interaction("GET", NOTION_QUERY, {"page": 1}),
+            _interaction("GET", NOTION_QUERY, {"page": 2}),
+        ]
+        with Replayer(corpus, speed=0):
+            pages = [requests.get(NOTION_QUERY).json()["page"] for _ in range(3)]
+        assert pages == [1, 2, 2]
+
+    def test_latency_scaled_by_speed(self):
+        corpus = [_interaction("GET", NOTION_QUERY, {}, elapsed=2.0)]
+        slept = []
+        with Replayer(corpus, speed=4, sleep=slept.append):
+            requests.get(NOTION_QUERY)
+        with Replayer(corpus, speed=0, sleep=slept.append):
+            requests.get(NOTION_QUERY)
+        assert slept == [0.5]
+
+    def test_async_client_replayed(self):
+        interactions, base_url = _recorded_label()
+        client = AsyncOpenAI(base_url=base_url, api_key="test", max_retries=0)
+        with Replayer(interactions, speed=0) as replayer:
+            assert asyncio.run(invoice_label_async("Invoice attached", [], client=client)) == "invoice"
+        assert replayer.counts["exact"] == 1
+
+
+class TestStageTimer:
+
+    def test_overlapping_requests_counted_once(self):
+        timer = StageTimer()
+        timer.add("openai", 0.0, 2.0)
+        timer.add("openai", 1.0, 3.0)
+        timer.add("notion", 5.0, 6.0)
+        assert timer.busy_seconds() == 4.0
+        summary = timer.summary()
+        assert summary["openai"]["calls"] == 2 and summary["openai"]["total"] == 4.0
+
+
+class TestIsolatedState:
+
+    def test_state_copied_in_and_writes_kept_out(self, tmp_path):
+        snapshot = tmp_path / "snapshot"
+        snapshot.mkdir()
+        (snapshot / "processed_emails.json").write_text('["old"]')
+        real_file = tracker.TRACKER_FILE
+
+        with isolated_state(tmp_path / "workspace", snapshot):
+            assert tracker.load_processed_ids() == {"old"}
+            tracker.mark_processed("new")
+
+        assert tracker.TRACKER_FILE == real_file
+        assert json.loads((tmp_path / "workspace" / "data" / "processed_emails.json").read_text()) == ["new", "old"]
+
+
+class TestBenchmark:
+
+    def _corpus(self, path):
+        """Two plain emails: one Graph listing, a batch label call and two categories"""
+        emails = [("Please see the attached quote", []), ("Quote for the kitchen job", [])]
+        with StandInOpenAI() as server, Recorder() as recorder:
+            invoice_label_batch(emails, client=OpenAI(base_url=server.base_url, api_key="test", max_retries=0))
+        listing = httpx.Request("GET", f"{MS_GRAPH_BASE_URL}/me/messages", params={
+            "$top": 10,
+            "$select": "id,subject,body,hasAttachments,from",
+            "$orderby": "receivedDateTime desc",
+        })
+        messages = [
+            {"id": f"m{n}", "subject": "Quote", "body": {"content": text, "contentType": "text"}, "hasAttachments": False}
+            for n, (text, _) in enumerate(emails)
+        ]
+        interactions = [_interaction("GET", str(listing.url), {"value": messages}, elapsed=0.1)]
+        interactions += recorder.interactions
+        interactions += [_interaction("PATCH", f"{MS_GRAPH_BASE_URL}/me/messages/m{n}", {}, elapsed=0.05) for n in range(2)]
+        save_corpus(path, interactions, {"environment": {"OPENAI_BASE_URL": server.base_url}})
+        (path / STATE_DIR).mkdir()
+
+    def test_replay_main_offline(self, tmp_path):
+        self._corpus(tmp_path)
+        report = benchmark.replay(tmp_path, speed=0, repeat=2)
+
+        assert report["messages"] == 4 and report["processed"] == 4
+        assert report["replay"]["missed"] == 0
+        assert report["stages"]["outlook"]["calls"] == 6
+        assert report["stages"]["openai"]["calls"] == 2
+        assert report["messages_per_second"] > 0 and report["peak_rss_mb"] > 0
+        print(benchmark.format_report(report))
+
+    def test_record_refuses_live_pushes(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(notion_service, "NOTION_API_KEY", "secret")
+        for name in benchmark.NOTION_DB_SETTINGS:
+            monkeypatch.delenv(name, raising=False)
+        monkeypatch.setenv("REFRESH_TOKEN", "token")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+
+        with pytest.raises(RuntimeError, match="QuickBooks"):
+            benchmark.record(tmp_path)
+        assert not (tmp_path / STATE_DIR).exists()
+
+        monkeypatch.setenv("ENVIRONMENT", "sandbox")
+        for name in benchmark.NOTION_DB_SETTINGS:
+            monkeypatch.setenv(name, "test-db")
+        assert benchmark.live_push_targets() == []
+        print("Recording blocked until pushes go to sandboxes")
+
+    def test_compare_with_baseline(self, tmp_path):
+        self._corpus(tmp_path)
+        baseline = benchmark.replay(tmp_path, speed=0)
+        report = benchmark.replay(tmp_path, speed=0)
+        comparison = benchmark.compare_reports(report, baseline)
+        assert "messages/sec" in comparison and "openai p95 s" in comparison
+        print(comparison)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,140 @@
+"""Test suite for the rule-based pre-classifier"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.rule_classifier import (
+    RuleStats,
+    find_tracking_numbers,
+    preclassify,
+    sender_domain,
+)
+
+
+class TestHighConfidenceRules:
+
+    def test_buildertrend_sender_is_none(self):
+        match = preclassify("New activity on your job", [], subject="Daily log", sender="alerts@buildertrend.com")
+        assert match.label == "none"
+        print("BuilderTrend sender labelled none")
+
+    def test_buildertrend_invoice_notification_is_none(self):
+        match = preclassify("Boris Jovanov created a $1,250.00 invoice for Smith Remodel", [], subject="Job update")
+        assert match.label == "none"
+        print("BuilderTrend notification labelled none")
+
+    def test_ups_tracking_email_is_shipping(self):
+        match = preclassify(
+            "Your package has shipped. Tracking number: 1Z999AA10123456784",
+            [],
+            subject="Your order is on the way",
+            sender="orders@supplier.com",
+        )
+        assert match.label == "shipping"
+        assert "1Z999AA10123456784" in match.reason
+        print("UPS tracking email labelled shipping")
+
+    def test_carrier_sender_is_shipping(self):
+        match = preclassify("Out for delivery today", [], subject="Delivery update", sender="mcinfo@ups.com")
+        assert match.label == "shipping"
+        print("Carrier sender labelled shipping")
+
+    def test_invoice_subject_with_invoice_pdf(self):
+        match = preclassify(
+            "Please see attached.",
+            [("Invoice_4471.pdf", "Lumber 2x4 ... Total $250.00")],
+            subject="Invoice #4471 from ABC Supply",
+            sender="billing@abcsupply.com",
+        )
+        assert match.label == "invoice"
+        print("Invoice email with invoice PDF labelled invoice")
+
+    def test_certificate_of_insurance(self):
+        match = preclassify("Attached is the COI you requested.", [], subject="Certificate of Insurance - Smith job")
+        assert match.label == "insurance"
+        print("COI labelled insurance")
+
+    def test_newsletter_without_attachments(self):
+        match = preclassify("Spring sale! 20% off. Click here to unsubscribe.", [], subject="Big savings", sender="news@store.com")
+        assert match.label == "none"
+        print("Newsletter labelled none")
+
+
+class TestAmbiguousGoesToModel:
+
+    def test_plain_client_email(self):
+        assert preclassify("Can we move the walkthrough to Friday?", [], subject="Walkthrough", sender="client@gmail.com") is None
+        print("Ordinary client email left to the model")
+
+    def test_invoice_mentioning_tracking_number(self):
+        match = preclassify(
+            "Invoice attached. Shipped via UPS tracking 1Z999AA10123456784",
+            [("Invoice_88.pdf", "...")],
+            subject="Invoice 88",
+        )
+        assert match.label == "invoice"
+        print("Invoice subject wins over tracking number in body")
+
+    def test_conflicting_rules_defer(self):
+        match = preclassify(
+            "Invoice attached",
+            [("invoice.pdf", "...")],
+            subject="Invoice for policy renewal",
+        )
+        assert match is None
+        print("Conflicting rules defer to the model")
+
+    def test_carrier_sender_with_pdf_defers(self):
+        # UPS bills arrive from ups.com with a PDF attached
+        assert preclassify("Your UPS bill is ready", [("statement.pdf", "...")], subject="Billing", sender="billing@ups.com") is None
+        print("Carrier email with a document left to the model")
+
+    def test_carrier_billing_mail_defers(self):
+        assert preclassify("Your weekly charges are ready to view online.", [], subject="Your FedEx invoice", sender="billing@fedex.com") is None
+        print("Carrier billing mail without a document left to the model")
+
+    def test_billing_filename_not_an_invoice(self):
+        attachments = [("billing_dispute.pdf", "...")]
+        assert preclassify("See attached.", attachments, subject="Invoice #4471 dispute", sender="ap@abcsupply.com") is None
+        match = preclassify("See attached.", [("bill_4471.pdf", "...")], subject="Invoice #4471", sender="ap@abcsupply.com")
+        assert match.label == "invoice"
+
+
+class TestHelpers:
+
+    def test_sender_domain(self):
+        assert sender_domain("Jane <jane@Mail.Example.com>") == "mail.example.com"
+        assert sender_domain("") == ""
+        assert sender_domain(None) == ""
+
+    def test_find_tracking_numbers(self):
+        found = find_tracking_numbers("UPS 1Z999AA10123456784, USPS 9400111899223197428490, FedEx tracking 123456789012")
+        carriers = {carrier for carrier, _ in found}
+        assert carriers == {"UPS", "USPS", "FedEx"}
+
+    def test_usps_formats_match_shipping_extractor(self):
+        text = "USPS 9100111899223197428490 and 92612999897543581234567890"
+        assert find_tracking_numbers(text) == [
+            ("USPS", "9100111899223197428490"),
+            ("USPS", "92612999897543581234567890"),
+        ]
+        print("91-prefix and 26-digit USPS numbers recognised")
+
+    def test_bare_digits_not_fedex(self):
+        assert find_tracking_numbers("Order 123456789012 confirmed") == []
+
+    def test_stats_share(self):
+        stats = RuleStats()
+        stats.record(preclassify("x", [], sender="a@buildertrend.com"))
+        stats.record(None)
+        stats.record(None)
+        stats.record(preclassify("Tracking 1Z999AA10123456784 shipped", []))
+        assert stats.rule_labelled == 2
+        assert stats.avoided_share == 0.5
+        assert "50%" in stats.summary()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,124 @@
+"""Test suite for the local carrier tracking-number extractor"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.shipping_extractor import extract_shipping, parse_date
+from parsers.tracking_numbers import (
+    fedex_express_valid,
+    find_valid_tracking_numbers,
+    mod10_check_digit,
+    s10_valid,
+    ups_check_digit_valid,
+)
+
+UPS_NUMBER = "1Z999AA10123456784"
+FEDEX_NUMBER = "123456789012"
+USPS_BODY = "940011189922319742849"
+USPS_NUMBER = USPS_BODY + str(mod10_check_digit(USPS_BODY))
+
+
+class TestCheckDigits:
+
+    def test_ups(self):
+        assert ups_check_digit_valid(UPS_NUMBER)
+        assert not ups_check_digit_valid("1Z999AA10123456785")
+        print("UPS check digit verified")
+
+    def test_fedex_express(self):
+        assert fedex_express_valid(FEDEX_NUMBER)
+        assert not fedex_express_valid("123456789013")
+        print("FedEx 12-digit check digit verified")
+
+    def test_usps(self):
+        assert len(USPS_NUMBER) == 22
+        assert find_valid_tracking_numbers(f"Tracking {USPS_NUMBER}") == [("USPS", USPS_NUMBER)]
+        broken = USPS_NUMBER[:-1] + str((int(USPS_NUMBER[-1]) + 1) % 10)
+        assert find_valid_tracking_numbers(f"Tracking {broken}") == []
+        assert s10_valid("RA123456785US")
+        assert not s10_valid("RA123456784US")
+        print("USPS IMpb and S10 check digits verified")
+
+
+class TestParseDate:
+
+    @pytest.mark.parametrize("value, expected", [
+        ("03/14/2026", "03/14/2026"),
+        ("3/4/26", "03/04/2026"),
+        ("2026-03-14", "03/14/2026"),
+        ("March 14th, 2026", "03/14/2026"),
+        ("Sept 14, 2026", "09/14/2026"),
+        ("Mar. 3, 2026", "03/03/2026"),
+    ])
+    def test_formats(self, value, expected):
+        assert parse_date(value) == expected
+
+    def test_unparseable(self):
+        assert parse_date("tomorrow") is None
+
+
+class TestExtractShipping:
+
+    def test_ups_notification_is_confident(self):
+        result = extract_shipping(
+            f"Your package is out for delivery.\nTracking Number: {UPS_NUMBER}\n"
+            "Scheduled Delivery: Friday, March 14, 2026\nShipped on 03/12/2026\nOrder #HD-55821",
+            subject="UPS Update: Out for delivery",
+            sender="mcinfo@ups.com",
+        )
+
+        data = result.data
+        assert (data.carrier, data.tracking_number) == ("UPS", UPS_NUMBER)
+        assert data.delivery_status == "out for delivery"
+        assert (data.estimated_delivery, data.shipment_date) == ("03/14/2026", "03/12/2026")
+        assert data.order_number == "HD-55821"
+        assert result.confident
+        print(f"UPS notification read locally: {result.reasons}")
+
+    def test_fedex_delivered(self):
+        result = extract_shipping(f"Your FedEx package {FEDEX_NUMBER} was delivered on Mar 3, 2026.")
+
+        assert (result.data.carrier, result.data.delivery_status) == ("FedEx", "delivered")
+        assert result.data.estimated_delivery == "03/03/2026"
+        assert result.confident
+        print("FedEx delivery read locally")
+
+    def test_bare_twelve_digits_need_fedex_mention(self):
+        result = extract_shipping(f"Your order {FEDEX_NUMBER} has shipped")
+        assert result.data.tracking_number is None
+        assert not result.confident
+        print("12-digit number without FedEx context ignored")
+
+    def test_invalid_check_digit_is_not_a_tracking_number(self):
+        result = extract_shipping("UPS tracking 1Z999AA10123456785 is in transit")
+        assert result.data.tracking_number is None
+        assert not result.confident
+        print("Number failing its check digit ignored")
+
+    def test_future_delivery_is_not_delivered(self):
+        result = extract_shipping(f"Your order has shipped and will be delivered soon. UPS {UPS_NUMBER}")
+        assert result.data.delivery_status == "shipped"
+        print("'will be delivered' not taken as delivered")
+
+    def test_tracking_in_text_attachment(self):
+        result = extract_shipping("See attached packing slip", [("slip.txt", f"UPS {UPS_NUMBER} shipped")])
+        assert result.data.tracking_number == UPS_NUMBER
+        print("Tracking number found in attachment text")
+
+    def test_extra_tracking_numbers_noted(self):
+        second = "1Z12345E6605272234"
+        result = extract_shipping(f"Your UPS shipment is in transit: {UPS_NUMBER} and {second}")
+        assert result.data.tracking_number == UPS_NUMBER
+        assert second in result.data.notes
+        print("Additional tracking numbers kept in notes")
+
+    def test_vague_email_falls_back_to_llm(self):
+        result = extract_shipping("Your freight will arrive next week, the driver will call ahead.")
+        assert not result.confident
+        print(f"Low confidence ({result.confidence}) leaves it to parse_shipping")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,98 @@
+"""Test suite for text-PDF page relevance scoring and selection"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.page_selection import score_page_text, select_text_pages
+from parsers.pdf_parser import extract_pages_from_pdf, extract_text_from_pdf
+
+SAMPLE_PDF = Path(__file__).parent.parent / "attachments" / "2307-271409.pdf"
+
+INVOICE_PAGE = (
+    "ABC Supply Co. INVOICE\n"
+    "Invoice #: INV-1001 Date: 03/14/2026 Due Date: 04/13/2026\n"
+    "Bill To: Cape Property Pros\n"
+    "Description Qty Unit Price Amount\n"
+    + "\n".join(f"Shingles bundle {n} 10 45.00 450.00" for n in range(20))
+    + "\nSubtotal 9,000.00\nTax 562.50\nTotal Due 9,562.50\n"
+)
+
+TERMS_PAGE = (
+    "Terms and Conditions\n"
+    + "\n".join(
+        "Claims for shortages or damage must be made within ten days of receipt of goods. "
+        "Special orders cannot be returned. Goods remain the property of the seller until settled."
+        for _ in range(40)
+    )
+)
+
+MARKETING_PAGE = "Spring sale! Visit our showroom for new kitchen displays and free design consultations.\n" * 30
+
+REMITTANCE_PAGE = "Please detach and return with payment\nInvoice # INV-1001\nAmount Due $9,562.50\n"
+
+
+class TestScorePageText:
+
+    def test_invoice_page_beats_terms_and_marketing(self):
+        invoice = score_page_text(INVOICE_PAGE)
+        assert invoice > score_page_text(TERMS_PAGE)
+        assert invoice > score_page_text(MARKETING_PAGE)
+        assert score_page_text(MARKETING_PAGE) == 0
+        print(f"Invoice page scored {invoice:.2f}")
+
+    def test_blank_page_scores_zero(self):
+        assert score_page_text("") == 0
+        assert score_page_text("   \n  ") == 0
+
+
+class TestSelectTextPages:
+
+    def test_short_document_sent_whole(self):
+        assert select_text_pages([INVOICE_PAGE, MARKETING_PAGE], token_budget=100000) == [0, 1]
+        print("Document within budget sent whole")
+
+    def test_long_document_keeps_invoice_pages(self):
+        pages = [INVOICE_PAGE, TERMS_PAGE, MARKETING_PAGE, REMITTANCE_PAGE, TERMS_PAGE]
+        selected = select_text_pages(pages, token_budget=1000)
+
+        assert selected == [0, 3]
+        print(f"Selected pages {selected}")
+
+    def test_first_page_always_kept(self):
+        pages = [MARKETING_PAGE, INVOICE_PAGE, TERMS_PAGE]
+        selected = select_text_pages(pages, token_budget=1000)
+        assert selected[0] == 0 and 1 in selected
+        print("Cover page kept for vendor and invoice details")
+
+    def test_budget_respected(self):
+        pages = [INVOICE_PAGE, REMITTANCE_PAGE, TERMS_PAGE, REMITTANCE_PAGE]
+        selected = select_text_pages(pages, token_budget=700)
+        assert selected == [0, 1, 3]
+        print(f"{len(selected)} of {len(pages)} pages fit the budget")
+
+    def test_line_item_pages_never_dropped(self):
+        items = "Description Qty Unit Price Amount\n" + "\n".join(f"2x4 stud {n} 12 5.00 60.00" for n in range(60))
+        pages = [INVOICE_PAGE] + [items] * 9 + [TERMS_PAGE]
+        selected = select_text_pages(pages, token_budget=4000)
+        assert selected == list(range(10))
+        print(f"Kept every item page: {selected}")
+
+    def test_item_pages_over_budget_not_trimmed(self):
+        pages = [REMITTANCE_PAGE] + [INVOICE_PAGE] * 5
+        assert select_text_pages(pages, token_budget=1000) is None
+        print("Over-budget line items left for chunked extraction")
+
+
+class TestExtractPages:
+
+    def test_pages_join_to_full_text(self):
+        pages = extract_pages_from_pdf(SAMPLE_PDF)
+        assert len(pages) == 1
+        assert "\n".join(pages) == extract_text_from_pdf(SAMPLE_PDF)
+        print("Per-page text matches the flattened text")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,117 @@
+"""Test suite for learned per-vendor invoice templates"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from parsers.vendor_templates import TemplateStore
+from models.invoice import InvoiceData, InvoiceLine
+
+
+def _document(number, date, items, tax=0.0, street="114 Maple Ave"):
+    subtotal = sum(quantity * rate for _, quantity, rate in items)
+    rows = "\n".join(f"{item}   {quantity:g}   {rate:,.2f}   {quantity * rate:,.2f}" for item, quantity, rate in items)
+    return (
+        "ABC Supply Co.\n"
+        "1200 Industrial Pkwy, Springfield IL 62701\n"
+        "INVOICE\n"
+        f"Invoice #: {number}    Date: {date}\n"
+        "Job Site:\n"
+        f"{street}\n"
+        "Description   Qty   Price   Amount\n"
+        f"{rows}\n"
+        f"Subtotal {subtotal:,.2f}\n"
+        f"Tax {tax:,.2f}\n"
+        f"Total Due {subtotal + tax:,.2f}\n"
+        "Thank you for your business. Terms net 30.\n"
+    )
+
+
+def _verified(number, date, items, tax=0.0, **overrides):
+    fields = dict(
+        vendor_display_name="ABC Supply",
+        line_items=[InvoiceLine(item=item, quantity=quantity, rate=rate, category="Materials") for item, quantity, rate in items],
+        tax=tax,
+        total_amount=sum(quantity * rate for _, quantity, rate in items) + tax,
+        invoice_number=number,
+        invoice_date=date,
+    )
+    fields.update(overrides)
+    return InvoiceData(**fields)
+
+
+FIRST = [("Shingles bundle", 10, 45.0), ("Roofing nails 5lb", 2, 12.5)]
+SECOND = [("Ridge vent", 3, 20.0), ("Drip edge", 12, 8.25), ("Underlayment roll", 4, 60.0)]
+THIRD = [("Step flashing", 5, 9.0), ("Roof cement", 2, 14.75)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TemplateStore(path=tmp_path / "vendor_templates.json")
+
+
+@pytest.fixture
+def trusted(store):
+    store.learn(_document("INV-1001", "03/14/2026", FIRST, tax=38.0), _verified("INV-1001", "03/14/2026", FIRST, tax=38.0, job_site_address="114 Maple Ave, Springfield IL"))
+    store.learn(_document("INV-1002", "3/20/2026", SECOND, tax=10.0, street="9 Oak Ct"), _verified("INV-1002", "03/20/2026", SECOND, tax=10.0))
+    return store
+
+
+class TestLearning:
+
+    def test_template_learned_from_verified_extraction(self, store):
+        assert store.learn(_document("INV-1001", "03/14/2026", FIRST, tax=38.0), _verified("INV-1001", "03/14/2026", FIRST, tax=38.0))
+
+        template = store.templates["abc supply"]
+        assert template["table"]["columns"] == {"amount": -1, "rate": -2, "quantity": -3}
+        assert template["table"]["header"] == "description qty price amount"
+        assert template["table"]["end"] == "subtotal"
+        assert template["anchors"]["total_amount"]["label"] == "Total Due"
+        print(f"Learned anchors: {sorted(template['anchors'])}")
+
+    def test_unverified_extraction_not_learned(self, store):
+        wrong_total = _verified("INV-1001", "03/14/2026", FIRST, tax=38.0, total_amount=999.0)
+        assert not store.learn(_document("INV-1001", "03/14/2026", FIRST, tax=38.0), wrong_total)
+        assert store.templates == {}
+        print("Extraction failing check_invoice not learned")
+
+    def test_single_sample_not_trusted(self, store):
+        store.learn(_document("INV-1001", "03/14/2026", FIRST, tax=38.0), _verified("INV-1001", "03/14/2026", FIRST, tax=38.0))
+        assert store.extract(_document("INV-1003", "04/01/2026", THIRD)) is None
+        print("Template not used until confirmed on a second invoice")
+
+    def test_templates_persist(self, trusted, tmp_path):
+        reloaded = TemplateStore(path=tmp_path / "vendor_templates.json")
+        assert reloaded.templates["abc supply"]["samples"] == 2
+        print("Templates saved to disk")
+
+
+class TestExtraction:
+
+    def test_repeat_invoice_extracted_locally(self, trusted):
+        draft = trusted.extract(_document("INV-1003", "04/01/2026", THIRD, tax=3.0, street="77 Elm St"))
+
+        assert draft.vendor_display_name == "ABC Supply"
+        assert draft.invoice_number == "INV-1003"
+        assert draft.invoice_date == "04/01/2026"
+        assert [(line.item, line.quantity, line.rate) for line in draft.line_items] == [("Step flashing", 5, 9.0), ("Roof cement", 2, 14.75)]
+        assert draft.total_amount == pytest.approx(77.5)
+        assert draft.tax == 3.0
+        assert draft.job_site_address == "77 Elm St"
+        assert all(line.category == "Materials" for line in draft.line_items)
+        print(f"Extracted without the model: {draft}")
+
+    def test_total_mismatch_falls_back(self, trusted):
+        text = _document("INV-1004", "04/02/2026", THIRD).replace("Total Due 74.50", "Total Due 99.00")
+        assert trusted.extract(text) is None
+        print("Totals not adding up sends the invoice to the model")
+
+    def test_other_vendor_not_matched(self, trusted):
+        text = "Lumber Yard LLC\nStatement\nItem Qty Each Total\n2x4 stud 10 4.00 40.00\nBalance 40.00\n"
+        assert trusted.extract(text) is None
+        print("Unrelated layout not matched")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,175 @@
+"""Test suite for inline vision images and the uploaded file-ID cache"""
+import sys
+import asyncio
+import json
+import time
+from pathlib import Path
+from unittest.mock import patch, AsyncMock, MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import httpx
+import pytest
+from openai import NotFoundError
+from PIL import Image
+from services.vision_files import (
+    cleanup_stale_uploads,
+    content_hash,
+    load_index,
+    upload_vision_file,
+    upload_vision_file_async,
+)
+from parsers.ai_parser import ai_invoice
+from models.invoice import InvoiceData, InvoiceLine
+
+
+@pytest.fixture(autouse=True)
+def temp_index(tmp_path):
+    """Redirect the upload index to a temporary directory for every test."""
+    fake_file = tmp_path / "vision_files.json"
+    with patch("services.vision_files.INDEX_FILE", fake_file), \
+         patch("services.vision_files.DATA_DIR", tmp_path):
+        yield fake_file
+
+
+def _make_mock_client():
+    mock_client = MagicMock()
+    mock_client.files.create.side_effect = [MagicMock(id=f"file-{i}") for i in range(10)]
+    mock_response = MagicMock()
+    mock_response.output_parsed = InvoiceData(
+        vendor_display_name="Lumber Yard",
+        line_items=[InvoiceLine(item="2x4", rate=5.0, quantity=4)],
+        total_amount=20.0,
+    )
+    mock_client.responses.parse.return_value = mock_response
+    return mock_client
+
+
+def _not_found(file_id):
+    request = httpx.Request("GET", f"https://api.openai.com/v1/files/{file_id}")
+    return NotFoundError("gone", response=httpx.Response(404, request=request), body=None)
+
+
+class TestUploadVisionFile:
+
+    def test_first_upload_is_recorded(self, temp_index):
+        client = _make_mock_client()
+        file_id = upload_vision_file(client, "r.jpg", b"image-bytes", "image/jpeg")
+
+        assert file_id == "file-0"
+        index = json.loads(temp_index.read_text())
+        assert index[content_hash(b"image-bytes")]["file_id"] == "file-0"
+        print("Upload recorded in the index")
+
+    def test_same_bytes_never_uploaded_twice(self, temp_index):
+        client = _make_mock_client()
+        first = upload_vision_file(client, "r.jpg", b"image-bytes", "image/jpeg")
+        second = upload_vision_file(client, "copy.jpg", b"image-bytes", "image/jpeg")
+
+        assert first == second
+        assert client.files.create.call_count == 1
+        print("Identical content reuses the cached file ID")
+
+    def test_different_bytes_uploaded_separately(self, temp_index):
+        client = _make_mock_client()
+        upload_vision_file(client, "a.jpg", b"aaa", "image/jpeg")
+        upload_vision_file(client, "b.jpg", b"bbb", "image/jpeg")
+        assert client.files.create.call_count == 2
+        print("Different content gets its own upload")
+
+    def test_deleted_remote_file_uploaded_again(self, temp_index):
+        client = _make_mock_client()
+        upload_vision_file(client, "r.jpg", b"image-bytes", "image/jpeg")
+        client.files.retrieve.side_effect = _not_found("file-0")
+
+        file_id = upload_vision_file(client, "r.jpg", b"image-bytes", "image/jpeg")
+
+        assert file_id == "file-1"
+        assert client.files.create.call_count == 2
+        assert load_index()[content_hash(b"image-bytes")]["file_id"] == "file-1"
+        print("Missing remote file re-uploaded and cache entry replaced")
+
+    def test_deleted_remote_file_uploaded_again_async(self, temp_index):
+        upload_vision_file(_make_mock_client(), "r.jpg", b"image-bytes", "image/jpeg")
+        client = MagicMock()
+        client.files.retrieve = AsyncMock(side_effect=_not_found("file-0"))
+        client.files.create = AsyncMock(return_value=MagicMock(id="file-9"))
+
+        file_id = asyncio.run(upload_vision_file_async(client, "r.jpg", b"image-bytes", "image/jpeg"))
+
+        assert file_id == "file-9"
+        assert load_index()[content_hash(b"image-bytes")]["file_id"] == "file-9"
+        print("Async upload replaces a missing cached file")
+
+
+class TestCleanupStaleUploads:
+
+    def _seed(self, temp_index, ages_days):
+        now = time.time()
+        index = {
+            f"hash-{i}": {"file_id": f"file-{i}", "filename": "x.jpg", "uploaded_at": now - age * 86400}
+            for i, age in enumerate(ages_days)
+        }
+        temp_index.write_text(json.dumps(index))
+
+    def test_old_uploads_deleted(self, temp_index):
+        self._seed(temp_index, [30, 1])
+        client = MagicMock()
+
+        removed = cleanup_stale_uploads(client, max_age_days=7)
+
+        assert removed == 1
+        client.files.delete.assert_called_once_with("file-0")
+        assert list(load_index()) == ["hash-1"]
+        print("Stale upload deleted, fresh one kept")
+
+    def test_already_deleted_file_is_forgotten(self, temp_index):
+        self._seed(temp_index, [30])
+        client = MagicMock()
+        client.files.delete.side_effect = _not_found("file-0")
+
+        assert cleanup_stale_uploads(client, max_age_days=7) == 1
+        assert load_index() == {}
+        print("Missing remote file removed from index")
+
+    def test_failed_delete_kept_for_next_run(self, temp_index):
+        self._seed(temp_index, [30])
+        client = MagicMock()
+        client.files.delete.side_effect = RuntimeError("network down")
+
+        assert cleanup_stale_uploads(client, max_age_days=7) == 0
+        assert "hash-0" in load_index()
+        print("Failed delete retried on a later run")
+
+
+class TestAiInvoiceImageMode:
+
+    def _image(self, tmp_path, name="receipt.png"):
+        path = tmp_path / name
+        Image.new("RGB", (600, 800), "white").save(path)
+        return str(path)
+
+    def test_small_image_sent_inline(self, tmp_path):
+        client = _make_mock_client()
+        ai_invoice("receipt", file_path=self._image(tmp_path), client=client)
+
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        assert content[1]["image_url"].startswith("data:image/jpeg;base64,")
+        client.files.create.assert_not_called()
+        print("Small image sent inline without an upload")
+
+    def test_large_image_uploaded_once(self, tmp_path):
+        client = _make_mock_client()
+        path = self._image(tmp_path)
+
+        ai_invoice("receipt", file_path=path, client=client, inline_max_bytes=0)
+        ai_invoice("receipt again", file_path=path, client=client, inline_max_bytes=0)
+
+        assert client.files.create.call_count == 1
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        assert content[1]["file_id"] == "file-0"
+        print("Re-processing the same receipt reuses the upload")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,140 @@
+"""Test suite for multi-page vision extraction and page selection"""
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+from PIL import Image, ImageDraw
+from parsers.ai_parser import ai_invoice
+from parsers.page_selection import score_page_image, select_invoice_pages
+from models.invoice import InvoiceData, InvoiceLine
+
+
+def _blank_page(path):
+    Image.new("RGB", (850, 1100), "white").save(path)
+    return str(path)
+
+
+def _text_page(path, lines=6):
+    img = Image.new("RGB", (850, 1100), "white")
+    draw = ImageDraw.Draw(img)
+    for row in range(lines):
+        y = 100 + row * 40
+        draw.rectangle([80, y, 500, y + 12], fill="black")
+    img.save(path)
+    return str(path)
+
+
+def _table_page(path, rows=12):
+    img = Image.new("RGB", (850, 1100), "white")
+    draw = ImageDraw.Draw(img)
+    for row in range(rows):
+        y = 150 + row * 50
+        draw.line([40, y, 810, y], fill="black", width=3)
+        draw.rectangle([60, y + 15, 400, y + 27], fill="black")
+        draw.rectangle([600, y + 15, 780, y + 27], fill="black")
+    img.save(path)
+    return str(path)
+
+
+class TestPageScoring:
+    """Test the cheap per-page relevance score"""
+
+    def test_blank_page_scores_zero(self, tmp_path):
+        assert score_page_image(_blank_page(tmp_path / "blank.png")) == 0
+        print("Blank page scores zero")
+
+    def test_table_page_beats_text_page(self, tmp_path):
+        table = score_page_image(_table_page(tmp_path / "table.png"))
+        text = score_page_image(_text_page(tmp_path / "text.png"))
+        assert table > text > 0
+        print("Table page outscores plain text page")
+
+
+class TestSelectInvoicePages:
+    """Test choosing which pages go into the vision call"""
+
+    def test_returns_all_pages_under_cap(self, tmp_path):
+        pages = [_text_page(tmp_path / f"p{i}.png") for i in range(3)]
+        assert select_invoice_pages(pages, max_pages=4) == pages
+        print("All pages kept when under the cap")
+
+    def test_cap_is_respected_and_order_kept(self, tmp_path):
+        pages = [
+            _text_page(tmp_path / "p0.png"),
+            _blank_page(tmp_path / "p1.png"),
+            _text_page(tmp_path / "p2.png", lines=2),
+            _table_page(tmp_path / "p3.png"),
+            _table_page(tmp_path / "p4.png", rows=4),
+        ]
+        selected = select_invoice_pages(pages, max_pages=3)
+
+        assert selected == [pages[0], pages[3], pages[4]]
+        print("First, last and best table page selected in order")
+
+    def test_blank_pages_are_dropped(self, tmp_path):
+        pages = [
+            _table_page(tmp_path / "p0.png"),
+            _blank_page(tmp_path / "p1.png"),
+            _blank_page(tmp_path / "p2.png"),
+        ]
+        assert select_invoice_pages(pages, max_pages=2) == [pages[0]]
+        print("Blank pages not sent to the model")
+
+
+class TestMultiPageAiInvoice:
+    """Test that ai_invoice sends every selected page in one request"""
+
+    def _make_mock_client(self):
+        mock_client = MagicMock()
+        mock_client.files.create.side_effect = [
+            MagicMock(id=f"file-{i}") for i in range(10)
+        ]
+        mock_response = MagicMock()
+        mock_response.output_parsed = InvoiceData(
+            vendor_display_name="Scan Supply",
+            line_items=[InvoiceLine(item="Pipe", rate=10.0, quantity=2)],
+            total_amount=20.0,
+        )
+        mock_client.responses.parse.return_value = mock_response
+        return mock_client
+
+    def test_single_file_path_still_supported(self, tmp_path):
+        client = self._make_mock_client()
+        draft = ai_invoice("receipt", file_path=_text_page(tmp_path / "r.png"), client=client)
+
+        assert draft.vendor_display_name == "Scan Supply"
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        images = [part for part in content if part["type"] == "input_image"]
+        assert len(images) == 1
+        print("Single image path still works")
+
+    def test_pages_sent_in_one_call(self, tmp_path):
+        client = self._make_mock_client()
+        pages = [_table_page(tmp_path / f"p{i}.png") for i in range(3)]
+
+        ai_invoice("scanned invoice", page_paths=pages, client=client)
+
+        assert client.responses.parse.call_count == 1
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        images = [part for part in content if part["type"] == "input_image"]
+        assert len(images) == 3
+        assert "3 images are pages of the SAME document" in content[0]["text"]
+        print("Three pages sent in a single vision call")
+
+    def test_page_cap_limits_uploads(self, tmp_path):
+        client = self._make_mock_client()
+        pages = [_table_page(tmp_path / f"p{i}.png") for i in range(6)]
+
+        ai_invoice("long scan", page_paths=pages, client=client, max_pages=2)
+
+        content = client.responses.parse.call_args.kwargs["input"][-1]["content"]
+        images = [part for part in content if part["type"] == "input_image"]
+        assert len(images) == 2
+        print("Page cap limits images sent")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])